@@ -10,17 +10,23 @@ except Exception as e:
     print(f"[ERROR] Failed to init gRPC Gevent: {e}")
 
 from flask import Flask, render_template, request, redirect, url_for, session, jsonify
-from flask_socketio import SocketIO, emit
+from flask_socketio import SocketIO, emit, join_room, leave_room, rooms
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime, timedelta
 import json
-import difflib
+import os
+import atexit
 import pandas as pd
-import math
+from dotenv import load_dotenv
+load_dotenv() # Load .env file (before config reads DATABASE_URL etc.)
+
+# One-off scripts that import app (compact_history.py) set BACKGROUND_TASKS=0:
+# no Firebase, announcement listener or background greenlets
+BACKGROUND_TASKS = os.environ.get('BACKGROUND_TASKS', '1') != '0'
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'secret!'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///buses.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///buses.db') # Benchmarks point this at a scratch DB
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 db = SQLAlchemy(app)
@@ -28,20 +34,25 @@ socketio = SocketIO(app, cors_allowed_origins="*")
 
 # --- Extensions & Blueprints ---
 import server.extensions # Import module to access f_db dynamically
-server.extensions.init_firebase()
+if BACKGROUND_TASKS:
+    server.extensions.init_firebase()
+from server import metrics
+metrics.init_app(app, db) # /metrics, HTTP + DB commit timing
+from server.profiling import Profiler
+profiler = Profiler()
+profiler.init_app(app) # cProfile capture hooks (armed from /api/admin/profile)
 from firebase_admin import messaging
 
 from routes.schedule import schedule_bp
 from routes.contact import contact_bp
 from routes.admin import admin_bp # NEW
+from routes.eta import eta_bp
 app.register_blueprint(schedule_bp)
 app.register_blueprint(contact_bp)
 app.register_blueprint(admin_bp) # NEW
+app.register_blueprint(eta_bp)
 
 # --- AI & Other Imports ---
-import os
-from dotenv import load_dotenv
-load_dotenv() # Load .env file
 from groq import Groq
 
 # Initialize Groq (Llama 3)
@@ -55,15 +66,16 @@ def call_groq(prompt, system_prompt="You are a helpful assistant."):
         raise Exception("GROQ_API_KEY not set")
     
     try:
-        completion = groq_client.chat.completions.create(
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": prompt}
-            ],
-            model="llama-3.1-8b-instant",
-            temperature=0.5,
-            max_tokens=200,
-        )
+        with metrics.external_call('groq', 'chat_completion'):
+            completion = groq_client.chat.completions.create(
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": prompt}
+                ],
+                model="llama-3.1-8b-instant",
+                temperature=0.5,
+                max_tokens=200,
+            )
         return completion.choices[0].message.content
     except Exception as e:
         print(f"[ERROR] Groq API Error: {e}")
@@ -93,10 +105,23 @@ class Bus(db.Model):
 
 class LocationHistory(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    bus_no = db.Column(db.String(20))
+    bus_no = db.Column(db.String(20), index=True)
     lat = db.Column(db.Float)
     lng = db.Column(db.Float)
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+class HistoryPartition(db.Model):
+    """One bus-day of compacted LocationHistory (see server/history_store.py)"""
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.String(10), index=True) # YYYY-MM-DD (UTC)
+    bus_no = db.Column(db.String(20), index=True)
+    point_count = db.Column(db.Integer, default=0)
+    raw_count = db.Column(db.Integer, default=0)
+    resolution_s = db.Column(db.Integer, default=0) # 0 = full resolution
+    t0 = db.Column(db.Integer) # Epoch seconds of the first point
+    data = db.Column(db.LargeBinary)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    __table_args__ = (db.UniqueConstraint('day', 'bus_no', name='uq_history_partition_day_bus'),)
 
 class StopRequest(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -112,6 +137,59 @@ class StopRequest(db.Model):
 with app.app_context():
     db.create_all()
 
+# --- Live Fleet State (in-memory, write-behind to SQLite) ---
+from server.fleet_state import FleetStateStore, bus_entry
+from server.broadcast import BroadcastScheduler
+from server.viewport import ViewportRouter, parse_bounds
+from server.history_ingest import HistoryIngestQueue
+from server.history_store import HistoryStore
+from server.trajectory import TrajectoryCompressor
+from server.geofence import GeofenceEngine
+from server.stop_index import StopIndex
+from server import trigram_index, autocomplete
+from server.query_cache import QueryCache
+from server.typo_index import TypoIndex, ranked_search
+from server.variant_index import VariantIndex
+from server.wire import encode_frame, json_size, WireStats, FrameTooLarge
+from server.ingress import IngressFilter
+from server.map_matching import MapMatcher
+from server.eta import EtaEngine, REFRESH_S as ETA_REFRESH_S
+fleet_store = FleetStateStore()
+with app.app_context():
+    fleet_store.load(Bus)
+metrics.GaugeFunc(metrics.REGISTRY, 'active_buses', 'Buses with a live driver', fleet_store.active_count)
+metrics.GaugeFunc(metrics.REGISTRY, 'event_loop_lag_seconds', 'Last measured gevent hub wake-up lag',
+                  profiler.loop_lag.current)
+
+# Snaps live fixes to route polylines (progress_m / next_stop / off_route_m)
+map_matcher = MapMatcher()
+# Learned stop-to-stop travel times, refreshed from LocationHistory by refresh_eta
+eta_engine = EtaEngine(map_matcher)
+
+# Stop requests + arrival/departure state (write-behind to StopRequest)
+geofence = GeofenceEngine()
+with app.app_context():
+    geofence.load(StopRequest)
+
+# GPS history is queued here and bulk-inserted by write_location_history
+history_queue = HistoryIngestQueue()
+# Dead-band + adaptive ping rate for incoming driver fixes
+ingress = IngressFilter()
+
+# Per-bus track simplifier in front of the queue
+trajectory = TrajectoryCompressor()
+
+def queue_history(rows):
+    for row in rows:
+        history_queue.push(row)
+
+HISTORY_COMPACT_INTERVAL = float(os.environ.get('HISTORY_COMPACT_INTERVAL', 6 * 3600)) # 0 = manual only
+
+# Cold history is compacted into per-day partitions (compact_history.py)
+history_store = HistoryStore(db, LocationHistory, HistoryPartition)
+with app.app_context():
+    history_store.ensure_indexes()
+
 # --- Helper Functions ---
 def get_recommendations(user_id):
     # Placeholder - Recommendations temporarily disabled during migration
@@ -176,13 +254,22 @@ except Exception as e:
 
 ROUTES_CACHE = {}
 
-def build_routes():
-    """Reads Excel and builds a dictionary of routes."""
+# Search responses keyed on (query, data version); see server/query_cache.py
+query_cache = QueryCache()
+server.extensions.query_cache = query_cache
+metrics.GaugeFunc(metrics.REGISTRY, 'query_cache_bytes', 'Bytes of cached search responses',
+                  lambda: query_cache.bytes)
+metrics.GaugeFunc(metrics.REGISTRY, 'query_cache_hit_ratio', 'Search cache hits / lookups',
+                  lambda: query_cache.stats()['hit_rate'])
+
+def build_routes(excel_path=None):
+    """Reads Excel and builds a dictionary of routes (default: data/bus_routes.xlsx)."""
     global ROUTES_CACHE
     try:
         # FIXED: Use absolute path for reliability
-        base_dir = os.path.dirname(os.path.abspath(__file__))
-        excel_path = os.path.join(base_dir, "data", "bus_routes.xlsx")
+        if excel_path is None:
+            base_dir = os.path.dirname(os.path.abspath(__file__))
+            excel_path = os.path.join(base_dir, "data", "bus_routes.xlsx")
         
         if not os.path.exists(excel_path):
             print(f"[WARN] Route file not found: {excel_path}")
@@ -204,6 +291,19 @@ def build_routes():
             }
         
         ROUTES_CACHE = routes
+        server.extensions.ROUTES_CACHE = routes
+        geofence.set_routes(routes)
+        fleet_store.set_routes(routes)
+        map_matcher.set_routes(routes)
+        eta_engine.rebuild_all()
+        # Build fully, then swap the reference (readers never see a partial index)
+        server.extensions.stop_index = StopIndex(routes)
+        stop_search = trigram_index.from_routes(routes)
+        stop_search.typos = TypoIndex(stop_search.names)
+        stop_search.variants = VariantIndex(stop_search.names)
+        server.extensions.stop_search = stop_search
+        server.extensions.autocomplete = autocomplete.from_routes(routes, geofence.demand_by_stop())
+        server.extensions.routes_version += 1 # Invalidates cached search results
         print(f"[INFO] Loaded {len(routes)} routes from {excel_path}")
     except Exception as e:
         print(f"[ERROR] Failed to load routes: {e}")
@@ -215,15 +315,39 @@ build_routes()
 server.extensions.StopRequest = StopRequest
 server.extensions.ROUTES_CACHE = ROUTES_CACHE
 server.extensions.db = db
+server.extensions.fleet_store = fleet_store
+server.extensions.eta_engine = eta_engine
+server.extensions.profiler = profiler
 
 @app.route('/api/debug/status')
 def debug_status():
     """Debug endpoint to check server health"""
+    try:
+        history_storage = history_store.stats()
+    except Exception as e:
+        history_storage = {"error": str(e)}
     return jsonify({
         "routes_loaded": len(ROUTES_CACHE),
         "routes_keys": list(ROUTES_CACHE.keys())[:5], # Show first 5 buses
-        "map_active_buses": len(Bus.query.filter_by(is_active=True).all()),
-        "search_engine_active": bool(search_engine)
+        "map_active_buses": fleet_store.active_count(),
+        "search_engine_active": bool(search_engine),
+        "fleet_store": fleet_store.stats(),
+        "history_ingest": history_queue.stats(),
+        "ingress": ingress.stats(),
+        "trajectory": trajectory.stats(),
+        "geofence": geofence.stats(),
+        "map_matching": map_matcher.stats(),
+        "eta": eta_engine.stats(),
+        "stop_index": server.extensions.stop_index.stats() if server.extensions.stop_index else None,
+        "stop_search": server.extensions.stop_search.stats() if server.extensions.stop_search else None,
+        "autocomplete": server.extensions.autocomplete.stats() if server.extensions.autocomplete else None,
+        "query_cache": query_cache.stats(),
+        "history_storage": history_storage,
+        "broadcast": broadcast_scheduler.stats(),
+        "viewports": viewport_router.stats(),
+        "wire": wire_stats.stats(),
+        "metrics": metrics.REGISTRY.stats(),
+        "profiling": profiler.stats()
     })
 
 @app.route('/api/routes/<bus_no>')
@@ -246,6 +370,9 @@ def get_route(bus_no):
 
     return route
 
+# Results per /api/search_stops call (?k= overrides, up to 100)
+SEARCH_MAX_RESULTS = int(os.environ.get('SEARCH_MAX_RESULTS', 20))
+
 @app.route('/api/search_stops')
 def search_stops():
     query = request.args.get('q', '').lower().strip()
@@ -259,70 +386,32 @@ def search_stops():
         build_routes()
 
 
-    # 1. Gather all unique stops and their buses
-    stop_map = {} # "Stop Name" -> Set(Bus Numbers)
-    # 1. Gather all unique stop names
-    all_stops = set()
-    for route in ROUTES_CACHE.values():
-        for stop in route['stops']:
-            all_stops.add(stop['stop_name'])
-    
-    unique_stops = list(all_stops)
-    
-    # 2. Find matches - "Google-like" Priority
-    matches = []
-    
-    # Priority 1: Starts With (Case Insensitive)
-    starts_with = [s for s in unique_stops if s.lower().startswith(query)]
-    starts_with.sort() # Alphabetical
-    
-    # Priority 2: Contains (Case Insensitive)
-    contains = [s for s in unique_stops if query in s.lower() and s not in starts_with]
-    contains.sort()
-    
-    matches.extend(starts_with)
-    matches.extend(contains)
-
-    # Priority 3: Fuzzy Match (Approximate)
-    # Enable for shorter queries too to handle "simr" -> "similar"
-    if len(query) >= 2:
-        # Create map for case-insensitive fuzzy matching
-        # "kiit" -> "KIIT Campus 6"
-        lower_map = {s.lower(): s for s in unique_stops}
-        
-        # Get close matches against LOWER case keys
-        fuzzy_sims = difflib.get_close_matches(query, lower_map.keys(), n=5, cutoff=0.4)
-        
-        for sim in fuzzy_sims:
-            original_name = lower_map[sim]
-            if original_name not in matches:
-                matches.append(original_name)
+    try:
+        k = min(max(int(request.args.get('k', SEARCH_MAX_RESULTS)), 1), 100)
+    except ValueError:
+        k = SEARCH_MAX_RESULTS
 
-    print(f"[DEBUG] Search '{query}' -> Found Stops: {len(matches)}")
+    version = server.extensions.routes_version
+    cache_key = (trigram_index.normalize(query), k)
+    body = query_cache.get('search_stops', version, cache_key)
+    if body is not None:
+        return app.response_class(body, mimetype='application/json')
 
-    # 3. Map Stops -> Buses
-    results = []
-    seen_stops = set()
+    # "Google-like" priority: starts with, contains, spelling variants, typo-tolerant tokens, then fuzzy
+    stop_search = server.extensions.stop_search
+    matches = ranked_search(stop_search, stop_search.typos, query, k=k, cutoff=0.4,
+                            variants=stop_search.variants) if stop_search else []
 
-    for stop_name in matches:
-        if stop_name in seen_stops: continue
-        seen_stops.add(stop_name)
-        
-        relevant_buses = []
-        for bus_no, route in ROUTES_CACHE.items():
-            # Check if this bus stops here
-            if any(s['stop_name'] == stop_name for s in route['stops']):
-                relevant_buses.append(str(bus_no)) # Ensure string for frontend
-        
-        # Sort buses numerically if possible
-        relevant_buses.sort(key=lambda x: int(x) if x.isdigit() else 999)
+    print(f"[DEBUG] Search '{query}' -> Found Stops: {len(matches)}")
 
-        results.append({
-            "stop_name": stop_name,
-            "buses": relevant_buses
-        })
+    results = [{
+        "stop_name": stop_search.names[i],
+        "buses": stop_search.payloads[i]
+    } for i, _, _ in matches]
     
-    return jsonify(results)
+    response = jsonify(results)
+    query_cache.put('search_stops', version, cache_key, response.get_data())
+    return response
 
 
 @app.route('/api/chat', methods=['POST'])
@@ -402,7 +491,7 @@ def chat():
     ### 1. INTELLIGENT SEARCH BAR
     *   **Logic:** The search bar uses a **hybrid matching algorithm**.
         -   **Frontend:** As you type, it floats an overlay over the map.
-        -   **Backend:** It queries `/api/search_stops` which uses Python's `difflib` for **fuzzy matching** (e.g., "kit campus" matches "KIIT Campus 6").
+        -   **Backend:** It queries `/api/search_stops` which uses a **trigram index** for **fuzzy matching** (e.g., "kit campus" matches "KIIT Campus 6").
     *   **Auto-Locate Action:** When you select a result:
         1.  The app first checks if the bus is **already visible** in the sidebar.
         2.  If yes, it programmatically **clicks the "Locate" button** for you.
@@ -438,7 +527,7 @@ def chat():
         -   `targetBusNo` (String): The bus currently being tracked.
         -   `markers` (Object): Stores L.marker instances by busId.
         -   `stopMarkers` (Object): Stores circular L.marker instances for bus stops.
-        -   `lastBusData` (Object): The latest payload from `update_buses` socket event.
+        -   `lastBusData` (Object): The fleet view built from `fleet_snapshot` + `bus_delta` socket events.
     *   **Key Functions:**
         -   `initMap()`: Initializes Leaflet map, User Icon (SVG), and Socket listeners.
         -   `startTrackingRouteByBusNo(busNo)`: 
@@ -456,7 +545,7 @@ def chat():
         -   `StopRequest`: { `bus_no`, `stop_name`, `count`, `is_arrived` }
         -   `Bus`: { `bus_no`, `lat`, `lng`, `speed`, `is_active` }
     *   **API Endpoints:**
-        -   `GET /api/search_stops?q=...`: Uses `difflib.get_close_matches` to find stops.
+        -   `GET /api/search_stops?q=...`: Ranks prefix, substring, then trigram fuzzy matches (top-k).
         -   `GET /api/routes/<bus_no>`: Returns `{ path: [[lat,lng]...], stops: [...] }`.
     *   **Socket Logic (`handle_driver_update`):**
         -   Updates `Bus` table.
@@ -473,11 +562,11 @@ def chat():
        ```javascript
        const distTraveledMeters = (speedKmph * (now - lastTime) / 3600000) * 1000;
        ```
-    2. **Haversine Distance (Python):**
+    2. **Haversine Distance (Python, `server/geofence.py`):**
        ```python
-       def haversine(lat1, lon1, lat2, lon2):
-           # R = 6371000 meters
-           # Standard sphere formula
+       StopSet.distances(lat, lng)
+           # EARTH_R = 6371000 meters
+           # Vectorized sphere formula over every stop of the bus
        ```
 
     --- YOUR BEHAVIOR ---
@@ -492,21 +581,22 @@ def chat():
     """
 
     try:
-        chat_completion = groq_client.chat.completions.create(
-            messages=[
-                {
-                    "role": "system",
-                    "content": system_prompt
-                },
-                {
-                    "role": "user",
-                    "content": user_msg
-                }
-            ],
-            model="llama-3.1-8b-instant",
-            temperature=0.5,
-            max_tokens=150,
-        )
+        with metrics.external_call('groq', 'student_chat'):
+            chat_completion = groq_client.chat.completions.create(
+                messages=[
+                    {
+                        "role": "system",
+                        "content": system_prompt
+                    },
+                    {
+                        "role": "user",
+                        "content": user_msg
+                    }
+                ],
+                model="llama-3.1-8b-instant",
+                temperature=0.5,
+                max_tokens=150,
+            )
         ai_response = chat_completion.choices[0].message.content
         return {"response": ai_response}
     except Exception as e:
@@ -535,15 +625,16 @@ def driver_ai_assist():
     """
 
     try:
-        completion = groq_client.chat.completions.create(
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": raw_text}
-            ],
-            model="llama-3.1-8b-instant",
-            temperature=0.5,
-            max_tokens=100,
-        )
+        with metrics.external_call('groq', 'driver_ai_assist'):
+            completion = groq_client.chat.completions.create(
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": raw_text}
+                ],
+                model="llama-3.1-8b-instant",
+                temperature=0.5,
+                max_tokens=100,
+            )
         response_text = completion.choices[0].message.content
         return {"response": response_text.strip()}
     except Exception as e:
@@ -570,15 +661,16 @@ def driver_chat():
     """
 
     try:
-        completion = groq_client.chat.completions.create(
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_msg}
-            ],
-            model="llama-3.1-8b-instant",
-            temperature=0.7,
-            max_tokens=150,
-        )
+        with metrics.external_call('groq', 'driver_chat'):
+            completion = groq_client.chat.completions.create(
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_msg}
+                ],
+                model="llama-3.1-8b-instant",
+                temperature=0.7,
+                max_tokens=150,
+            )
         response_text = completion.choices[0].message.content
         return {"response": response_text.strip()}
     except Exception as e:
@@ -603,72 +695,8 @@ def subscribe_to_topic():
 # --- Socket Events ---
 
 def get_active_buses_payload():
-    # Fetch ALL buses to ensure we capture ad-hoc ones that went offline
-    all_buses_db = Bus.query.all()
-    payload = {}
-    
-    active_bus_nos = set()
-
-    # 1. Process DB Buses (Active & Inactive)
-    for b in all_buses_db:
-        if b.is_active:
-            active_bus_nos.add(b.bus_no)
-            payload[b.sid] = {
-                'bus_no': b.bus_no,
-                'lat': b.lat,
-                'lng': b.lng,
-                'accuracy': b.accuracy,
-                'speed': b.speed,
-                'heading': b.heading,
-                'crowd': b.crowd_status or 'LOW',
-                'type': b.bus_type or 'HOSTEL', # NEW FIELD
-                'driver_name': b.driver_name or 'Driver', # NEW FIELD
-                'last_updated': b.last_updated.isoformat() if b.last_updated else None,
-                'offline': False
-            }
-        else:
-            # It's an inactive bus from DB (Ad-hoc or regular)
-            # We want to show it as Offline
-            dummy_sid = f"OFFLINE_DB_{b.bus_no}"
-            payload[dummy_sid] = {
-                'bus_no': b.bus_no,
-                'lat': b.lat,
-                'lng': b.lng,
-                'speed': 0,
-                'crowd': 'LOW',
-                'last_updated': b.last_updated.isoformat() if b.last_updated else None,
-                'offline': True
-            }
-
-    # 2. Add via Excel Cache (if not already in DB list)
-    # This covers buses that have routes but have NEVER been driven yet
-    for bus_no, route_data in ROUTES_CACHE.items():
-        # Check if we already have this bus from DB (Active or Inactive)
-        # We need to check against all DB buses, not just active ones
-        is_known = False
-        for db_bus in all_buses_db:
-            if db_bus.bus_no == bus_no:
-                is_known = True
-                break
-        
-        if not is_known:
-            start_lat = 0
-            start_lng = 0
-            if route_data.get('stops'):
-                start_lat = route_data['stops'][0]['lat']
-                start_lng = route_data['stops'][0]['lng']
-            
-            dummy_sid = f"OFFLINE_STATIC_{bus_no}"
-            payload[dummy_sid] = {
-                'bus_no': bus_no,
-                'lat': start_lat,
-                'lng': start_lng,
-                'speed': 0,
-                'crowd': 'LOW',
-                'offline': True
-            }
-            
-    return payload
+    """Full fleet view (key -> entry), cached in the store until something changes."""
+    return fleet_store.payload()
 
 @socketio.on('search_bus')
 def handle_search(bus_no):
@@ -679,43 +707,218 @@ def handle_search(bus_no):
     #     db.session.commit()
     
     # Check bus status
-    bus = Bus.query.filter_by(bus_no=bus_no).first()
+    bus = fleet_store.get(bus_no)
     if bus:
-        if bus.is_active:
+        if bus['is_active']:
              emit('search_result', {'status': 'active', 'bus_no': bus_no})
         else:
              # Return offline info
-             last_seen = bus.last_updated.strftime("%H:%M")
+             last_seen = bus['last_updated'].strftime("%H:%M") if bus['last_updated'] else None
              emit('search_result', {'status': 'offline', 'bus_no': bus_no, 'last_seen': last_seen})
     else:
         emit('search_result', {'status': 'not_found'})
 
-@socketio.on('connect')
-def handle_connect():
-    emit('update_buses', get_active_buses_payload())
-    
-    # Send initial stop counts
-    active_stops = StopRequest.query.filter(StopRequest.count > 0).all()
-    for s in active_stops:
+def get_fleet_snapshot():
+    """Full fleet view stamped with the sequence number deltas build on."""
+    return fleet_store.snapshot()
+
+# --- Fleet Subscriptions ---
+# Every socket starts in FLEET_ROOM (global bus_delta frames). Sockets that
+# send their map bounds move to the viewport router and get per-socket frames.
+FLEET_ROOM = 'fleet'
+FLEET_BIN_ROOM = 'fleet:bin' # Same feed, binary encoded (see server/wire.py)
+viewport_router = ViewportRouter()
+viewport_router.reset(get_active_buses_payload()) # Seed with the startup fleet view
+
+# Sockets that negotiated the compact binary encoding via set_encoding
+binary_sids = set()
+wire_stats = WireStats()
+
+def fleet_room(sid):
+    return FLEET_BIN_ROOM if sid in binary_sids else FLEET_ROOM
+
+def encode_or_none(frame, snapshot=False):
+    """Binary frame, or None when it does not fit the wire format (send JSON)."""
+    try:
+        return encode_frame(frame, snapshot=snapshot)
+    except FrameTooLarge as e:
+        print(f"[WARN] Binary fleet frame skipped, sending JSON: {e}")
+        return None
+
+def send_fleet(event, frame, sid):
+    """Emit 'fleet_snapshot' / 'bus_delta' to one socket in its negotiated encoding."""
+    packed = encode_or_none(frame, snapshot=(event == 'fleet_snapshot')) if sid in binary_sids else None
+    if packed is not None:
+        socketio.emit(event + '_bin', packed, to=sid)
+        wire_stats.count('binary')
+    else:
+        socketio.emit(event, frame, to=sid) # Binary clients also handle the JSON events
+        wire_stats.count('json')
+
+def send_fleet_frame(delta):
+    """Deliver one tick's delta: globally, then per viewport subscriber."""
+    socketio.emit('bus_delta', delta, to=FLEET_ROOM)
+    # Encode (and measure both sizes) only while binary clients take the global feed
+    if any(not viewport_router.is_subscribed(sid) for sid in binary_sids):
+        packed = encode_or_none(delta)
+        if packed is not None:
+            json_bytes = json_size(delta)
+            wire_stats.observe(json_bytes, len(packed))
+            metrics.BROADCAST_FRAME_BYTES.observe(json_bytes, 'json')
+            metrics.BROADCAST_FRAME_BYTES.observe(len(packed), 'binary')
+            socketio.emit('bus_delta_bin', packed, to=FLEET_BIN_ROOM)
+        else:
+            socketio.emit('bus_delta', delta, to=FLEET_BIN_ROOM)
+    for sid, frame in viewport_router.route_delta(delta).items():
+        send_fleet('bus_delta', frame, sid)
+
+# Driver updates are coalesced and sent once per tick (see broadcast_tick)
+broadcast_scheduler = BroadcastScheduler(fleet_store, send_fleet_frame)
+
+# --- Per-Bus Rooms ---
+# Drivers join their bus room when they start broadcasting; students join the
+# room of the bus they track. Student locations and stop events go only there.
+viewer_rooms = {} # student sid -> bus_no being tracked
+
+def bus_room(bus_no):
+    return f"bus:{str(bus_no).strip().upper()}"
+
+def emit_stop_counts(bus_no):
+    """Send current stop counts for one bus to the calling socket."""
+    for stop_name, req in geofence.pending(bus_no):
         emit('stop_update', {
-            'bus_no': s.bus_no,
-            'stop_name': s.stop_name,
-            'count': s.count,
-            'lat': s.lat,
-            'lng': s.lng
+            'bus_no': bus_no,
+            'stop_name': stop_name,
+            'count': req['count'],
+            'lat': req['lat'],
+            'lng': req['lng']
         })
 
+# Socket role (io({query: {role}})) per sid, for the sockets_connected gauge
+socket_roles = {}
+
+@socketio.on('connect')
+@metrics.timed_event('connect')
+def handle_connect(auth=None):
+    role = metrics.socket_role(request.args.get('role'))
+    socket_roles[request.sid] = role
+    metrics.SOCKETS_CONNECTED.inc(role)
+    join_room(FLEET_ROOM)
+    emit('fleet_snapshot', get_fleet_snapshot()) # JSON until the client negotiates
+    # Stop counts are sent when the socket joins a bus room (track_bus / driver_update)
+
+@socketio.on('subscribe_viewport')
+def handle_subscribe_viewport(data):
+    """
+    Client map bounds: { 'south': .., 'west': .., 'north': .., 'east': .. }
+    First call swaps the global feed for a viewport snapshot; later calls
+    (pan/zoom) get a frame with entering buses and 'left' keys.
+    """
+    bounds = parse_bounds(data or {})
+    if not bounds:
+        return
+    sid = request.sid
+    if not viewport_router.is_subscribed(sid):
+        leave_room(fleet_room(sid))
+        viewport_router.set_tracked(sid, viewer_rooms.get(sid))
+        viewport_router.subscribe(sid, bounds)
+        send_fleet('fleet_snapshot', viewport_router.snapshot(sid), sid)
+        return
+    frame = viewport_router.subscribe(sid, bounds)
+    if frame:
+        send_fleet('bus_delta', frame, sid)
+
+@socketio.on('unsubscribe_viewport')
+def handle_unsubscribe_viewport():
+    """Back to the global feed (whole fleet)."""
+    if viewport_router.is_subscribed(request.sid):
+        viewport_router.unsubscribe(request.sid)
+        join_room(fleet_room(request.sid))
+        send_fleet('fleet_snapshot', get_fleet_snapshot(), request.sid)
+
+@socketio.on('leave_fleet')
+def handle_leave_fleet():
+    """Sockets that never render buses (driver console) opt out of frames."""
+    viewport_router.unsubscribe(request.sid)
+    leave_room(FLEET_ROOM)
+    leave_room(FLEET_BIN_ROOM)
+
+@socketio.on('set_encoding')
+def handle_set_encoding(data):
+    """
+    Negotiate the fleet frame encoding: { 'encoding': 'binary' | 'json' }.
+    Binary clients get fleet_snapshot_bin / bus_delta_bin (ArrayBuffer).
+    """
+    sid = request.sid
+    encoding = (data or {}).get('encoding')
+    if encoding not in ('binary', 'json'):
+        encoding = 'json'
+    in_global = fleet_room(sid) in rooms()
+    if in_global:
+        leave_room(fleet_room(sid))
+    if encoding == 'binary':
+        binary_sids.add(sid)
+    else:
+        binary_sids.discard(sid)
+    if in_global:
+        join_room(fleet_room(sid))
+    emit('encoding', {'encoding': encoding})
+
+@socketio.on('track_bus')
+def handle_track_bus(data):
+    """Student started tracking a bus: move to that bus room."""
+    bus_no = (data or {}).get('bus_no')
+    if not bus_no:
+        return
+    previous = viewer_rooms.get(request.sid)
+    if previous == bus_no:
+        return
+    if previous:
+        leave_room(bus_room(previous))
+    join_room(bus_room(bus_no))
+    viewer_rooms[request.sid] = bus_no
+    emit_stop_counts(bus_no)
+
+    # Viewport subscribers always receive the bus they track
+    frame = viewport_router.set_tracked(request.sid, bus_no)
+    if frame:
+        send_fleet('bus_delta', frame, request.sid)
+
+@socketio.on('untrack_bus')
+def handle_untrack_bus():
+    previous = viewer_rooms.pop(request.sid, None)
+    if previous:
+        leave_room(bus_room(previous))
+        frame = viewport_router.set_tracked(request.sid, None)
+        if frame:
+            send_fleet('bus_delta', frame, request.sid)
+
 @socketio.on('get_buses')
 def handle_get_buses():
     """Manual request for bus data"""
-    emit('update_buses', get_active_buses_payload())
+    if viewport_router.is_subscribed(request.sid):
+        send_fleet('fleet_snapshot', viewport_router.snapshot(request.sid), request.sid)
+    else:
+        send_fleet('fleet_snapshot', get_fleet_snapshot(), request.sid)
+
+@socketio.on('fleet_resync')
+def handle_fleet_resync():
+    """Client detected a gap in bus_delta sequence numbers"""
+    handle_get_buses()
 
 @socketio.on('disconnect')
 def handle_disconnect():
-    bus = Bus.query.filter_by(sid=request.sid).first()
+    role = socket_roles.pop(request.sid, None)
+    if role:
+        metrics.SOCKETS_CONNECTED.dec(role)
+    viewer_rooms.pop(request.sid, None) # Rooms themselves are cleared by Socket.IO
+    binary_sids.discard(request.sid)
+    viewport_router.unsubscribe(request.sid)
+    bus = fleet_store.deactivate_sid(request.sid)
+    ingress.forget(request.sid, bus['bus_no'] if bus else None)
     if bus:
-        bus.is_active = False
-        db.session.commit()
+        map_matcher.forget(bus['bus_no'])
+        queue_history(trajectory.finish(bus['bus_no']))
         emit('bus_disconnected', request.sid, broadcast=True)
         # Optional: Broadcast full list to clear marker immediately if needed, 
         # but bus_disconnected event is efficient for removal.
@@ -724,117 +927,86 @@ def handle_disconnect():
         # unless user reports issues.
 
 @socketio.on('driver_update')
+@metrics.timed_event('driver_update')
 def handle_driver_update(data):
     sid = request.sid
     if data is None:
         # Driver stopped session manually
-        bus = Bus.query.filter_by(sid=sid).first()
+        bus = fleet_store.deactivate_sid(sid)
+        ingress.forget(sid, bus['bus_no'] if bus else None)
         if bus:
-            bus.is_active = False
-            db.session.commit()
+            map_matcher.forget(bus['bus_no'])
+            queue_history(trajectory.finish(bus['bus_no']))
+            leave_room(bus_room(bus['bus_no']))
             emit('bus_disconnected', sid, broadcast=True)
-            # FORCE SYNC: Broadcast full list to ensure removal
-            emit('update_buses', get_active_buses_payload(), broadcast=True)
+            # SYNC: Next tick's delta moves the bus to its offline entry
         return
 
     bus_no = data.get('bus_no')
-    bus = Bus.query.filter_by(bus_no=bus_no).first()
-    if not bus:
-        bus = Bus(bus_no=bus_no)
-        db.session.add(bus)
-    
-    bus.sid = sid
-    bus.lat = data.get('lat')
-    bus.lng = data.get('lng')
-    bus.accuracy = data.get('accuracy')
-    bus.speed = data.get('speed')
-    bus.heading = data.get('heading')
-    bus.crowd_status = data.get('crowd', 'LOW')
-    bus.bus_type = data.get('type', 'HOSTEL') 
-    bus.driver_name = data.get('driver_name') # NEW FIELD
-    bus.is_active = True
-    bus.last_updated = datetime.utcnow()
-
-    # Log History
-    history = LocationHistory(
-        bus_no=bus_no, 
-        lat=data.get('lat'), 
-        lng=data.get('lng')
-    )
-    db.session.add(history)
-    
-    db.session.commit()
-
-    # --- Geofence Logic for Stop Reset ---
-    # Check active requests for this bus
-    active_requests = StopRequest.query.filter_by(bus_no=bus_no).all()
-    for req in active_requests:
-        if req.lat and req.lng:
-            dist = haversine(bus.lat, bus.lng, req.lat, req.lng)
-            
-            # 1. Arrival (< 50m)
-            if dist < 50 and not req.is_arrived:
-                req.is_arrived = True
-                db.session.commit()
-                # Optional: specific event for arrival
-            
-            # 2. Departure (> 100m) AND was arrived -> RESET
-            elif dist > 100 and req.is_arrived:
-                if req.count > 0:
-                    req.count = 0
-                    req.is_arrived = False
-                    db.session.commit()
-                    emit('stop_reset', {'bus_no': bus_no, 'stop_name': req.stop_name}, broadcast=True)
-    
-    # BROADCAST FULL STATE
-    emit('update_buses', get_active_buses_payload(), broadcast=True)
+
+    # Join this bus room when the session starts (or the bus number changes)
+    previous = fleet_store.sid_to_bus.get(sid)
+    if previous != bus_no:
+        if previous:
+            leave_room(bus_room(previous))
+            queue_history(trajectory.finish(previous))
+        join_room(bus_room(bus_no))
+        emit_stop_counts(bus_no)
+
+    # Dead-band: insignificant fixes are dropped (a new session always passes)
+    significant = ingress.accept(bus_no, data, force=(previous != bus_no))
+    interval_ms = ingress.instruction(sid, bus_no, loaded=broadcast_scheduler.is_loaded())
+    if interval_ms:
+        emit('ping_interval', {'interval_ms': interval_ms})
+    if not significant:
+        return
+
+    # Snap to the route line, then update live state
+    # (Bus snapshot is persisted by flush_fleet_state)
+    match = map_matcher.match(bus_no, data.get('lat'), data.get('lng'))
+    bus = fleet_store.update_from_driver(sid, data, match)
+
+    # Log History: only fixes the simplifier keeps reach the queue
+    queue_history(trajectory.add(bus_no, bus['last_updated'], bus['lat'], bus['lng']))
+
+    # --- Geofence: arrival (< 50m) / departure (> 100m) in memory ---
+    for event, payload in geofence.evaluate(bus_no, bus['lat'], bus['lng']):
+        emit(event, payload, to=bus_room(bus_no))
+
+    # Changed fields go out with the next broadcast tick
 
 @socketio.on('student_update')
+@metrics.timed_event('student_update')
 def handle_student_update(data):
     """
     Relays student location to drivers.
     Data: { 'bus_no': '42', 'lat': ..., 'lng': ... }
     """
-    print(f"[DEBUG] Received student_update: {data}")
+    bus_no = data.get('bus_no')
+    if not bus_no:
+        return
     # Attach the student's socket ID so the driver can track unique students
     data['id'] = request.sid
-    # Broadcast to everyone (Drivers will filter by bus_no)
-    emit('student_location_update', data, broadcast=True)
+    # Only sockets in this bus room (its driver + students tracking it)
+    emit('student_location_update', data, to=bus_room(bus_no), include_self=False)
 
 @socketio.on('request_stop')
+@metrics.timed_event('request_stop')
 def handle_stop_request(data):
     bus_no = data.get('bus_no')
     stop_name = data.get('stop_name')
     lat = data.get('lat')
     lng = data.get('lng')
 
-    req = StopRequest.query.filter_by(bus_no=bus_no, stop_name=stop_name).first()
-    if not req:
-        req = StopRequest(bus_no=bus_no, stop_name=stop_name, lat=lat, lng=lng, count=0)
-        db.session.add(req)
-
-    req.count += 1
-    req.last_updated = datetime.utcnow()
-    db.session.commit()
+    req = geofence.request(bus_no, stop_name, lat, lng)
 
     emit('stop_update', {
         'bus_no': bus_no,
         'stop_name': stop_name,
-        'count': req.count,
+        'count': req['count'],
         'lat': lat,
         'lng': lng
-    }, broadcast=True)
-
-def haversine(lat1, lon1, lat2, lon2):
-    R = 6371000  # meters
-    phi1 = math.radians(lat1)
-    phi2 = math.radians(lat2)
-    dphi = math.radians(lat2 - lat1)
-    dlambda = math.radians(lon2 - lon1)
-    
-    a = math.sin(dphi/2)**2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda/2)**2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-    return R * c
+    }, to=bus_room(bus_no))
 
 # --- Background Listener for Announcements ---
 def listen_for_announcements():
@@ -941,60 +1113,117 @@ def send_multicast_notification(title_bus, body_text):
             },
             topic=topic,
         )
-        response = messaging.send(message)
+        with metrics.external_call('fcm', 'announcement'):
+            response = messaging.send(message)
         print('Successfully sent message:', response)
     except Exception as e:
         print('Error sending message:', e)
 
 # Start listener in a background thread (Only in the reloader child process or production)
-if os.environ.get('WERKZEUG_RUN_MAIN') == 'true' or not app.debug:
+if BACKGROUND_TASKS and (os.environ.get('WERKZEUG_RUN_MAIN') == 'true' or not app.debug):
     gevent.spawn(listen_for_announcements)
 
 # --- NEW: Cancel Stop Request ---
 @socketio.on('cancel_stop')
+@metrics.timed_event('cancel_stop')
 def handle_cancel_stop(data):
     bus_no = data.get('bus_no')
     stop_name = data.get('stop_name')
     
-    stop_req = StopRequest.query.filter_by(bus_no=bus_no, stop_name=stop_name).first()
-    if stop_req and stop_req.count > 0:
-        stop_req.count -= 1
-        stop_req.last_updated = datetime.utcnow()
-        db.session.commit()
-        
+    stop_req = geofence.cancel(bus_no, stop_name)
+    if stop_req:
         emit('stop_update', {
             'bus_no': bus_no,
             'stop_name': stop_name,
-            'count': stop_req.count,
-            'lat': stop_req.lat,
-            'lng': stop_req.lng
-        }, broadcast=True)
+            'count': stop_req['count'],
+            'lat': stop_req['lat'],
+            'lng': stop_req['lng']
+        }, to=bus_room(bus_no))
 
 def cleanup_stale_requests():
     """Background task to reset counters older than 1 hour."""
     while True:
         try:
             socketio.sleep(60) # Check every minute
-            with app.app_context():
-                expiration_time = datetime.utcnow() - timedelta(hours=1)
-                stale_requests = StopRequest.query.filter(
-                    StopRequest.last_updated < expiration_time,
-                    StopRequest.count > 0
-                ).all()
-                
-                if stale_requests:
-                    print(f"[CLEANUP] Found {len(stale_requests)} stale requests. Resetting...")
-                    for req in stale_requests:
-                        req.count = 0
-                        req.is_arrived = False
-                        socketio.emit('stop_reset', {
-                            'bus_no': req.bus_no, 
-                            'stop_name': req.stop_name
-                        })
-                    db.session.commit()
+            expiration_time = datetime.utcnow() - timedelta(hours=1)
+            stale_requests = geofence.expire(expiration_time)
+
+            if stale_requests:
+                print(f"[CLEANUP] Found {len(stale_requests)} stale requests. Resetting...")
+                for bus_no, stop_name in stale_requests:
+                    socketio.emit('stop_reset', {
+                        'bus_no': bus_no,
+                        'stop_name': stop_name
+                    }, to=bus_room(bus_no))
         except Exception as e:
             print(f"[CLEANUP ERROR] {e}")
 
+def flush_fleet_state():
+    """Background task: write-behind persistence of the live fleet store."""
+    while True:
+        try:
+            socketio.sleep(fleet_store.flush_interval)
+            with app.app_context():
+                fleet_store.flush(db, Bus)
+                geofence.flush(db, StopRequest)
+        except Exception as e:
+            print(f"[FLUSH ERROR] {e}")
+
+def write_location_history():
+    """Background task: drain the history queue with bulk inserts."""
+    history_queue.run(app, db, LocationHistory)
+
+def compact_history():
+    """Background task: fold cold history into partitions and apply retention."""
+    while True:
+        try:
+            socketio.sleep(HISTORY_COMPACT_INTERVAL)
+            with app.app_context():
+                report = history_store.compact()
+            print(f"[INFO] History compaction: {report}")
+        except Exception as e:
+            print(f"[COMPACT ERROR] {e}")
+
+def refresh_eta():
+    """Background task: fold new LocationHistory rows into the ETA profiles."""
+    while True:
+        try:
+            with app.app_context():
+                eta_engine.refresh(db, LocationHistory, history_store, pause=socketio.sleep)
+        except Exception as e:
+            print(f"[ETA ERROR] {e}")
+        socketio.sleep(ETA_REFRESH_S)
+
+@atexit.register
+def flush_fleet_state_on_exit():
+    """Persist whatever is still queued when the worker shuts down."""
+    with app.app_context():
+        fleet_store.flush(db, Bus)
+        geofence.flush(db, StopRequest)
+        queue_history(trajectory.finish_all())
+        history_queue.flush(db, LocationHistory)
+
+def broadcast_tick():
+    """Background task: one coalesced bus_delta frame per tick."""
+    broadcast_scheduler.run(socketio.sleep)
+
+def measure_loop_lag():
+    """Background task: how late the hub wakes a sleeping greenlet."""
+    profiler.loop_lag.run(socketio.sleep)
+
+def start_background_tasks():
+    socketio.start_background_task(flush_fleet_state)
+    socketio.start_background_task(write_location_history)
+    socketio.start_background_task(broadcast_tick)
+    socketio.start_background_task(refresh_eta)
+    socketio.start_background_task(measure_loop_lag)
+    if HISTORY_COMPACT_INTERVAL > 0:
+        socketio.start_background_task(compact_history)
+
+# Flusher and tick must run under gunicorn too (not only via __main__)
+if BACKGROUND_TASKS and (os.environ.get('WERKZEUG_RUN_MAIN') == 'true' or not app.debug):
+    start_background_tasks()
+
 if __name__ == '__main__':
     socketio.start_background_task(cleanup_stale_requests)
     # Use PORT from environment for Render, default to 3000 locally
@@ -0,0 +1,61 @@
+"""
+Helpers shared by the benchmark scripts (percentiles, run metadata, result files).
+"""
+import json
+import math
+import os
+import platform
+import subprocess
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+
+
+def percentiles(values, ps=(50, 90, 95, 99)):
+    """Nearest-rank percentiles plus min/max/mean/count, rounded to 0.01."""
+    if not values:
+        return {}
+    v = sorted(values)
+    out = {f"p{p}": round(v[min(len(v) - 1, int(math.ceil(p / 100 * len(v))) - 1)], 2) for p in ps}
+    out.update(min=round(v[0], 2), max=round(v[-1], 2), mean=round(sum(v) / len(v), 2), count=len(v))
+    return out
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def run_info():
+    """Metadata stored with every result so runs can be compared across commits."""
+    return {
+        'timestamp': datetime.utcnow().isoformat() + 'Z',
+        'commit': git_commit(),
+        'host': {'python': platform.python_version(), 'platform': platform.platform(),
+                 'cpus': os.cpu_count()}
+    }
+
+
+def write_result(name, result, out=None):
+    """Write a result dict to `out` (default benchmarks/results/<name>-<ts>.json)."""
+    out = out or os.path.join(RESULTS_DIR, f"{name}-{datetime.utcnow():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump(result, f, indent=2, default=str)
+    return out
+
+
+def rss_bytes(pid='self'):
+    """Resident set size from /proc (0 where /proc is unavailable)."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
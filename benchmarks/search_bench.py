@@ -0,0 +1,560 @@
+"""
+Stop Search Benchmark
+
+Replays keystroke-by-keystroke query streams against both stop search paths:
+    search_stops   GET /api/search_stops (app.py, over ROUTES_CACHE)
+    search-stop    GET /api/search-stop  (routes/search.py, BusStopSearchEngine)
+
+Corpora are synthetic route workbooks (default 1k, 10k and 100k unique stops)
+built from Bhubaneswar/Cuttack-style place names, written once to
+benchmarks/data/ and reused. Query streams are generated per corpus and saved
+next to it, so the same streams can be replayed on another commit; --queries
+replays a recorded stream file instead. Each stream is the prefixes of what
+a user typed: the exact name, a transliteration variant (Vihar/Bihar,
+Chhak/Chowk, ...), a typo, or a dropped word.
+
+Reported per corpus and path:
+    latency     per-keystroke latency percentiles (ms), by typed length
+    memory      deep size of each path's index (ROUTES_CACHE / the search
+                engine's tables), load time, process RSS, and the
+                tracemalloc peak allocated by a full query
+    quality     recall@k of the expected stop on the full query and per
+                keystroke, MRR, and keystrokes typed before the first hit
+
+--compare-matchers skips the endpoints and compares the matchers directly on
+each stream's full query: the old difflib path (substring + get_close_matches,
+cutoff 0.4), the trigram index, the symmetric-delete typo index, the
+normalized-key (spelling variant) index, and the combined ranking the
+endpoints use. Reported: recall@k by query kind,
+latency percentiles and index build time.
+
+Streams file format (JSON): [{"expected": "<stop name>", "kind": "...",
+"keystrokes": ["p", "pa", "pat", ...]}, ...]
+
+Usage:
+    python benchmarks/search_bench.py                         # 1k, 10k, 100k
+    python benchmarks/search_bench.py --sizes 1000 --streams 100
+    python benchmarks/search_bench.py --workbook data/bus_routes.xlsx --queries streams.json
+    python benchmarks/search_bench.py --compare-matchers --sizes 1000,10000
+"""
+import argparse
+import contextlib
+import difflib
+import io
+import json
+import math
+import os
+import random
+import signal
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+
+from common import ROOT, percentiles, rss_bytes, run_info, write_result
+
+DATA_DIR = os.path.join(ROOT, 'benchmarks', 'data')
+
+# --- Synthetic corpus ---
+ROOTS = [
+    'Patia', 'Chandrasekharpur', 'Nayapalli', 'Saheed Nagar', 'Jaydev Vihar', 'Acharya Vihar',
+    'Vani Vihar', 'Rasulgarh', 'Khandagiri', 'Baramunda', 'Sundarpada', 'Jharpada', 'Pokhariput',
+    'Mancheswar', 'Kalpana', 'Bapuji Nagar', 'Kharavela Nagar', 'Unit 9', 'Old Town', 'Lingaraj',
+    'Rajarani', 'Bhimatangi', 'Gadakana', 'Damana', 'Infocity', 'Nandankanan', 'Raghunathpur',
+    'Tamando', 'Khurda', 'Jatni', 'Pahala', 'Phulnakhara', 'Badambadi', 'Buxi Bazaar',
+    'Tulsipur', 'Bidanasi', 'Jagatpur', 'Choudwar', 'Naraj', 'Kanan Vihar', 'Shailashree Vihar',
+    'Sailashree Vihar', 'Niladri Vihar', 'Gajapati Nagar', 'Satya Nagar', 'Ashok Nagar',
+    'Bomikhal', 'Palasuni', 'Lakshmisagar', 'Kapila Prasad', 'Siripur', 'Aiginia', 'Gangapada',
+    'Samantarapur', 'Dumduma', 'Sijua', 'Kalinga Nagar', 'Ghatikia', 'Kesura', 'Bhubaneswar',
+    'Cuttack', 'Barang', 'Balianta', 'Trisulia', 'Ranihat', 'Madhupatna', 'Mangalabag',
+    'Chauliaganj', 'Sikharpur', 'Mahanadi Vihar', 'Sector Nua', 'Kandarpur', 'Gopalpur',
+    'Dhenkanal Road', 'Bhagabatpur', 'Delta Square', 'Sishu Bhawan', 'Jayadev Nagar',
+]
+SUFFIXES = [
+    '', 'Square', 'Chhak', 'Chowk', 'Bus Stand', 'Market', 'Bazaar', 'Colony', 'Gate',
+    'Hospital', 'Temple', 'College', 'School', 'Police Station', 'Railway Station', 'Park',
+    'Road', 'Bridge', 'Petrol Pump', 'Post Office', 'Haat', 'Basti', 'Sahi', 'Main Road', 'Mandir',
+]
+PREFIXES = ['', '', '', 'New', 'Old', 'Upper', 'Lower', 'Sri', 'Maa', 'Kalinga']
+QUALIFIERS = ['Sector', 'Phase', 'Lane', 'Block', 'Gali', 'Plot']
+
+# Spelling variants people type for the same place (both directions are applied)
+VARIANTS = [
+    ('vihar', 'bihar'), ('chhak', 'chowk'), ('chhak', 'chak'), ('nagar', 'ngr'),
+    ('bazaar', 'bazar'), ('square', 'sq'), ('pur', 'puram'), ('ee', 'i'), ('oo', 'u'),
+    ('aa', 'a'), ('sh', 's'), ('w', 'v'), ('jaydev', 'jayadev'), ('mandir', 'mandira'),
+    ('station', 'stn'), ('road', 'rd'), ('bus stand', 'busstand'),
+]
+KEYBOARD = 'qwertyuiopasdfghjklzxcvbnm'
+
+
+def stop_names(n, rng):
+    """n unique stop names, common forms first."""
+    names, seen = [], set()
+
+    def add(name):
+        name = ' '.join(name.split())
+        if name and name not in seen:
+            seen.add(name)
+            names.append(name)
+
+    base = [f"{p} {r} {s}" for s in SUFFIXES for r in ROOTS for p in PREFIXES]
+    rng.shuffle(base)
+    for name in base:
+        add(name)
+        if len(names) >= n:
+            return names
+    i = 1
+    while len(names) < n:
+        add(f"{rng.choice(ROOTS)} {rng.choice(QUALIFIERS)} {i} {rng.choice(SUFFIXES)}")
+        i += 1
+    return names
+
+
+def make_workbook(n_stops, seed, path):
+    """Routes of ~30 stops laid along a random walk; windows overlap so stops are shared."""
+    rng = random.Random(seed)
+    names = stop_names(n_stops, rng)
+    lat, lng = 20.2961, 85.8245
+    coords = []
+    for _ in names:
+        ang = rng.uniform(0, 2 * math.pi)
+        step = rng.uniform(250, 600) / 111000
+        lat += step * math.sin(ang)
+        lng += step * math.cos(ang) / math.cos(math.radians(lat))
+        coords.append((round(lat, 6), round(lng, 6)))
+
+    rows, route_len, stride = [], 30, 20
+    for r, start in enumerate(range(0, max(1, n_stops - (route_len - stride)), stride)):
+        bus_no = str(r + 1)
+        for order, i in enumerate(range(start, min(start + route_len, n_stops)), 1):
+            rows.append({'bus_no': bus_no, 'stop_order': order, 'stop_name': names[i],
+                         'lat': coords[i][0], 'lng': coords[i][1]})
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pd.DataFrame(rows).to_excel(path, index=False)
+    return len(rows)
+
+
+def variant(name, rng):
+    low = name.lower()
+    options = [(a, b) for a, b in VARIANTS if a in low] + [(b, a) for a, b in VARIANTS if b in low]
+    if not options:
+        return None
+    a, b = rng.choice(options)
+    return low.replace(a, b, 1)
+
+
+def typo(name, rng):
+    s = list(name.lower())
+    letters = [i for i, c in enumerate(s) if c.isalpha()]
+    if len(letters) < 4:
+        return None
+    i = rng.choice(letters[1:])
+    op = rng.choice(('sub', 'del', 'swap', 'dup'))
+    if op == 'sub':
+        s[i] = rng.choice(KEYBOARD)
+    elif op == 'del':
+        del s[i]
+    elif op == 'swap' and i + 1 < len(s):
+        s[i], s[i + 1] = s[i + 1], s[i]
+    else:
+        s.insert(i, s[i])
+    return ''.join(s)
+
+
+def drop_word(name, rng):
+    words = name.lower().split()
+    if len(words) < 3:
+        return None
+    del words[rng.randrange(len(words))]
+    return ' '.join(words)
+
+
+def make_streams(names, count, seed):
+    """Keystroke streams for `count` target stops, mixed query kinds."""
+    rng = random.Random(seed)
+    kinds = [('exact', None, 0.5), ('variant', variant, 0.2), ('typo', typo, 0.2),
+             ('drop_word', drop_word, 0.1)]
+    streams = []
+    for name in rng.sample(names, min(count, len(names))):
+        r, acc = rng.random(), 0.0
+        for kind, fn, p in kinds:
+            acc += p
+            if r <= acc:
+                break
+        typed = fn(name, rng) if fn else name.lower()
+        if not typed:
+            kind, typed = 'exact', name.lower()
+        streams.append({'expected': name, 'kind': kind,
+                        'keystrokes': [typed[:i] for i in range(1, len(typed) + 1)]})
+    return streams
+
+
+# --- Replay ---
+class KeystrokeTimeout(BaseException):
+    """BaseException so the endpoints' `except Exception` blocks do not swallow it."""
+
+
+def _alarm(signum, frame):
+    raise KeystrokeTimeout()
+
+
+@contextlib.contextmanager
+def time_limit(seconds):
+    """Interrupt a runaway query (SIGALRM; no limit where unavailable or seconds <= 0)."""
+    if seconds <= 0 or not hasattr(signal, 'setitimer'):
+        yield
+        return
+    previous = signal.signal(signal.SIGALRM, _alarm)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+@contextlib.contextmanager
+def quiet():
+    """Swallow the per-query [DEBUG] prints of the search endpoints."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def result_names(path, payload):
+    if path == 'search_stops':
+        return [r['stop_name'] for r in payload]
+    return [r['stop_name'] for r in payload.get('results', [])]
+
+
+def replay(client, path, streams, k, budget_s, timeout_s):
+    """
+    Replay streams until the budget runs out (checked per keystroke, so the
+    last stream may be partial and is then not scored). A keystroke slower
+    than timeout_s is interrupted, counted as a timeout and returns nothing.
+    """
+    url = '/api/search_stops' if path == 'search_stops' else '/api/search-stop'
+    lat_ms, by_len = [], {'1-2': [], '3-5': [], '6-10': [], '11+': []}
+    final_hits = ranks = 0
+    first_hit, keystroke_hits, keystrokes, timeouts = [], 0, 0, 0
+    by_kind = {}
+    done = 0
+    deadline = time.perf_counter() + budget_s
+    for stream in streams:
+        expected = stream['expected'].lower()
+        hit_at = None
+        names = []
+        for q in stream['keystrokes']:
+            if time.perf_counter() > deadline:
+                break
+            t = time.perf_counter()
+            try:
+                with quiet(), time_limit(timeout_s):
+                    payload = client.get(url, query_string={'q': q}).get_json() or {}
+            except KeystrokeTimeout:
+                payload = {}
+                timeouts += 1
+            ms = (time.perf_counter() - t) * 1000
+            lat_ms.append(ms)
+            n = len(q)
+            by_len['1-2' if n <= 2 else '3-5' if n <= 5 else '6-10' if n <= 10 else '11+'].append(ms)
+            names = [s.lower() for s in result_names(path, payload)][:k]
+            keystrokes += 1
+            if expected in names:
+                keystroke_hits += 1
+                if hit_at is None:
+                    hit_at = n
+        if time.perf_counter() > deadline:
+            break
+        # Quality on the full query
+        hit = expected in names
+        final_hits += hit
+        ranks += 1 / (names.index(expected) + 1) if hit else 0
+        kind = by_kind.setdefault(stream['kind'], [0, 0])
+        kind[0] += hit
+        kind[1] += 1
+        if hit_at is not None:
+            first_hit.append(hit_at)
+        done += 1
+
+    return {
+        'streams_replayed': done,
+        'streams_total': len(streams),
+        'keystrokes': keystrokes,
+        'keystroke_timeouts': timeouts,
+        'latency_ms': percentiles(lat_ms),
+        'latency_ms_by_typed_length': {b: percentiles(v) for b, v in by_len.items() if v},
+        'quality': {
+            'k': k,
+            f'recall_at_{k}': round(final_hits / done, 3) if done else None,
+            'mrr': round(ranks / done, 3) if done else None,
+            'recall_by_kind': {kd: round(h / t, 3) for kd, (h, t) in by_kind.items()},
+            'keystroke_hit_rate': round(keystroke_hits / keystrokes, 3) if keystrokes else None,
+            'chars_to_first_hit': percentiles(first_hit, ps=(50, 90)),
+            'never_found': done - len(first_hit)
+        }
+    }
+
+
+def query_peak_kb(client, path, streams, timeout_s, samples=5):
+    """Largest tracemalloc peak over a few full queries (index already loaded)."""
+    url = '/api/search_stops' if path == 'search_stops' else '/api/search-stop'
+    peak = 0
+    tracemalloc.start()
+    try:
+        for stream in streams[:samples]:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            try:
+                with quiet(), time_limit(timeout_s * 3):  # tracemalloc slows queries down
+                    client.get(url, query_string={'q': stream['keystrokes'][-1]})
+            except KeystrokeTimeout:
+                continue
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - base)
+    finally:
+        tracemalloc.stop()
+    return round(peak / 1024, 1)
+
+
+def timed(fn):
+    t = time.perf_counter()
+    with quiet():
+        fn()
+    return time.perf_counter() - t
+
+
+def deep_size(obj, seen=None):
+    """Bytes held by a structure of dicts/lists/sets/strings/DataFrames (shared objects once)."""
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(deep=True).sum())
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(k, seen) + deep_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_size(v, seen) for v in obj)
+    return size
+
+
+# --- Matcher comparison ---
+def difflib_search(names, names_lower, query, k, cutoff=0.4):
+    """The pre-index search-stop path: substring matches, then get_close_matches."""
+    q = query.strip().lower()
+    fuzzy = difflib.get_close_matches(q, names_lower, n=k, cutoff=cutoff)
+    out, seen = [], set()
+    for m in [s for s in names_lower if q in s] + fuzzy:
+        if m not in seen:
+            seen.add(m)
+            out.append(m)
+    return out[:k]
+
+
+def compare_matchers(names, streams, k, budget_s, max_distance=None):
+    """Recall@k by kind and latency of each matcher on the streams' full queries."""
+    from server.trigram_index import TrigramIndex
+    from server.typo_index import TypoIndex, ranked_search
+    from server.variant_index import VariantIndex
+
+    t = time.perf_counter()
+    trigram = TrigramIndex(names)
+    trigram_s = time.perf_counter() - t
+    t = time.perf_counter()
+    typos = TypoIndex(trigram.names, max_distance=max_distance if max_distance is not None else 2)
+    typo_s = time.perf_counter() - t
+    t = time.perf_counter()
+    variants = VariantIndex(trigram.names)
+    variant_s = time.perf_counter() - t
+    names_lower = [n.lower() for n in names]
+
+    def ids_to_names(ids):
+        return [trigram.names[i].lower() for i in ids]
+
+    matchers = {
+        'difflib': lambda q: difflib_search(names, names_lower, q, k),
+        'trigram': lambda q: ids_to_names(i for i, _, _ in trigram.search(q, k=k, cutoff=0.4)),
+        'typo': lambda q: ids_to_names(i for i, _ in typos.search(q, k, max_distance)),
+        'variant': lambda q: ids_to_names(i for i, _, _ in variants.lookup(q, k)),
+        'combined': lambda q: ids_to_names(i for i, _, _ in ranked_search(
+            trigram, typos, q, k=k, cutoff=0.4, max_distance=max_distance, variants=variants)),
+    }
+    results = {}
+    for name, fn in matchers.items():
+        lat_ms, by_kind, hits, done = [], {}, 0, 0
+        deadline = time.perf_counter() + budget_s
+        for stream in streams:
+            if time.perf_counter() > deadline:
+                break
+            t = time.perf_counter()
+            found = fn(stream['keystrokes'][-1])
+            lat_ms.append((time.perf_counter() - t) * 1000)
+            hit = stream['expected'].lower() in found[:k]
+            hits += hit
+            kind = by_kind.setdefault(stream['kind'], [0, 0])
+            kind[0] += hit
+            kind[1] += 1
+            done += 1
+        results[name] = {
+            'streams': done,
+            'latency_ms': percentiles(lat_ms),
+            f'recall_at_{k}': round(hits / done, 3) if done else None,
+            'recall_by_kind': {kd: round(h / n, 3) for kd, (h, n) in by_kind.items()}
+        }
+    results['build_s'] = {'trigram': round(trigram_s, 3), 'typo': round(typo_s, 3),
+                          'variant': round(variant_s, 3)}
+    results['typo_index'] = typos.stats()
+    results['variant_index'] = variants.stats()
+    return results
+
+
+def engine_size(engine):
+    return deep_size([engine.stop_ids, engine.stop_names, engine.stop_coords, engine.stop_buses,
+                      engine.stop_to_buses, engine.bus_routes, vars(engine.trigram)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stop search latency / memory / recall benchmark")
+    parser.add_argument('--sizes', default='1000,10000,100000', help="unique stops per corpus")
+    parser.add_argument('--workbook', help="benchmark this workbook instead of synthetic corpora")
+    parser.add_argument('--queries', help="replay streams from this JSON file")
+    parser.add_argument('--streams', type=int, default=60, help="generated streams per corpus")
+    parser.add_argument('--paths', default='search_stops,search-stop')
+    parser.add_argument('--k', type=int, default=5, help="results a user sees (recall@k)")
+    parser.add_argument('--budget', type=float, default=60,
+                        help="max seconds replaying per corpus and path")
+    parser.add_argument('--timeout', type=float, default=5,
+                        help="interrupt a single keystroke after this many seconds (0 = never)")
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--compare-matchers', action='store_true',
+                        help="compare difflib / trigram / typo matchers offline instead of replaying")
+    parser.add_argument('--max-distance', type=int, help="typo matcher edits per token (default 2)")
+    parser.add_argument('--out', help="result JSON path")
+    args = parser.parse_args()
+
+    if args.compare_matchers:
+        return main_compare(args)
+
+    # The app writes driver/history state on import: keep it off the dev DB
+    scratch = tempfile.mkdtemp(prefix='bus-search-bench-')
+    os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(scratch, 'bench.db')}")
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    with quiet():
+        import app as bus_app
+        import routes.search
+        from server.bus_search import BusStopSearchEngine
+    client = bus_app.app.test_client()
+    paths = [p for p in args.paths.split(',') if p]
+
+    corpora = []
+    if args.workbook:
+        corpora.append((None, os.path.abspath(args.workbook)))
+    else:
+        for n in (int(s) for s in args.sizes.split(',') if s):
+            path = os.path.join(DATA_DIR, f"stops-{n}-seed{args.seed}.xlsx")
+            if not os.path.exists(path):
+                print(f"[INFO] Generating {n}-stop workbook -> {path}")
+                make_workbook(n, args.seed, path)
+            corpora.append((n, path))
+
+    results = []
+    for n, path in corpora:
+        print(f"[INFO] Corpus {os.path.basename(path)}")
+        rss_before = rss_bytes()
+
+        routes_s = timed(lambda: bus_app.build_routes(path))
+        rss_routes = rss_bytes()
+        holder = {}
+        engine_s = timed(lambda: holder.setdefault('e', BusStopSearchEngine(path)))
+        routes.search.init_search_engine(holder['e'])
+
+        names = sorted({s['stop_name'] for r in bus_app.ROUTES_CACHE.values() for s in r['stops']})
+        if args.queries:
+            with open(args.queries) as f:
+                streams = json.load(f)
+            streams_file = args.queries
+        else:
+            streams = make_streams(names, args.streams, args.seed)
+            streams_file = os.path.splitext(path)[0] + f"-streams{args.streams}.json"
+            with open(streams_file, 'w') as f:
+                json.dump(streams, f, indent=1)
+
+        corpus = {
+            'workbook': os.path.relpath(path, ROOT),
+            'stops': len(names),
+            'routes': len(bus_app.ROUTES_CACHE),
+            'rows': sum(len(r['stops']) for r in bus_app.ROUTES_CACHE.values()),
+            'streams_file': os.path.relpath(streams_file, ROOT),
+            'memory': {
+                'routes_cache_mb': round(deep_size(bus_app.ROUTES_CACHE) / 2 ** 20, 2),
+                'search_engine_mb': round(engine_size(holder['e']) / 2 ** 20, 2),
+                'build_routes_s': round(routes_s, 3),
+                'search_engine_load_s': round(engine_s, 3),
+                'rss_mb_before': round(rss_before / 2 ** 20, 1),
+                'rss_mb_after_build_routes': round(rss_routes / 2 ** 20, 1),
+                'rss_mb_after_engine': round(rss_bytes() / 2 ** 20, 1)
+            },
+            'paths': {}
+        }
+        for p in paths:
+            res = replay(client, p, streams, args.k, args.budget, args.timeout)
+            res['query_peak_alloc_kb'] = query_peak_kb(client, p, streams, args.timeout)
+            corpus['paths'][p] = res
+            lat, q = res['latency_ms'], res['quality']
+            print(f"[INFO]   {p:<13} p50 {lat.get('p50')} ms  p99 {lat.get('p99')} ms  "
+                  f"recall@{args.k} {q[f'recall_at_{args.k}']}  "
+                  f"({res['streams_replayed']}/{res['streams_total']} streams, "
+                  f"{res['keystrokes']} keystrokes, {res['keystroke_timeouts']} timeouts)")
+        results.append(corpus)
+
+    out = write_result('search', {
+        'benchmark': 'search',
+        **run_info(),
+        'params': {k: v for k, v in vars(args).items() if k != 'out'},
+        'corpora': results
+    }, args.out)
+    print(f"[SUCCESS] Results written to {out}")
+    return 0
+
+
+def main_compare(args):
+    sys.path.insert(0, ROOT)
+    results = []
+    for n in (int(s) for s in args.sizes.split(',') if s):
+        path = args.workbook or os.path.join(DATA_DIR, f"stops-{n}-seed{args.seed}.xlsx")
+        if not os.path.exists(path):
+            print(f"[INFO] Generating {n}-stop workbook -> {path}")
+            make_workbook(n, args.seed, path)
+        names = sorted(pd.read_excel(path)['stop_name'].astype(str).str.strip().unique())
+        if args.queries:
+            with open(args.queries) as f:
+                streams = json.load(f)
+        else:
+            streams = make_streams(names, args.streams, args.seed)
+        print(f"[INFO] Corpus {os.path.basename(path)} ({len(names)} stops, {len(streams)} queries)")
+        res = compare_matchers(names, streams, args.k, args.budget, args.max_distance)
+        for m in ('difflib', 'trigram', 'typo', 'variant', 'combined'):
+            r = res[m]
+            kinds = ' '.join(f"{kd}={v}" for kd, v in sorted(r['recall_by_kind'].items()))
+            print(f"[INFO]   {m:<9} p50 {r['latency_ms'].get('p50')} ms  p99 {r['latency_ms'].get('p99')} ms  "
+                  f"recall@{args.k} {r[f'recall_at_{args.k}']}  ({kinds}; {r['streams']} queries)")
+        results.append({'workbook': os.path.relpath(path, ROOT), 'stops': len(names), 'matchers': res})
+        if args.workbook:
+            break
+
+    out = write_result('search-matchers', {
+        'benchmark': 'search-matchers',
+        **run_info(),
+        'params': {k: v for k, v in vars(args).items() if k != 'out'},
+        'corpora': results
+    }, args.out)
+    print(f"[SUCCESS] Results written to {out}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
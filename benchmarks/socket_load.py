@@ -0,0 +1,408 @@
+"""
+Socket.IO Load Generator / End-to-End Latency Benchmark
+
+Starts app.socketio in a child process (single gevent worker, like the
+Procfile) against a scratch SQLite file, then connects N simulated drivers
+that drive along the real routes in data/bus_routes.xlsx and M students
+listening to the fleet feed.
+
+Measured:
+    ingest      driver_update emits/s sent, and fixes received/applied by the
+                server (from /api/debug/status ingress counters)
+    fan-out     driver emit -> student receive latency (ms) for every bus_delta
+                entry a student gets; an entry is matched to its emit by
+                (bus_no, lat, lng), so superseded fixes are not counted
+    server      CPU % and RSS of the server process (psutil if installed,
+                otherwise /proc)
+
+Results are written as JSON (default benchmarks/results/socket_load-<ts>.json)
+so runs can be compared between commits.
+
+Latency includes the broadcast tick (BROADCAST_TICK_HZ), so with the
+default 1 Hz tick expect p50 around half a second plus transport time.
+
+Usage:
+    python benchmarks/socket_load.py --drivers 50 --students 200 --duration 60
+    python benchmarks/socket_load.py --url http://localhost:3000 --pid 1234
+    python benchmarks/socket_load.py --transport websocket   # needs websocket-client
+"""
+from gevent import monkey
+monkey.patch_all()
+
+import argparse
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import gevent
+import pandas as pd
+import requests
+import socketio
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+from common import ROOT, percentiles, rss_bytes, run_info, write_result
+
+EARTH_R = 6371000  # meters
+
+
+# --- Routes ---
+def load_routes(path):
+    """bus_no -> [(lat, lng), ...] in stop order (same rules as build_routes)"""
+    df = pd.read_excel(path)
+    df['bus_no'] = df['bus_no'].astype(str)
+    df['stop_order'] = pd.to_numeric(df['stop_order'], errors='coerce')
+    routes = {}
+    for bus_no, group in df.dropna(subset=['lat', 'lng']).groupby('bus_no'):
+        pts = group.sort_values('stop_order')[['lat', 'lng']].values.tolist()
+        if len(pts) >= 2:
+            routes[bus_no] = pts
+    return routes
+
+
+def _dist_m(a, b):
+    dy = (b[0] - a[0]) * math.radians(1) * EARTH_R
+    dx = (b[1] - a[1]) * math.radians(1) * EARTH_R * math.cos(math.radians(a[0]))
+    return math.hypot(dx, dy)
+
+
+class RouteWalker:
+    """Position after travelling d metres along a polyline (wraps around)."""
+
+    def __init__(self, pts):
+        self.pts = pts
+        self.cum = [0.0]
+        for a, b in zip(pts, pts[1:]):
+            self.cum.append(self.cum[-1] + _dist_m(a, b))
+        self.length = self.cum[-1] or 1.0
+
+    def at(self, d):
+        d %= self.length
+        i = 0
+        while i < len(self.cum) - 2 and self.cum[i + 1] < d:
+            i += 1
+        seg = self.cum[i + 1] - self.cum[i]
+        f = (d - self.cum[i]) / seg if seg else 0.0
+        a, b = self.pts[i], self.pts[i + 1]
+        heading = math.degrees(math.atan2(b[1] - a[1], b[0] - a[0])) % 360
+        return a[0] + (b[0] - a[0]) * f, a[1] + (b[1] - a[1]) * f, heading
+
+
+# --- Server process ---
+def free_port():
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def start_server(port, db_path, log):
+    code = ("import app; app.socketio.run(app.app, host='127.0.0.1', port=%d, "
+            "debug=False, log_output=False, allow_unsafe_werkzeug=True)" % port)
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{db_path}", PYTHONUNBUFFERED='1')
+    return subprocess.Popen([sys.executable, '-c', code], cwd=ROOT, env=env,
+                            stdout=log, stderr=subprocess.STDOUT)
+
+
+def wait_ready(url, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(f"{url}/api/debug/status", timeout=2).ok:
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    return False
+
+
+def server_status(url):
+    try:
+        return requests.get(f"{url}/api/debug/status", timeout=5).json()
+    except Exception as e:
+        print(f"[WARN] Could not read server status: {e}")
+        return {}
+
+
+class ProcessSampler:
+    """CPU % / RSS of one process, sampled every `period` seconds."""
+
+    def __init__(self, pid, period=1.0):
+        self.pid = pid
+        self.period = period
+        self.cpu = []
+        self.rss = []
+        self.source = 'psutil' if psutil else '/proc'
+        self._tick = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+    def _proc_times(self):
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / self._tick  # utime + stime
+
+    def run(self):
+        try:
+            if psutil:
+                proc = psutil.Process(self.pid)
+                proc.cpu_percent(None)
+                while True:
+                    gevent.sleep(self.period)
+                    self.cpu.append(proc.cpu_percent(None))
+                    self.rss.append(proc.memory_info().rss)
+            else:
+                last_t, last_cpu = time.monotonic(), self._proc_times()
+                while True:
+                    gevent.sleep(self.period)
+                    now, cpu = time.monotonic(), self._proc_times()
+                    self.cpu.append(100.0 * (cpu - last_cpu) / (now - last_t))
+                    self.rss.append(rss_bytes(self.pid))
+                    last_t, last_cpu = now, cpu
+        except Exception as e:  # Process exited (psutil.Error / OSError)
+            print(f"[WARN] Process sampling stopped: {e}")
+
+    def summary(self):
+        if not self.cpu:
+            return {'source': self.source, 'samples': 0}
+        return {
+            'source': self.source,
+            'samples': len(self.cpu),
+            'cpu_percent_avg': round(sum(self.cpu) / len(self.cpu), 1),
+            'cpu_percent_max': round(max(self.cpu), 1),
+            'rss_mb_start': round(self.rss[0] / 2 ** 20, 1),
+            'rss_mb_max': round(max(self.rss) / 2 ** 20, 1),
+            'rss_mb_end': round(self.rss[-1] / 2 ** 20, 1)
+        }
+
+
+# --- Clients ---
+def fix_key(bus_no, lat, lng):
+    return (str(bus_no), round(float(lat), 6), round(float(lng), 6))
+
+
+class Recorder:
+    """Emit times per fix, and the latencies students observe for them."""
+
+    def __init__(self):
+        self.sent = {}         # fix_key -> perf_counter at emit
+        self.bus_of = {}       # fleet entry key (driver sid) -> bus_no
+        self.emits = 0
+        self.emit_errors = 0
+        self.latencies = []    # ms
+        self.frames = 0
+        self.unmatched = 0
+        self.connect_errors = 0
+        self.measuring = False
+
+    def on_snapshot(self, frame):
+        for key, entry in (frame.get('buses') or {}).items():
+            self.bus_of[key] = entry.get('bus_no')
+
+    def on_delta(self, frame):
+        now = time.perf_counter()
+        self.frames += 1
+        for key, entry in (frame.get('changed') or {}).items():
+            # Deltas only carry changed fields; bus_no comes with a key's first entry
+            if 'bus_no' in entry:
+                self.bus_of[key] = entry['bus_no']
+            if entry.get('lat') is None or entry.get('lng') is None or key not in self.bus_of:
+                continue
+            t0 = self.sent.get(fix_key(self.bus_of[key], entry['lat'], entry['lng']))
+            if t0 is None:
+                self.unmatched += 1
+            elif self.measuring:
+                self.latencies.append((now - t0) * 1000)
+
+
+def connect(url, rec, transports, listen=False):
+    client = socketio.Client(reconnection=False)
+    if listen:
+        client.on('fleet_snapshot', rec.on_snapshot)
+        client.on('bus_delta', rec.on_delta)
+    try:
+        client.connect(url, transports=transports, wait_timeout=30)
+    except Exception as e:
+        rec.connect_errors += 1
+        print(f"[WARN] Connect failed: {e}")
+        return None
+    return client
+
+
+def run_student(url, rec, transports, track_bus, stop_at):
+    client = connect(url, rec, transports, listen=True)
+    if client is None:
+        return
+    if track_bus:
+        client.emit('track_bus', {'bus_no': track_bus})
+    gevent.sleep(max(0, stop_at - time.time()))
+    client.disconnect()
+
+
+def run_driver(url, rec, transports, bus_no, walker, speed, interval, stop_at):
+    client = connect(url, rec, transports)
+    if client is None:
+        return
+    client.emit('leave_fleet')  # Driver consoles do not render the fleet
+    d = random.uniform(0, walker.length)
+    next_at = time.time()
+    while time.time() < stop_at:
+        lat, lng, heading = walker.at(d)
+        data = {'bus_no': bus_no, 'lat': round(lat, 6), 'lng': round(lng, 6),
+                'speed': speed, 'heading': round(heading, 1), 'accuracy': 5,
+                'crowd': 'LOW', 'type': 'DAY_SCHOLAR', 'driver_name': f"Bench {bus_no}"}
+        rec.sent[fix_key(bus_no, data['lat'], data['lng'])] = time.perf_counter()
+        try:
+            client.emit('driver_update', data)
+            rec.emits += 1
+        except Exception:
+            rec.emit_errors += 1
+        d += speed * interval
+        next_at += interval
+        gevent.sleep(max(0, next_at - time.time()))
+    try:
+        client.emit('driver_update', (None,))  # End the session like the driver app
+        gevent.sleep(0.2)
+    finally:
+        client.disconnect()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Socket.IO load / latency benchmark")
+    parser.add_argument('--drivers', type=int, default=20)
+    parser.add_argument('--students', type=int, default=50)
+    parser.add_argument('--duration', type=float, default=30, help="measured seconds")
+    parser.add_argument('--warmup', type=float, default=5, help="seconds before measuring")
+    parser.add_argument('--interval', type=float, default=1.0, help="driver ping interval (s)")
+    parser.add_argument('--speed', type=float, default=10.0, help="simulated bus speed (m/s)")
+    parser.add_argument('--track', type=float, default=0.5,
+                        help="fraction of students that also track_bus one bus")
+    parser.add_argument('--transport', choices=['polling', 'websocket'], default='polling')
+    parser.add_argument('--routes', default=os.path.join(ROOT, 'data', 'bus_routes.xlsx'))
+    parser.add_argument('--url', help="benchmark a running server instead of starting one")
+    parser.add_argument('--pid', type=int, help="server pid to sample with --url")
+    parser.add_argument('--startup-timeout', type=float, default=90)
+    parser.add_argument('--out', help="result JSON path")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    routes = load_routes(args.routes)
+    if not routes:
+        print(f"[ERROR] No routes in {args.routes}")
+        return 1
+    route_keys = sorted(routes)
+    walkers = {k: RouteWalker(routes[k]) for k in route_keys}
+
+    server, log, scratch = None, None, None
+    url, pid = args.url, args.pid
+    if not url:
+        scratch = tempfile.mkdtemp(prefix='bus-bench-')
+        log = open(os.path.join(scratch, 'server.log'), 'w')
+        port = free_port()
+        server = start_server(port, os.path.join(scratch, 'bench.db'), log)
+        url, pid = f"http://127.0.0.1:{port}", server.pid
+        print(f"[INFO] Starting server on {url} (log: {log.name})")
+        if not wait_ready(url, args.startup_timeout):
+            print("[ERROR] Server did not come up")
+            server.kill()
+            return 1
+
+    transports = [args.transport] if args.transport == 'polling' else ['websocket']
+    rec = Recorder()
+    sampler = ProcessSampler(pid) if pid else None
+    try:
+        # Drivers: one per route first, then more buses on the same routes
+        start = time.time()
+        stop_at = start + args.warmup + args.duration
+        drivers = []
+        for i in range(args.drivers):
+            route = route_keys[i % len(route_keys)]
+            bus_no = route if i < len(route_keys) else f"{route}-{i // len(route_keys)}"
+            drivers.append(gevent.spawn(run_driver, url, rec, transports, bus_no, walkers[route],
+                                        args.speed, args.interval, stop_at))
+        students = []
+        for i in range(args.students):
+            track = route_keys[i % len(route_keys)] if random.random() < args.track else None
+            students.append(gevent.spawn(run_student, url, rec, transports, track, stop_at))
+
+        gevent.sleep(max(0, start + args.warmup - time.time()))
+        before = server_status(url)
+        emits_before = rec.emits
+        rec.measuring = True
+        sampler_job = gevent.spawn(sampler.run) if sampler else None
+        t0 = time.time()
+        gevent.sleep(max(0, stop_at - time.time()))
+        elapsed = time.time() - t0
+        rec.measuring = False
+        after = server_status(url)
+        if sampler_job:
+            sampler_job.kill()
+        gevent.joinall(drivers + students, timeout=30)
+    finally:
+        if server:
+            server.terminate()
+            try:
+                server.wait(10)
+            except subprocess.TimeoutExpired:
+                server.kill()
+            log.close()
+
+    ib, ia = before.get('ingress', {}), after.get('ingress', {})
+    received = ia.get('received', 0) - ib.get('received', 0)
+    accepted = ia.get('accepted', 0) - ib.get('accepted', 0)
+    result = {
+        'benchmark': 'socket_load',
+        **run_info(),
+        'params': {k: v for k, v in vars(args).items() if k not in ('out',)},
+        'routes': len(route_keys),
+        'measured_s': round(elapsed, 2),
+        'ingest': {
+            'emits': rec.emits - emits_before,
+            'emits_per_s': round((rec.emits - emits_before) / elapsed, 1) if elapsed else 0,
+            'server_received': received,
+            'server_received_per_s': round(received / elapsed, 1) if elapsed else 0,
+            'server_applied': accepted,
+            'server_applied_per_s': round(accepted / elapsed, 1) if elapsed else 0,
+            'emit_errors': rec.emit_errors
+        },
+        'fanout_latency_ms': percentiles(rec.latencies),
+        'fanout': {
+            'frames_received': rec.frames,
+            'deliveries_measured': len(rec.latencies),
+            'deliveries_per_s': round(len(rec.latencies) / elapsed, 1) if elapsed else 0,
+            'unmatched_entries': rec.unmatched,
+            'connect_errors': rec.connect_errors
+        },
+        'server': sampler.summary() if sampler else None,
+        'server_status': {k: after.get(k) for k in ('broadcast', 'fleet_store', 'wire', 'ingress')}
+    }
+
+    out = write_result('socket_load', result, args.out)
+
+    lat = result['fanout_latency_ms']
+    print(f"[INFO] {args.drivers} drivers / {args.students} students for {elapsed:.0f}s")
+    print(f"[INFO] Ingest: {result['ingest']['emits_per_s']}/s sent, "
+          f"{result['ingest']['server_applied_per_s']}/s applied")
+    if lat:
+        print(f"[INFO] Fan-out latency ms: p50 {lat['p50']} p90 {lat['p90']} p99 {lat['p99']} "
+              f"max {lat['max']} ({lat['count']} deliveries)")
+    else:
+        print("[WARN] No deliveries measured")
+    if result['server'] and result['server'].get('samples'):
+        s = result['server']
+        print(f"[INFO] Server CPU avg {s['cpu_percent_avg']}% max {s['cpu_percent_max']}%, "
+              f"RSS max {s['rss_mb_max']} MB ({s['source']})")
+    print(f"[SUCCESS] Results written to {out}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,23 @@
+"""
+Compact LocationHistory into day/bus partitions and print storage stats.
+
+Usage:
+    python compact_history.py           # compact, downsample, apply retention
+    python compact_history.py --stats   # only print storage stats
+"""
+import json
+import os
+import sys
+
+# Import the app without starting the server's background tasks (flusher,
+# broadcast tick, ETA refresh, periodic compaction) or Firebase
+os.environ['BACKGROUND_TASKS'] = '0'
+from app import app, history_store
+
+with app.app_context():
+    if '--stats' not in sys.argv:
+        report = history_store.compact()
+        print("[SUCCESS] Compaction finished:")
+        print(json.dumps(report, indent=2))
+    print("[INFO] History storage:")
+    print(json.dumps(history_store.stats(), indent=2, default=str))
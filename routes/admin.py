@@ -1,10 +1,17 @@
-from flask import Blueprint, render_template, request, jsonify
+from flask import Blueprint, render_template, request, jsonify, Response
 from datetime import datetime
+from functools import wraps
+import hmac
+import os
 import server.extensions
+from server.metrics import external_call
 from firebase_admin import messaging, firestore
 
 admin_bp = Blueprint('admin', __name__)
 
+# Profiling endpoints stay disabled unless this is set
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+
 @admin_bp.route('/api/admin/stops')
 def get_stops_data():
     from server.extensions import ROUTES_CACHE # Still use Cache for static routes
@@ -99,23 +106,25 @@ def send_announcement():
             # 1. Save to 'messages' collection (Global)
             print("[ADMIN] Writing to university/kiit/messages")
             ref = db.collection('university').document('kiit').collection('messages')
-            ref.add({
-                'message': message,
-                'bus_no': 'ADMIN',
-                'timestamp': timestamp,
-                'type': 'general',
-                'is_admin': True # FLAG for styling
-            })
+            with external_call('firestore', 'announcement_add'):
+                ref.add({
+                    'message': message,
+                    'bus_no': 'ADMIN',
+                    'timestamp': timestamp,
+                    'type': 'general',
+                    'is_admin': True # FLAG for styling
+                })
             
         elif target == 'driver':
             # 1. Save to 'driver_messages' collection
             ref = db.collection('university').document('kiit').collection('driver_messages')
-            ref.add({
-                'message': message,
-                'author': 'Admin',
-                'timestamp': timestamp,
-                'is_important': True
-            })
+            with external_call('firestore', 'driver_announcement_add'):
+                ref.add({
+                    'message': message,
+                    'author': 'Admin',
+                    'timestamp': timestamp,
+                    'is_important': True
+                })
             
             # Drivers need their own listener (we will build this in driver_announcements.js)
             
@@ -127,3 +136,114 @@ def send_announcement():
     except Exception as e:
         print(f"[ADMIN ERROR] {e}")
         return jsonify({'error': str(e)}), 500
+
+
+# --- Profiling (X-Admin-Token header only: query strings end up in access logs) ---
+def require_admin_token(fn):
+    @wraps(fn)
+    def inner(*args, **kwargs):
+        if not ADMIN_TOKEN:
+            return jsonify({'error': 'Profiling disabled (ADMIN_TOKEN not set)'}), 404
+        token = request.headers.get('X-Admin-Token') or ''
+        if not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+            return jsonify({'error': 'Invalid admin token'}), 403
+        return fn(*args, **kwargs)
+    return inner
+
+
+def _download(body, filename, mimetype):
+    return Response(body, mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+
+@admin_bp.route('/api/admin/profile')
+@require_admin_token
+def profile_status():
+    return jsonify(server.extensions.profiler.stats())
+
+
+@admin_bp.route('/api/admin/profile/sample/start', methods=['POST'])
+@require_admin_token
+def profile_sample_start():
+    data = request.get_json(silent=True) or {}
+    try:
+        duration = float(data.get('duration', request.args.get('duration', 30)))
+        hz = data.get('hz', request.args.get('hz'))
+        hz = float(hz) if hz else None
+    except (TypeError, ValueError):
+        return jsonify({'error': 'duration and hz must be numbers'}), 400
+    if duration <= 0 or (hz is not None and not 0 < hz <= 1000):
+        return jsonify({'error': 'duration must be > 0 and hz in (0, 1000]'}), 400
+
+    sampler = server.extensions.profiler.sampler
+    if not sampler.start(duration, hz):
+        return jsonify({'error': 'Sampler already running', 'sampler': sampler.stats()}), 409
+    print(f"[ADMIN] Sampling profiler started for {sampler.duration_s}s at {sampler.hz} Hz")
+    return jsonify(sampler.stats())
+
+
+@admin_bp.route('/api/admin/profile/sample/stop', methods=['POST'])
+@require_admin_token
+def profile_sample_stop():
+    sampler = server.extensions.profiler.sampler
+    sampler.stop()
+    return jsonify(sampler.stats())
+
+
+@admin_bp.route('/api/admin/profile/sample/download')
+@require_admin_token
+def profile_sample_download():
+    """Collapsed stacks for flamegraph.pl / speedscope (?idle=1 keeps hub-idle samples)."""
+    sampler = server.extensions.profiler.sampler
+    body = sampler.collapsed(include_idle=request.args.get('idle') == '1')
+    stamp = datetime.utcfromtimestamp(sampler.started_at or 0).strftime('%Y%m%dT%H%M%S')
+    return _download(body, f'profile-{stamp}.collapsed.txt', 'text/plain')
+
+
+@admin_bp.route('/api/admin/profile/requests', methods=['GET', 'POST', 'DELETE'])
+@require_admin_token
+def profile_requests():
+    """POST {path, count, ttl} arms cProfile for matching requests; DELETE disarms."""
+    req_profiler = server.extensions.profiler.requests
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        prefix = data.get('path') or request.args.get('path')
+        if not prefix or not prefix.startswith('/'):
+            return jsonify({'error': 'path prefix (starting with /) is required'}), 400
+        try:
+            count = min(int(data.get('count', request.args.get('count', 1))), req_profiler.captures.maxlen)
+            ttl = float(data.get('ttl', request.args.get('ttl', 600)))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'count and ttl must be numbers'}), 400
+        print(f"[ADMIN] Request profiling armed for {prefix} x{count}")
+        return jsonify(req_profiler.arm(prefix, count, ttl))
+    if request.method == 'DELETE':
+        req_profiler.disarm()
+    return jsonify(req_profiler.status())
+
+
+@admin_bp.route('/api/admin/profile/requests/<int:capture_id>')
+@require_admin_token
+def profile_request_capture(capture_id):
+    """?format=pstats (default, for pstats / snakeviz) or ?format=text."""
+    from server.profiling import summarize_pstats
+    capture = server.extensions.profiler.requests.get(capture_id)
+    if capture is None:
+        return jsonify({'error': 'Capture not found'}), 404
+    if request.args.get('format') == 'text':
+        return Response(summarize_pstats(capture['pstats'], sort=request.args.get('sort', 'cumulative')),
+                        mimetype='text/plain')
+    return _download(capture['pstats'], f'request-{capture_id}.pstats', 'application/octet-stream')
+
+
+@admin_bp.route('/api/admin/profile/greenlets')
+@require_admin_token
+def profile_greenlets():
+    from server.profiling import dump_greenlets
+    return Response(dump_greenlets(), mimetype='text/plain')
+
+
+@admin_bp.route('/api/admin/profile/loop-lag')
+@require_admin_token
+def profile_loop_lag():
+    return jsonify(server.extensions.profiler.loop_lag.stats())
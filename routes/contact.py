@@ -1,5 +1,6 @@
 from flask import Blueprint, request, jsonify, render_template
 import server.extensions
+from server.metrics import external_call
 from firebase_admin import firestore
 import datetime
 
@@ -30,15 +31,16 @@ def submit_contact():
     try:
         # Save to 'feedback' collection
         doc_ref = server.extensions.f_db.collection('feedback').document()
-        doc_ref.set({
-            "name": name,
-            "email": email,
-            "message": message,
-            "role": role,
-            "type": report_type,
-            "timestamp": firestore.SERVER_TIMESTAMP,
-            "status": "new"
-        })
+        with external_call('firestore', 'feedback_set'):
+            doc_ref.set({
+                "name": name,
+                "email": email,
+                "message": message,
+                "role": role,
+                "type": report_type,
+                "timestamp": firestore.SERVER_TIMESTAMP,
+                "status": "new"
+            })
 
         return jsonify({"status": "success", "message": "Feedback submitted successfully"}), 200
 
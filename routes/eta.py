@@ -0,0 +1,90 @@
+from flask import Blueprint, request, jsonify
+from datetime import datetime, timedelta
+import server.extensions
+import routes.search
+
+eta_bp = Blueprint('eta_bp', __name__)
+
+# Live positions older than this are not used for ETAs
+STALE_AFTER = timedelta(minutes=10)
+
+
+def _live_progress(bus_no):
+    """progress_m of an active, fresh, on-route bus (else None)"""
+    fleet_store = server.extensions.fleet_store
+    b = fleet_store.get(str(bus_no)) if fleet_store else None
+    if not b or not b['is_active'] or not b['last_updated']:
+        return None
+    if b['last_updated'] < datetime.utcnow() - STALE_AFTER:
+        return None
+    return b.get('progress_m')
+
+
+def _resolve_stop(stop_name):
+    """Canonical stop name for any spelling /api/stop-status accepts (else as given)"""
+    search_engine = routes.search.search_engine
+    stop_id = search_engine.stop_id(stop_name) if search_engine else None
+    return search_engine.stop_names[stop_id] if stop_id is not None else stop_name
+
+
+@eta_bp.route('/api/eta/bus/<bus_no>', methods=['GET'])
+def bus_eta(bus_no):
+    """ETA to every stop still ahead of a live bus"""
+    eta_engine = server.extensions.eta_engine
+    if not eta_engine:
+        return jsonify({'success': False, 'error': 'ETA engine not initialized'}), 500
+
+    bus_no = str(bus_no).strip().upper()
+    if eta_engine.matcher.route(bus_no) is None:
+        return jsonify({'success': False, 'error': 'Route not found'}), 404
+
+    progress = _live_progress(bus_no)
+    if progress is None:
+        return jsonify({'success': True, 'bus_no': bus_no, 'is_online': False, 'stops': []})
+
+    stops = [{'stop_name': name, 'eta_s': round(float(eta), 1), 'learned': learned}
+             for name, eta, learned in eta_engine.upcoming(bus_no, progress)]
+    return jsonify({
+        'success': True,
+        'bus_no': bus_no,
+        'is_online': True,
+        'progress_m': progress,
+        'stops': stops
+    })
+
+
+@eta_bp.route('/api/eta/<stop_name>', methods=['GET'])
+def stop_eta(stop_name):
+    """Live buses heading to a stop, soonest first"""
+    eta_engine = server.extensions.eta_engine
+    if not eta_engine:
+        return jsonify({'success': False, 'error': 'ETA engine not initialized'}), 500
+
+    stop_name = _resolve_stop(stop_name)
+    serving = eta_engine.routes_serving(stop_name)
+    if not serving:
+        return jsonify({'success': False, 'error': 'Stop not found'}), 404
+
+    try:
+        limit = min(max(int(request.args.get('k', 10)), 1), 50)
+    except ValueError:
+        limit = 10
+
+    buses = []
+    for bus_no in serving:
+        progress = _live_progress(bus_no)
+        if progress is None:
+            continue
+        for name, eta, learned in eta_engine.upcoming(bus_no, progress):
+            if name == stop_name:
+                buses.append({'bus_no': bus_no, 'eta_s': round(float(eta), 1), 'learned': learned})
+                break
+    buses.sort(key=lambda b: b['eta_s'])
+
+    return jsonify({
+        'success': True,
+        'stop_name': stop_name,
+        'routes': serving,
+        'buses': buses[:limit],
+        'count': len(buses)
+    })
@@ -1,6 +1,7 @@
 from flask import Blueprint, request, jsonify
 from firebase_admin import firestore, messaging
 import server.extensions
+from server.metrics import external_call
 from datetime import datetime
 
 schedule_bp = Blueprint('schedule', __name__)
@@ -32,15 +33,17 @@ def publish_schedule():
             "updated_at": firestore.SERVER_TIMESTAMP
         }
         print(f"[DEBUG] Attempting date_ref.set()... payload size: {len(str(payload))}")
-        date_ref.set(payload)
+        with external_call('firestore', 'schedule_set'):
+            date_ref.set(payload)
         print("[DEBUG] date_ref.set() COMPLETED.")
 
         # Update metadata
         print("[DEBUG] Updating metadata...")
-        schedule_ref.set({
-            "last_update": firestore.SERVER_TIMESTAMP,
-            "bus_no": bus_no
-        }, merge=True)
+        with external_call('firestore', 'schedule_meta_set'):
+            schedule_ref.set({
+                "last_update": firestore.SERVER_TIMESTAMP,
+                "bus_no": bus_no
+            }, merge=True)
         print("[DEBUG] Metadata updated. Success!")
 
         # --- SEND NOTIFICATION ---
@@ -54,7 +57,8 @@ def publish_schedule():
                 ),
                 topic='news'
             )
-            response = messaging.send(msg)
+            with external_call('fcm', 'schedule'):
+                response = messaging.send(msg)
             print(f"[INFO] Schedule Notification sent: {response}")
         except Exception as ne:
              print(f"[WARN] Failed to send notification: {ne}")
@@ -1,5 +1,8 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 from datetime import datetime, timedelta
+import math
+import server.extensions
+from server.query_cache import STATUS_TTL_S
 # Import Bus model (will need a clean way, likely circular import workaround or from extensions if possible)
 # Actually, Bus is in app.py. We should move Bus model to extensions or models.
 # But for now, app.py imports routes, so routes cannot import app.
@@ -29,6 +32,19 @@ def init_search_engine(engine):
     global search_engine
     search_engine = engine
 
+def cached_response(ns, key, compute, ttl_s=None):
+    """JSON response from the query cache, or compute() -> (payload, status) and cache 200s."""
+    cache = server.extensions.query_cache
+    version = search_engine.version
+    body = cache.get(ns, version, key) if cache else None
+    if body is not None:
+        return current_app.response_class(body, mimetype='application/json')
+    payload, status = compute()
+    response = jsonify(payload)
+    if cache and status == 200:
+        cache.put(ns, version, key, response.get_data(), ttl_s)
+    return response, status
+
 @search_bp.route('/api/search-stop', methods=['GET'])
 def search_stop():
     """Search for bus stops with fuzzy matching (Module Based)"""
@@ -37,20 +53,53 @@ def search_stop():
 
     query = request.args.get('q', '').strip()
     threshold = float(request.args.get('threshold', 0.4)) 
+    max_distance = request.args.get('max_distance', type=int) # Edits per token (0-3)
+    if max_distance is not None:
+        max_distance = min(max(max_distance, 0), 3)
     
     if not query: return jsonify({'success': False, 'error': 'Query required'}), 400
     
+    def compute():
+        try:
+            results = search_engine.fuzzy_search(query, threshold, max_distance=max_distance)
+            return {
+                'success': True,
+                'query': query,
+                'results': results,
+                'count': len(results)
+            }, 200
+        except Exception as e:
+            print(f"[ERROR] Search API: {e}")
+            return {'success': False, 'error': str(e)}, 500
+
+    # Keyed on the query as sent: the body echoes it back verbatim
+    return cached_response('search-stop', (query, threshold, max_distance), compute)
+
+@search_bp.route('/api/autocomplete', methods=['GET'])
+def autocomplete():
+    """Top-k stops whose name (or any word of it) starts with q, most popular first"""
+    index = server.extensions.autocomplete
+    if not index:
+        return jsonify({'success': False, 'error': 'Autocomplete index not built'}), 500
+
+    query = request.args.get('q', '').strip()
     try:
-        results = search_engine.fuzzy_search(query, threshold)
-        return jsonify({
-            'success': True,
-            'query': query,
-            'results': results,
-            'count': len(results)
-        })
-    except Exception as e:
-        print(f"[ERROR] Search API: {e}")
-        return jsonify({'success': False, 'error': str(e)}), 500
+        k = int(request.args.get('k', 10))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'k must be an integer'}), 400
+    k = min(max(k, 1), 50)
+
+    suggestions = [{
+        'stop_name': index.names[i],
+        'buses': index.buses[i],
+        'weight': weight
+    } for i, weight in index.suggest(query, k)]
+    return jsonify({
+        'success': True,
+        'query': query,
+        'suggestions': suggestions,
+        'count': len(suggestions)
+    })
 
 @search_bp.route('/api/stop-status/<stop_name>', methods=['GET'])
 def get_stop_status(stop_name):
@@ -58,44 +107,80 @@ def get_stop_status(stop_name):
     if not search_engine:
         return jsonify({'success': False, 'error': 'Engine not initialized'}), 500
         
+    # Any accepted spelling resolves to one stop id (and one cache entry)
+    stop_id = search_engine.stop_id(stop_name)
+    if stop_id is None:
+        return jsonify({'success': False, 'error': 'Stop not found'}), 404
+
+    # Live positions: cached for about one broadcast tick only
+    def compute():
+        try:
+            buses = search_engine.stop_buses[stop_id]
+            
+            # Live state comes from the in-memory fleet store (populated by app.py)
+            fleet_store = server.extensions.fleet_store
+            
+            # Active Buses only (STALENESS CHECK enforced)
+            threshold = datetime.utcnow() - timedelta(minutes=10)
+            
+            live_buses = []
+            for bus_no in buses:
+                bus_no_str = str(bus_no)
+                b = fleet_store.get(bus_no_str) if fleet_store else None
+                if b and b['is_active'] and b['last_updated'] and b['last_updated'] >= threshold:
+                    live_buses.append({
+                        'bus_no': bus_no_str,
+                        'lat': b['lat'],
+                        'lng': b['lng'],
+                        'speed': b['speed'],
+                        'heading': b['heading'],
+                        'crowd': b['crowd_status'],
+                        'is_online': True
+                    })
+                else:
+                    live_buses.append({
+                        'bus_no': bus_no_str,
+                        'is_online': False
+                    })
+            
+            return {
+                'success': True,
+                'stop_name': search_engine.stop_names[stop_id],
+                'buses': live_buses
+            }, 200
+        except Exception as e:
+            return {'success': False, 'error': str(e)}, 500
+
+    return cached_response('stop-status', stop_id, compute, STATUS_TTL_S)
+
+@search_bp.route('/api/stops/nearby', methods=['GET'])
+def nearby_stops():
+    """Closest stops to a point, with the buses serving each one"""
+    stop_index = server.extensions.stop_index
+    if not stop_index:
+        return jsonify({'success': False, 'error': 'Stop index not built'}), 500
+
     try:
-        if stop_name not in search_engine.stop_to_buses:
-            return jsonify({'success': False, 'error': 'Stop not found'}), 404
-        
-        buses = list(search_engine.stop_to_buses[stop_name])
-        
-        # LAZY IMPORT MODEL to avoid circular import
-        from app import Bus
-        
-        # Query Active Buses (STALENESS CHECK enforced)
-        threshold = datetime.utcnow() - timedelta(minutes=10)
-        active_buses = Bus.query.filter(Bus.is_active==True, Bus.last_updated >= threshold).all()
-        active_map = {b.bus_no: b for b in active_buses}
-        
-        live_buses = []
-        for bus_no in buses:
-            bus_no_str = str(bus_no)
-            if bus_no_str in active_map:
-                b = active_map[bus_no_str]
-                live_buses.append({
-                    'bus_no': bus_no_str,
-                    'lat': b.lat,
-                    'lng': b.lng,
-                    'speed': b.speed,
-                    'heading': b.heading,
-                    'crowd': b.crowd_status,
-                    'is_online': True
-                })
-            else:
-                live_buses.append({
-                    'bus_no': bus_no_str,
-                    'is_online': False
-                })
-        
-        return jsonify({
-            'success': True,
-            'stop_name': stop_name,
-            'buses': live_buses
-        })
-    except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        lat = float(request.args['lat'])
+        lng = float(request.args['lng'])
+        radius = float(request.args.get('radius', 500))
+        k = int(request.args.get('k', 10))
+    except (KeyError, ValueError):
+        return jsonify({'success': False, 'error': 'lat and lng are required numbers'}), 400
+    if not all(math.isfinite(v) for v in (lat, lng, radius)):
+        return jsonify({'success': False, 'error': 'lat, lng and radius must be finite'}), 400
+
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return jsonify({'success': False, 'error': 'lat/lng out of range'}), 400
+    radius = min(max(radius, 1), 20000)  # Clamp to 20 km
+    k = min(max(k, 1), 100)
+
+    stops = stop_index.nearby(lat, lng, radius, k)
+    return jsonify({
+        'success': True,
+        'lat': lat,
+        'lng': lng,
+        'radius': radius,
+        'stops': stops,
+        'count': len(stops)
+    })
@@ -0,0 +1,108 @@
+"""
+Prefix Autocomplete over Stop Names
+
+Built at route load. Every stop contributes one key per word start of its
+normalized name ('patia square' -> 'patia square', 'square'), so typing any
+word of a name finds it. Keys live in one sorted list; the keys starting
+with a prefix are a contiguous range found with two bisects.
+
+Each key carries its stop's popularity weight (buses serving the stop plus
+the demand recorded in StopRequest counts). A sparse table over the weights
+answers "heaviest key in [lo, hi)" in O(1); top-k pops the best key and
+splits its range in two, so a query costs O(log n + k log k) and never
+sorts the matching range. Equal weights fall back to key order (A-Z).
+
+The index is immutable; build_routes() swaps in a new one.
+"""
+import heapq
+import os
+from bisect import bisect_left
+
+import numpy as np
+
+from server.trigram_index import normalize, bus_sort_key
+
+# Weight of one serving bus relative to one requested seat
+BUS_WEIGHT = float(os.environ.get('AUTOCOMPLETE_BUS_WEIGHT', 5))
+_KEY_END = '\uffff'  # Sorts after any character in a key
+
+
+class AutocompleteIndex:
+    def __init__(self, stop_buses, demand=None):
+        """stop_buses: {stop_name: iterable of bus_no}; demand: {stop_name: count}."""
+        demand = demand or {}
+        self.names = list(stop_buses)
+        self.buses = [sorted({str(b) for b in stop_buses[n]}, key=bus_sort_key) for n in self.names]
+        self.weights = np.array([len(b) * BUS_WEIGHT + demand.get(n, 0)
+                                 for n, b in zip(self.names, self.buses)], dtype=float)
+
+        keyed = []
+        for i, name in enumerate(self.names):
+            norm = normalize(name)
+            keyed.append((norm, i))
+            keyed.extend((norm[j + 1:], i) for j, ch in enumerate(norm) if ch == ' ')
+        keyed.sort()
+        self.keys = [k for k, _ in keyed]
+        self.key_stop = np.array([i for _, i in keyed], dtype=np.int32)
+        self.key_weight = self.weights[self.key_stop] if len(keyed) else np.empty(0)
+
+        # table[j][i] = index of the heaviest key in [i, i + 2**j)
+        level = np.arange(len(self.keys), dtype=np.int32)
+        self.table = [level]
+        span = 1
+        while span * 2 <= len(self.keys):
+            left, right = level[:-span], level[span:]
+            level = np.where(self.key_weight[left] >= self.key_weight[right], left, right)
+            self.table.append(level)
+            span *= 2
+
+    def __len__(self):
+        return len(self.names)
+
+    def _best(self, lo, hi):
+        """Heaviest key in [lo, hi), leftmost on ties."""
+        j = (hi - lo).bit_length() - 1
+        a, b = int(self.table[j][lo]), int(self.table[j][hi - (1 << j)])
+        return a if self.key_weight[a] >= self.key_weight[b] else b
+
+    def prefix_range(self, prefix):
+        lo = bisect_left(self.keys, prefix)
+        hi = bisect_left(self.keys, prefix + _KEY_END, lo)
+        return lo, hi
+
+    def suggest(self, query, k=10):
+        """Top-k [(stop_id, weight)] for keys starting with query (all if empty)."""
+        lo, hi = self.prefix_range(normalize(query))
+        heap, out, seen = [], [], set()
+
+        def push(a, b):
+            if a < b:
+                i = self._best(a, b)
+                heapq.heappush(heap, (-self.key_weight[i], i, a, b))
+
+        push(lo, hi)
+        while heap and len(out) < k:
+            w, i, a, b = heapq.heappop(heap)
+            stop = int(self.key_stop[i])
+            if stop not in seen:  # A name can match through several words
+                seen.add(stop)
+                out.append((stop, -w))
+            push(a, i)
+            push(i + 1, b)
+        return out
+
+    def stats(self):
+        return {
+            'stops': len(self.names),
+            'keys': len(self.keys),
+            'levels': len(self.table),
+            'bus_weight': BUS_WEIGHT
+        }
+
+
+def from_routes(routes_cache, demand=None):
+    stop_buses = {}
+    for bus_no, route in routes_cache.items():
+        for stop in route.get('stops', []):
+            stop_buses.setdefault(stop['stop_name'], set()).add(str(bus_no))
+    return AutocompleteIndex(stop_buses, demand)
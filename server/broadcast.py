@@ -0,0 +1,82 @@
+"""
+Fixed-Rate Broadcast Scheduler
+
+Driver updates only mutate the fleet store; this scheduler drains the
+accumulated deltas once per tick and sends a single coalesced frame, so
+outbound messages per client are capped by the tick rate rather than by
+the number of drivers.
+"""
+import os
+import time
+
+# Normal tick rate and the reduced rate used under load (frames per second)
+TICK_HZ = float(os.environ.get('BROADCAST_TICK_HZ', 1.0))
+LOADED_TICK_HZ = float(os.environ.get('BROADCAST_LOADED_TICK_HZ', 0.5))
+# Active drivers at which the scheduler drops to LOADED_TICK_HZ
+LOAD_THRESHOLD = int(os.environ.get('BROADCAST_LOAD_THRESHOLD', 200))
+
+
+class BroadcastScheduler:
+    def __init__(self, store, send_frame, hz=TICK_HZ, loaded_hz=LOADED_TICK_HZ,
+                 load_threshold=LOAD_THRESHOLD):
+        self.store = store
+        self.send_frame = send_frame  # callable(delta) -> None
+        self.hz = hz
+        self.loaded_hz = loaded_hz
+        self.load_threshold = load_threshold
+
+        self.ticks = 0
+        self.frames_sent = 0
+        self.updates_coalesced = 0
+        self.last_tick_ms = 0.0
+        self.max_tick_ms = 0.0
+        self.overruns = 0
+
+    def is_loaded(self):
+        """Under load when many drivers are live or the last tick ate half its budget."""
+        if self.store.active_count() >= self.load_threshold:
+            return True
+        return self.last_tick_ms > (500.0 / self.hz)
+
+    def interval(self):
+        hz = self.loaded_hz if self.is_loaded() else self.hz
+        return 1.0 / hz
+
+    def tick(self):
+        started = time.monotonic()
+        updates = self.store.writes_since_drain
+        delta = self.store.drain_delta()
+        if delta:
+            self.send_frame(delta)
+            self.frames_sent += 1
+            self.updates_coalesced += updates
+        self.ticks += 1
+        self.last_tick_ms = (time.monotonic() - started) * 1000
+        self.max_tick_ms = max(self.max_tick_ms, self.last_tick_ms)
+        if self.last_tick_ms > 1000.0 / self.hz:
+            self.overruns += 1
+        return delta
+
+    def run(self, sleep):
+        """Loop forever; `sleep` is socketio.sleep so the hub keeps running."""
+        print(f"[INFO] Broadcast tick started at {self.hz} Hz ({self.loaded_hz} Hz under load).")
+        while True:
+            try:
+                sleep(self.interval())
+                self.tick()
+            except Exception as e:
+                print(f"[BROADCAST ERROR] {e}")
+
+    def stats(self):
+        return {
+            'tick_hz': self.hz,
+            'loaded_tick_hz': self.loaded_hz,
+            'loaded': self.is_loaded(),
+            'ticks': self.ticks,
+            'frames_sent': self.frames_sent,
+            'updates_coalesced': self.updates_coalesced,
+            'updates_per_frame': round(self.updates_coalesced / self.frames_sent, 2) if self.frames_sent else 0,
+            'last_tick_ms': round(self.last_tick_ms, 2),
+            'max_tick_ms': round(self.max_tick_ms, 2),
+            'overruns': self.overruns
+        }
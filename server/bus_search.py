@@ -1,137 +1,155 @@
 """
 Bus Stop Fuzzy Search Module
+
+The workbook is compiled once per load into immutable lookup tables, built
+with vectorized groupbys; the DataFrame is dropped afterwards:
+
+    stop_ids       normalized name -> stop id
+    stop_names     stop id -> name
+    stop_coords    stop id -> (lat, lng) of the first row for that stop
+    stop_buses     stop id -> sorted tuple of bus numbers
+    bus_routes     bus_no -> tuple of stop dicts in stop_order
+
+Every query method is then dictionary / tuple lookups. The trigram index
+carries the typo and normalized-key (spelling variant) indexes over the
+same names.
 """
 import pandas as pd
-from difflib import get_close_matches
-from collections import defaultdict
-import sqlite3
 import os
 
+from server.trigram_index import TrigramIndex, normalize
+from server.typo_index import TypoIndex, ranked_search
+from server.variant_index import VariantIndex
+
 class BusStopSearchEngine:
     def __init__(self, excel_path='data/bus_routes.xlsx'):
         """Initialize the search engine with your Excel file"""
         self.excel_path = excel_path
+        self.version = 0  # Bumped on every successful load (result cache key)
+        self._set_tables(self._compile(pd.DataFrame(columns=['bus_no', 'stop_order', 'stop_name', 'lat', 'lng'])))
         # Load immediately if exists
         if os.path.exists(excel_path):
             self.reload_data()
         else:
             print(f"[WARN] Search Engine: Excel file not found at {excel_path}")
-            self.df = pd.DataFrame()
-            self.stop_to_buses = {}
-            self.all_stop_names = []
-            self.all_stop_names_lower = []
 
     def reload_data(self):
         try:
-            self.df = pd.read_excel(self.excel_path)
-            # Ensure types
-            self.df['bus_no'] = self.df['bus_no'].astype(str)
-            
-            self.stop_to_buses = self._build_stop_index()
-            self.all_stop_names = list(self.stop_to_buses.keys())
-            self.all_stop_names_lower = [s.lower() for s in self.all_stop_names]
-            print(f"[INFO] Search Engine Loaded: {len(self.all_stop_names)} stops.")
+            df = pd.read_excel(self.excel_path)
+            tables = self._compile(df)
+            del df
+            # Swap every table at once (a failed load keeps the previous data)
+            self._set_tables(tables)
+            self.version += 1
+            print(f"[INFO] Search Engine Loaded: {len(self.stop_names)} stops.")
         except Exception as e:
             print(f"[ERROR] Search Engine Load Failed: {e}")
 
-    def _build_stop_index(self):
-        """Build index: stop_name -> {bus_no1, bus_no2, ...}"""
-        stop_index = defaultdict(set)
-        
-        for _, row in self.df.iterrows():
-            stop_name = str(row['stop_name']).strip()
-            bus_no = str(row['bus_no']) # Keep as string for consistency
-            stop_index[stop_name].add(bus_no)
-        
-        return stop_index
-    
-    def fuzzy_search(self, query, threshold=0.5, max_results=5):
+    @staticmethod
+    def _compile(df):
+        """Workbook rows -> lookup tables (see module docstring)."""
+        df = df[['bus_no', 'stop_order', 'stop_name', 'lat', 'lng']].copy()
+        # Ensure types
+        df['bus_no'] = df['bus_no'].astype(str) # Keep as string for consistency
+        df['stop_name'] = df['stop_name'].astype(str).str.strip()
+        df['stop_order'] = pd.to_numeric(df['stop_order'], errors='coerce')
+
+        # Stops: first row's coordinates, buses sorted numerically (non-numeric last)
+        stops = df.groupby('stop_name', sort=True).agg(lat=('lat', 'first'), lng=('lng', 'first'))
+        pairs = df[['stop_name', 'bus_no']].drop_duplicates()
+        pairs = pairs.assign(_key=pd.to_numeric(pairs['bus_no'], errors='coerce').fillna(999))
+        pairs = pairs.sort_values(['stop_name', '_key', 'bus_no'], kind='stable')
+        buses = pairs.groupby('stop_name', sort=True)['bus_no'].agg(tuple)
+
+        stop_names = tuple(stops.index)
+        stop_coords = tuple(zip(stops['lat'].astype(float).tolist(), stops['lng'].astype(float).tolist()))
+        stop_buses = tuple(buses.reindex(stops.index).tolist())
+        stop_ids = {}
+        for i, name in enumerate(stop_names):
+            stop_ids.setdefault(normalize(name), i)
+
+        # Routes: one pass over the rows sorted by (bus, stop_order)
+        rows = df.dropna(subset=['stop_order']).sort_values(['bus_no', 'stop_order'], kind='stable')
+        bus_routes = {}
+        for bus_no, group in rows.groupby('bus_no', sort=False):
+            bus_routes[bus_no] = tuple(
+                {'stop_order': int(o), 'stop_name': n, 'lat': float(la), 'lng': float(ln)}
+                for o, n, la, ln in zip(group['stop_order'].tolist(), group['stop_name'].tolist(),
+                                        group['lat'].tolist(), group['lng'].tolist()))
+
+        trigram = TrigramIndex(stop_names, payloads=range(len(stop_names)))
+        trigram.typos = TypoIndex(trigram.names)
+        trigram.variants = VariantIndex(trigram.names)
+
+        return {
+            'stop_ids': stop_ids,
+            'stop_names': stop_names,
+            'stop_coords': stop_coords,
+            'stop_buses': stop_buses,
+            'stop_to_buses': dict(zip(stop_names, stop_buses)),
+            'bus_routes': bus_routes,
+            'trigram': trigram
+        }
+
+    def _set_tables(self, tables):
+        self.stop_ids = tables['stop_ids']
+        self.stop_names = tables['stop_names']
+        self.stop_coords = tables['stop_coords']
+        self.stop_buses = tables['stop_buses']
+        self.stop_to_buses = tables['stop_to_buses']
+        self.bus_routes = tables['bus_routes']
+        self.trigram = tables['trigram']
+        self.all_stop_names = list(self.stop_names)
+
+    def stop_id(self, stop_name):
+        """Stop id for a name (case / spacing / spelling variant insensitive), or None."""
+        stop_id = self.stop_ids.get(normalize(stop_name))
+        if stop_id is None:
+            idx = self.trigram.variants.unique(stop_name)
+            stop_id = self.trigram.payloads[idx] if idx is not None else None
+        return stop_id
+
+    def stop_record(self, stop_id):
+        buses = self.stop_buses[stop_id]
+        lat, lng = self.stop_coords[stop_id]
+        return {
+            'stop_name': self.stop_names[stop_id],
+            'buses': list(buses),
+            'bus_count': len(buses),
+            'lat': lat,
+            'lng': lng
+        }
+
+    def fuzzy_search(self, query, threshold=0.5, max_results=5, max_distance=None):
         """
         Search for stops with fuzzy matching
+        (max_distance: edits allowed per token, default TYPO_MAX_DISTANCE)
         """
         if not query or not query.strip():
             return []
-        
-        # Clean the query
-        query_clean = query.strip().lower()
-        
-        # Find fuzzy matches
-        matches = get_close_matches(
-            query_clean,
-            self.all_stop_names_lower,
-            n=max_results,
-            cutoff=threshold
-        )
-        
-        # Also include direct substring matches (Priority)
-        # e.g. "kiit" matches "kiit square" even if fuzzy score is low
-        substring_matches = [s for s in self.all_stop_names_lower if query_clean in s]
-        
-        # Merge lists (substring first, then fuzzy)
-        final_matches_lower = []
-        seen = set()
-        
-        # Helper to add unique
-        def add_unique(lst):
-            for m in lst:
-                if m not in seen:
-                    final_matches_lower.append(m)
-                    seen.add(m)
-        
-        add_unique(substring_matches)
-        add_unique(matches)
-        
-        # Limit results
-        final_matches_lower = final_matches_lower[:max_results]
+
+        # Prefix, substring, spelling variants, typo-tolerant tokens, then trigram fuzzy
+        matches = ranked_search(self.trigram, self.trigram.typos, query, k=max_results,
+                                cutoff=threshold, max_distance=max_distance,
+                                variants=self.trigram.variants)
 
         # Build results with proper capitalization
-        results = []
-        for match_lower in final_matches_lower:
-            # Find original stop name
-            if match_lower in self.all_stop_names_lower:
-                idx = self.all_stop_names_lower.index(match_lower)
-                original_stop = self.all_stop_names[idx]
-                
-                # Get buses for this stop
-                buses = sorted(list(self.stop_to_buses[original_stop]), key=lambda x: int(x) if x.isdigit() else 999)
-                
-                # Get coordinates (Take first occurrence)
-                stop_data_rows = self.df[self.df['stop_name'] == original_stop]
-                if not stop_data_rows.empty:
-                    stop_data = stop_data_rows.iloc[0]
-                    results.append({
-                        'stop_name': original_stop,
-                        'buses': buses,
-                        'bus_count': len(buses),
-                        'lat': float(stop_data['lat']),
-                        'lng': float(stop_data['lng'])
-                    })
-        
-        return results
-    
+        return [self.stop_record(self.trigram.payloads[idx]) for idx, _, _ in matches]
+
     def get_bus_route(self, bus_no):
         """Get complete route for a specific bus number"""
         bus_no = str(bus_no)
-        bus_data = self.df[self.df['bus_no'] == bus_no].sort_values('stop_order')
-        
-        if bus_data.empty:
+        route = self.bus_routes.get(bus_no)
+
+        if not route:
             return None
-        
-        route = []
-        for _, row in bus_data.iterrows():
-            route.append({
-                'stop_order': int(row['stop_order']),
-                'stop_name': row['stop_name'],
-                'lat': float(row['lat']),
-                'lng': float(row['lng'])
-            })
-        
+
         return {
             'bus_no': bus_no,
             'total_stops': len(route),
-            'stops': route
+            'stops': list(route)
         }
-    
+
     def get_all_stops(self):
         """Get all unique stop names"""
-        return sorted(self.all_stop_names)
+        return list(self.stop_names) # Already sorted
@@ -0,0 +1,328 @@
+"""
+Segment Travel-Time ETA Engine
+
+Learns, per route, how long each stop-to-stop pair takes by hour of day from
+LocationHistory, and combines that with the live progress_m from map
+matching to answer ETA queries from an in-memory table.
+
+Batch job (vectorized): history points are projected onto the route line
+(points x segments in one numpy pass, with a cheap continuity pass to keep
+out-and-back legs apart), stop crossings are interpolated with
+searchsorted over the stop progress array, and pair travel times are
+aggregated with a pandas groupby into running (sum, count) per
+(pair, hour). refresh() only reads rows past the last processed id and a
+per-bus carry point keeps trips that span two batches intact.
+
+Projection runs in chunks of PROJECT_CHUNK points (bounding the points x
+segments arrays), and refresh() takes a `pause` callable (socketio.sleep)
+that is called between chunks and buses so the first 14-day load does not
+hold the event loop. A route reload that changes a bus's stop layout drops
+its profile and re-learns it from the lookback window on the next refresh.
+
+Pairs with fewer than ETA_MIN_SAMPLES observations for an hour fall back to
+the pair's all-day mean, then to distance / ETA_DEFAULT_SPEED.
+"""
+import os
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+LOOKBACK_DAYS = int(os.environ.get('ETA_LOOKBACK_DAYS', 14))
+MIN_SAMPLES = int(os.environ.get('ETA_MIN_SAMPLES', 3))
+DEFAULT_SPEED = float(os.environ.get('ETA_DEFAULT_SPEED', 5.0))  # m/s (~18 km/h)
+UTC_OFFSET_H = float(os.environ.get('ETA_UTC_OFFSET_HOURS', 5.5))  # Profiles use local hours
+REFRESH_S = float(os.environ.get('ETA_REFRESH_S', 300))
+
+SNAP_M = 60.0           # History points further from the route are ignored
+TRIP_GAP_S = 1800       # A gap this long starts a new trip
+TRIP_RESET_M = 300.0    # Progress jumping back this far starts a new trip
+MIN_PAIR_SPEED = 0.3    # m/s; slower pair traversals are breaks, not travel
+HOURS = 24
+PROJECT_CHUNK = 2048    # History points projected per numpy pass
+
+
+def _epoch(ts):
+    return ts.astype('datetime64[ns]').astype(np.int64) / 1e9
+
+
+class EtaEngine:
+    def __init__(self, matcher, min_samples=MIN_SAMPLES, default_speed=DEFAULT_SPEED,
+                 utc_offset_h=UTC_OFFSET_H):
+        self.matcher = matcher
+        self.min_samples = min_samples
+        self.default_speed = default_speed
+        self.utc_offset_s = utc_offset_h * 3600
+
+        self.sums = {}     # bus_no -> (HOURS, pairs) travel seconds
+        self.counts = {}   # bus_no -> (HOURS, pairs) observations
+        self.carry = {}    # bus_no -> (epoch_s, progress_m) of the last projected point
+        self.tables = {}   # bus_no -> {'pair_s': (HOURS, pairs), 'cum': (HOURS, pairs + 1), 'learned': ...}
+        self.layouts = {}  # bus_no -> stop progress tuple the profile was learned on
+        self.relearn = set()  # Buses to re-learn from the lookback window (layout changed)
+
+        self.watermark_id = 0
+        self.loaded = False
+        self.rows_processed = 0
+        self.pairs_observed = 0
+        self.last_refresh_ms = 0.0
+        self.last_refresh_at = None
+
+    # --- Batch job ---
+    def _project(self, geo, lat, lng, prev_progress, pause=None):
+        """Progress (m) along the route for each point; NaN when off route."""
+        out = np.full(len(lat), np.nan)
+        prev = prev_progress
+        for start in range(0, len(lat), PROJECT_CHUNK):
+            if start and pause:
+                pause(0)
+            end = start + PROJECT_CHUNK
+            chunk = self._project_chunk(geo, lat[start:end], lng[start:end], prev)
+            out[start:end] = chunk
+            snapped = chunk[~np.isnan(chunk)]
+            if len(snapped):
+                prev = snapped[-1]  # Continuity carries into the next chunk
+        return out
+
+    def _project_chunk(self, geo, lat, lng, prev):
+        px, py = lng * geo.kx, lat * geo.ky
+        t = ((px[:, None] - geo.ax) * geo.dx + (py[:, None] - geo.ay) * geo.dy)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            t = np.where(geo.len2 > 0, t / geo.len2, 0.0)
+        t = np.clip(t, 0.0, 1.0)
+        dist = np.hypot(geo.ax + t * geo.dx - px[:, None], geo.ay + t * geo.dy - py[:, None])
+        prog = geo.cum[:-1] + t * np.sqrt(geo.len2)
+
+        # Continuity: among near segments take the smallest step forward
+        out = np.full(len(px), np.nan)
+        near = dist < SNAP_M
+        for i in range(len(px)):
+            cand = prog[i][near[i]]
+            if not len(cand):
+                continue
+            if prev is not None and not np.isnan(prev):
+                ahead = cand[cand >= prev - 30]
+                p = ahead.min() if len(ahead) else cand[np.argmin(dist[i][near[i]])]
+            else:
+                p = cand[np.argmin(dist[i][near[i]])]
+            out[i] = p
+            prev = p
+        return out
+
+    def _observe(self, bus_no, times, lat, lng, pause=None):
+        """Add one bus's time-ordered points. Returns pair observations as a DataFrame."""
+        geo = self.matcher.route(bus_no)
+        if geo is None or len(geo.stop_progress) < 2:
+            return None
+        carry = self.carry.get(bus_no)
+        if carry:
+            keep = times > carry[0]
+            times, lat, lng = times[keep], lat[keep], lng[keep]
+        if not len(times):
+            return None
+
+        prog = self._project(geo, lat, lng, carry[1] if carry else None, pause)
+        ok = ~np.isnan(prog)
+        times, prog = times[ok], prog[ok]
+        if not len(times):
+            return None
+        if carry:
+            times = np.concatenate(([carry[0]], times))
+            prog = np.concatenate(([carry[1]], prog))
+        self.carry[bus_no] = (float(times[-1]), float(prog[-1]))
+        if len(times) < 2:
+            return None
+
+        # Stop crossings between consecutive points moving forward
+        sp = np.asarray(geo.stop_progress)
+        t0, t1 = times[:-1], times[1:]
+        p0, p1 = prog[:-1], prog[1:]
+        reset = ((t1 - t0) > TRIP_GAP_S) | (p1 < p0 - TRIP_RESET_M)
+        trip = np.concatenate(([0], np.cumsum(reset)))[:-1]
+        fwd = (p1 > p0) & ~reset
+        lo = np.searchsorted(sp, p0, side='right')
+        hi = np.searchsorted(sp, p1, side='right')
+        n = np.where(fwd, np.maximum(hi - lo, 0), 0)
+        if not n.sum():
+            return None
+        step = np.repeat(np.arange(len(n)), n)
+        stop_k = np.concatenate([np.arange(a, b) for a, b, c in zip(lo, hi, n) if c > 0])
+        frac = (sp[stop_k] - p0[step]) / (p1[step] - p0[step])
+        cross_t = t0[step] + frac * (t1[step] - t0[step])
+        cross_trip = trip[step]
+
+        # Consecutive stops crossed on the same trip -> one pair observation
+        same = (np.diff(stop_k) == 1) & (np.diff(cross_trip) == 0)
+        k = stop_k[:-1][same]
+        dt = np.diff(cross_t)[same]
+        start = cross_t[:-1][same]
+        pair_m = sp[k + 1] - sp[k]
+        valid = (dt > 0) & (dt <= pair_m / MIN_PAIR_SPEED + 300)
+        if not valid.any():
+            return None
+        hour = (((start[valid] + self.utc_offset_s) // 3600) % HOURS).astype(int)
+        return pd.DataFrame({'pair': k[valid], 'hour': hour, 'dt': dt[valid]})
+
+    def ingest(self, df, pause=None):
+        """
+        df: bus_no, timestamp, lat, lng (any order). Updates profiles
+        incrementally; pause(0) is called between buses and projection chunks.
+        """
+        if df is None or df.empty:
+            return 0
+        df = df.dropna(subset=['lat', 'lng', 'timestamp'])
+        df = df.assign(t=_epoch(pd.to_datetime(df['timestamp']).values)).sort_values(['bus_no', 't'])
+        touched = set()
+        for bus_no, g in df.groupby('bus_no', sort=False):
+            if pause:
+                pause(0)
+            obs = self._observe(str(bus_no), g['t'].to_numpy(), g['lat'].to_numpy(float),
+                                g['lng'].to_numpy(float), pause)
+            if obs is None or obs.empty:
+                continue
+            agg = obs.groupby(['hour', 'pair'])['dt'].agg(['sum', 'count']).reset_index()
+            pairs = len(self.matcher.route(bus_no).stop_progress) - 1
+            sums = self.sums.get(bus_no)
+            if sums is None or sums.shape[1] != pairs:
+                sums = self.sums[bus_no] = np.zeros((HOURS, pairs))
+                self.counts[bus_no] = np.zeros((HOURS, pairs))
+            np.add.at(sums, (agg['hour'].to_numpy(), agg['pair'].to_numpy()), agg['sum'].to_numpy())
+            np.add.at(self.counts[bus_no], (agg['hour'].to_numpy(), agg['pair'].to_numpy()), agg['count'].to_numpy())
+            self.pairs_observed += len(obs)
+            touched.add(str(bus_no))
+        self.rows_processed += len(df)
+        for bus_no in touched:
+            self._rebuild(bus_no)
+        return len(df)
+
+    def _rebuild(self, bus_no):
+        """Expected seconds per (hour, pair) with fallbacks, plus per-hour prefix sums."""
+        geo = self.matcher.route(bus_no)
+        if geo is None or len(geo.stop_progress) < 2:
+            self.tables.pop(bus_no, None)
+            return
+        sp = np.asarray(geo.stop_progress)
+        pairs = len(sp) - 1
+        default = np.diff(sp) / self.default_speed
+        sums, counts = self.sums.get(bus_no), self.counts.get(bus_no)
+        if sums is None or sums.shape[1] != pairs:
+            pair_s = np.tile(default, (HOURS, 1))
+            learned = np.zeros((HOURS, pairs), dtype=bool)
+        else:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                hourly = sums / counts
+                all_day = sums.sum(axis=0) / counts.sum(axis=0)
+            fallback = np.where(counts.sum(axis=0) >= self.min_samples, all_day, default)
+            learned = counts >= self.min_samples
+            pair_s = np.where(learned, hourly, fallback)
+        cum = np.concatenate((np.zeros((HOURS, 1)), np.cumsum(pair_s, axis=1)), axis=1)
+        self.tables[bus_no] = {'pair_s': pair_s, 'cum': cum, 'learned': learned}
+
+    def rebuild_all(self):
+        """
+        Routes reloaded: drop profiles whose stop layout changed (or whose
+        route is new) and queue them for re-learning, then rebuild tables.
+        """
+        layouts = {bus_no: tuple(np.round(geo.stop_progress, 1)) for bus_no, geo in self.matcher.routes.items()}
+        for bus_no in set(self.layouts) | set(layouts):
+            if self.layouts.get(bus_no) == layouts.get(bus_no):
+                continue
+            self.sums.pop(bus_no, None)
+            self.counts.pop(bus_no, None)
+            self.carry.pop(bus_no, None)  # Progress was measured on the old line
+            if self.loaded and bus_no in layouts:
+                self.relearn.add(bus_no)
+        self.layouts = layouts
+        self.tables = {}
+        for bus_no in self.matcher.routes:
+            self._rebuild(bus_no)
+
+    def _load_lookback(self, history_store, pause, bus_no=None):
+        end = datetime.utcnow()
+        points = history_store.load_points(end - timedelta(days=LOOKBACK_DAYS), end, bus_no)
+        self.ingest(pd.DataFrame(points, columns=['bus_no', 'timestamp', 'lat', 'lng']), pause)
+
+    def refresh(self, db, LocationHistory, history_store=None, pause=None):
+        """
+        First call: learn from the last ETA_LOOKBACK_DAYS (both history tiers).
+        Later calls: only LocationHistory rows past the id watermark, plus the
+        lookback window of buses whose route layout changed.
+        pause: e.g. socketio.sleep, called with 0 between buses / chunks.
+        Must run inside an app context.
+        """
+        started = time.monotonic()
+        max_id = db.session.execute(text("SELECT coalesce(max(id), 0) FROM location_history")).scalar()
+        if not self.loaded:
+            self.rebuild_all()
+            if history_store is not None:
+                self._load_lookback(history_store, pause)
+            self.loaded = True
+            self.relearn.clear()
+        else:
+            if history_store is not None:
+                for bus_no in list(self.relearn):
+                    self._load_lookback(history_store, pause, bus_no)
+                    self.relearn.discard(bus_no)
+            else:
+                self.relearn.clear()
+            if max_id < self.watermark_id:
+                self.watermark_id = 0  # Table was emptied (ids restart); carry points dedupe
+            with db.engine.connect() as conn:
+                df = pd.read_sql(text("SELECT bus_no, timestamp, lat, lng FROM location_history "
+                                      "WHERE id > :w AND id <= :m"),
+                                 conn, params={'w': self.watermark_id, 'm': max_id})
+            self.ingest(df, pause)
+        self.watermark_id = max_id
+        self.last_refresh_ms = (time.monotonic() - started) * 1000
+        self.last_refresh_at = datetime.utcnow()
+
+    # --- Queries ---
+    def _hour(self, now):
+        return int(((now - datetime(1970, 1, 1)).total_seconds() + self.utc_offset_s) // 3600) % HOURS
+
+    def upcoming(self, bus_no, progress_m, now=None):
+        """[(stop_name, eta_s, learned)] for stops ahead of progress_m on this bus's route."""
+        geo = self.matcher.route(bus_no)
+        if geo is None or progress_m is None:
+            return []
+        table = self.tables.get(str(bus_no))
+        if table is None:
+            self._rebuild(str(bus_no))
+            table = self.tables.get(str(bus_no))
+            if table is None:
+                return []
+        sp = geo.stop_progress
+        h = self._hour(now or datetime.utcnow())
+        pair_s, cum = table['pair_s'][h], table['cum'][h]
+
+        k = int(np.searchsorted(sp, progress_m, side='right')) - 1
+        if k < 0:
+            # Before the first stop: straight distance at the default speed
+            first = (sp[0] - progress_m) / self.default_speed
+            return [(geo.stop_names[j], first + cum[j], bool(j > 0 and table['learned'][h][j - 1]))
+                    for j in range(len(sp))]
+        if k >= len(sp) - 1:
+            return []
+        frac = (progress_m - sp[k]) / (sp[k + 1] - sp[k]) if sp[k + 1] > sp[k] else 1.0
+        to_next = (1 - frac) * pair_s[k]
+        return [(geo.stop_names[j], to_next + cum[j] - cum[k + 1], bool(table['learned'][h][j - 1]))
+                for j in range(k + 1, len(sp))]
+
+    def routes_serving(self, stop_name):
+        return [bus_no for bus_no, geo in self.matcher.routes.items() if stop_name in geo.stop_names]
+
+    def stats(self):
+        learned = sum(int(t['learned'].sum()) for t in self.tables.values())
+        cells = sum(t['learned'].size for t in self.tables.values())
+        return {
+            'routes': len(self.tables),
+            'profile_cells_learned': learned,
+            'profile_cells': cells,
+            'rows_processed': self.rows_processed,
+            'pairs_observed': self.pairs_observed,
+            'watermark_id': self.watermark_id,
+            'last_refresh_ms': round(self.last_refresh_ms, 2),
+            'last_refresh_at': self.last_refresh_at.isoformat() if self.last_refresh_at else None
+        }
@@ -7,6 +7,14 @@ f_db = None
 db = None # Populated by app.py (SQLAlchemy)
 StopRequest = None # Populated by app.py
 ROUTES_CACHE = {} # Populated by app.py
+fleet_store = None # Populated by app.py (FleetStateStore)
+stop_index = None # Rebuilt by app.build_routes (StopIndex)
+stop_search = None # Rebuilt by app.build_routes (TrigramIndex of stop names)
+autocomplete = None # Rebuilt by app.build_routes (AutocompleteIndex)
+routes_version = 0 # Bumped by app.build_routes on every load
+query_cache = None # Populated by app.py (QueryCache)
+eta_engine = None # Populated by app.py (EtaEngine)
+profiler = None # Populated by app.py (Profiler)
 
 def init_firebase():
     global f_db
@@ -0,0 +1,365 @@
+"""
+Live Fleet State Store
+
+Authoritative in-memory view of every bus the socket server knows about.
+Socket handlers read and write records here; SQLite is only touched by the
+background flusher, which persists dirty Bus snapshots in one transaction
+per interval (write-behind). LocationHistory has its own pipeline
+(server/history_ingest.py).
+
+The store also keeps the client-visible entry last published for each bus,
+so every write yields a field-level delta. Deltas accumulate until
+drain_delta() stamps them with the next sequence number.
+
+The full snapshot (published entries + static placeholders for routed buses
+that were never driven) is cached and only rebuilt after a change.
+"""
+import os
+import time
+from datetime import datetime
+
+# Seconds between write-behind flushes (override with FLEET_FLUSH_INTERVAL)
+FLUSH_INTERVAL = float(os.environ.get('FLEET_FLUSH_INTERVAL', 5))
+
+# Record keys persisted to the Bus table (record key == Bus column name)
+BUS_COLUMNS = (
+    'sid', 'lat', 'lng', 'accuracy', 'speed', 'heading', 'last_updated',
+    'is_active', 'crowd_status', 'bus_type', 'driver_name'
+)
+
+# Live-only record keys from map matching (server/map_matching.py), not persisted
+MATCH_FIELDS = ('progress_m', 'next_stop', 'next_stop_m', 'off_route_m')
+
+# Driver-supplied text is cut to the Bus column sizes
+TEXT_LIMITS = {'crowd_status': 20, 'bus_type': 20, 'driver_name': 100}
+
+
+def _text(value, limit):
+    return None if value is None else str(value)[:limit]
+
+
+def bus_entry(rec):
+    """Client-visible (key, entry) for a record, as sent in update payloads."""
+    last_updated = rec['last_updated'].isoformat() if rec['last_updated'] else None
+    if rec['is_active']:
+        return rec['sid'], {
+            'bus_no': rec['bus_no'],
+            'lat': rec['lat'],
+            'lng': rec['lng'],
+            'accuracy': rec['accuracy'],
+            'speed': rec['speed'],
+            'heading': rec['heading'],
+            'crowd': rec['crowd_status'] or 'LOW',
+            'type': rec['bus_type'] or 'HOSTEL',
+            'driver_name': rec['driver_name'] or 'Driver',
+            'last_updated': last_updated,
+            'offline': False,
+            'progress_m': rec.get('progress_m'),
+            'next_stop': rec.get('next_stop'),
+            'off_route_m': rec.get('off_route_m')
+        }
+    # Inactive bus (Ad-hoc or regular) is shown as Offline
+    return f"OFFLINE_DB_{rec['bus_no']}", {
+        'bus_no': rec['bus_no'],
+        'lat': rec['lat'],
+        'lng': rec['lng'],
+        'speed': 0,
+        'crowd': 'LOW',
+        'last_updated': last_updated,
+        'offline': True
+    }
+
+
+def static_entry(bus_no, route_data):
+    """Placeholder (key, entry) for a routed bus that has never been driven."""
+    start_lat = 0
+    start_lng = 0
+    if route_data.get('stops'):
+        start_lat = route_data['stops'][0]['lat']
+        start_lng = route_data['stops'][0]['lng']
+    return f"OFFLINE_STATIC_{bus_no}", {
+        'bus_no': bus_no,
+        'lat': start_lat,
+        'lng': start_lng,
+        'speed': 0,
+        'crowd': 'LOW',
+        'offline': True
+    }
+
+
+class FleetStateStore:
+    def __init__(self, flush_interval=FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self.buses = {}       # bus_no -> record dict (mirrors Bus columns)
+        self.sid_to_bus = {}  # socket sid -> bus_no (live drivers only)
+
+        # Write-behind queues
+        self._dirty = set()   # bus_nos with unflushed changes
+        self._oldest_pending = None  # monotonic time of oldest unflushed change
+
+        # Flush bookkeeping
+        self.last_flush_at = None
+        self.last_flush_ms = 0.0
+        self.last_flush_error = None
+        self.flush_count = 0
+        self.rows_flushed = 0
+
+        # Versioned client model
+        self.seq = 0
+        self._published = {}  # bus_no -> (key, entry) last published
+        self._changed = {}    # key -> changed fields since last drain
+        self._removed = set() # keys removed since last drain
+        self.writes_since_drain = 0
+
+        # Snapshot cache
+        self._static = {}     # bus_no -> (key, entry) from route start stops
+        self._payload = None  # key -> entry, None when stale
+        self._snapshot = None # {'seq', 'buses'} for the current seq
+
+    # --- Loading ---
+    def load(self, Bus):
+        """Hydrate from the Bus table. Must run inside an app context."""
+        for b in Bus.query.all():
+            rec = {'bus_no': b.bus_no}
+            for col in BUS_COLUMNS:
+                rec[col] = getattr(b, col)
+            for f in MATCH_FIELDS:
+                rec[f] = None
+            # Sockets do not survive a restart: anything still marked active
+            # belongs to a dead sid and stays offline until its driver reconnects.
+            if rec['is_active']:
+                rec['is_active'] = False
+                self._mark_dirty(b.bus_no)
+            self.buses[b.bus_no] = rec
+            self._published[b.bus_no] = bus_entry(rec)
+        self._invalidate()
+        print(f"[INFO] Fleet Store Loaded: {len(self.buses)} buses.")
+
+    def set_routes(self, routes_cache):
+        """Precompute placeholders for routed buses; diffs go out as a delta."""
+        static = {bus_no: static_entry(bus_no, route) for bus_no, route in routes_cache.items()}
+        if self._static:  # Reload: clients already hold the old placeholders
+            for bus_no, (key, _) in self._static.items():
+                if bus_no not in static and bus_no not in self.buses:
+                    self._removed.add(key)
+            for bus_no, (key, entry) in static.items():
+                if bus_no not in self.buses and self._static.get(bus_no) != (key, entry):
+                    self._removed.discard(key)
+                    self._changed[key] = entry
+        self._static = static
+        self._invalidate()
+
+    # --- Reads ---
+    def get(self, bus_no):
+        return self.buses.get(bus_no)
+
+    def get_by_sid(self, sid):
+        bus_no = self.sid_to_bus.get(sid)
+        return self.buses.get(bus_no) if bus_no else None
+
+    def records(self):
+        return self.buses.values()
+
+    def active_count(self):
+        return len(self.sid_to_bus)
+
+    def payload(self):
+        """Full client view (key -> entry). Cached; callers must not mutate it."""
+        if self._payload is None:
+            payload = {}
+            for bus_no, (key, entry) in self._static.items():
+                if bus_no not in self.buses:
+                    payload[key] = entry
+            for key, entry in self._published.values():
+                payload[key] = entry
+            self._payload = payload
+        return self._payload
+
+    def snapshot(self):
+        """{'seq', 'buses'} for new clients; one dict read between changes."""
+        if self._snapshot is None or self._snapshot['seq'] != self.seq:
+            self._snapshot = {'seq': self.seq, 'buses': self.payload()}
+        return self._snapshot
+
+    def _invalidate(self):
+        self._payload = None
+        self._snapshot = None
+
+    # --- Writes (called from socket handlers) ---
+    def update_from_driver(self, sid, data, match=None):
+        """
+        Apply a driver_update payload (plus the map-matching result, if any).
+        Returns the updated record.
+        """
+        bus_no = data.get('bus_no')
+        now = datetime.utcnow()
+
+        # Same socket switched to another bus number: release the old one
+        previous = self.sid_to_bus.get(sid)
+        if previous and previous != bus_no:
+            old = self._release(previous)
+            if old:
+                old['sid'] = None  # sid is unique in the Bus table
+
+        rec = self.buses.get(bus_no)
+        if rec is None:
+            rec = {'bus_no': bus_no}
+            for col in BUS_COLUMNS + MATCH_FIELDS:
+                rec[col] = None
+            self.buses[bus_no] = rec
+            # First sighting replaces the route-derived placeholder
+            self._removed.add(f"OFFLINE_STATIC_{bus_no}")
+        elif rec['sid'] and rec['sid'] != sid:
+            # Driver reconnected with a new socket (or took over the bus)
+            self.sid_to_bus.pop(rec['sid'], None)
+
+        rec['sid'] = sid
+        rec['lat'] = data.get('lat')
+        rec['lng'] = data.get('lng')
+        rec['accuracy'] = data.get('accuracy')
+        rec['speed'] = data.get('speed')
+        rec['heading'] = data.get('heading')
+        rec['crowd_status'] = _text(data.get('crowd', 'LOW'), TEXT_LIMITS['crowd_status'])
+        rec['bus_type'] = _text(data.get('type', 'HOSTEL'), TEXT_LIMITS['bus_type'])
+        rec['driver_name'] = _text(data.get('driver_name'), TEXT_LIMITS['driver_name'])
+        for f in MATCH_FIELDS:
+            rec[f] = match.get(f) if match else None
+        rec['is_active'] = True
+        rec['last_updated'] = now
+        self.sid_to_bus[sid] = bus_no
+        self._mark_dirty(bus_no)
+        self._publish(bus_no)
+        return rec
+
+    def deactivate_sid(self, sid):
+        """Mark the bus driven by this socket offline. Returns its record or None."""
+        bus_no = self.sid_to_bus.get(sid)
+        if not bus_no:
+            return None
+        return self._release(bus_no)
+
+    def _release(self, bus_no):
+        rec = self.buses.get(bus_no)
+        if not rec:
+            return None
+        self.sid_to_bus.pop(rec['sid'], None)
+        rec['is_active'] = False
+        self._mark_dirty(bus_no)
+        self._publish(bus_no)
+        return rec
+
+    def _mark_dirty(self, bus_no):
+        self._dirty.add(bus_no)
+        if self._oldest_pending is None:
+            self._oldest_pending = time.monotonic()
+
+    # --- Versioned deltas ---
+    def _publish(self, bus_no):
+        """Diff the record's client entry against the last published one."""
+        self.writes_since_drain += 1
+        key, entry = bus_entry(self.buses[bus_no])
+        prev_key, prev = self._published.get(bus_no, (None, None))
+        if prev_key is not None and prev_key != key:
+            # Online <-> offline transition moves the bus to a new key
+            self._removed.add(prev_key)
+            self._changed.pop(prev_key, None)
+            prev = None
+
+        if prev is None:
+            changes = entry
+        else:
+            changes = {f: v for f, v in entry.items() if prev.get(f) != v}
+
+        self._published[bus_no] = (key, entry)
+        if changes:
+            self._invalidate()
+            self._removed.discard(key)
+            self._changed.setdefault(key, {}).update(changes)
+
+    def drain_delta(self):
+        """
+        Return pending changes as {seq, base, changed, removed} and reset,
+        or None if nothing changed. Fields in 'changed' are absolute values,
+        so re-applying a delta on top of a newer snapshot is harmless.
+        """
+        self.writes_since_drain = 0
+        if not self._changed and not self._removed:
+            return None
+        self.seq += 1
+        delta = {
+            'seq': self.seq,
+            'base': self.seq - 1,
+            'changed': self._changed,
+            'removed': sorted(self._removed)
+        }
+        self._changed = {}
+        self._removed = set()
+        return delta
+
+    # --- Persistence ---
+    def flush(self, db, Bus):
+        """
+        Persist dirty Bus snapshots in one transaction.
+        Must run inside an app context. On failure everything is re-queued.
+        """
+        if not self._dirty:
+            return 0
+
+        dirty, self._dirty = self._dirty, set()
+        oldest, self._oldest_pending = self._oldest_pending, None
+
+        started = time.monotonic()
+        try:
+            rows = {}
+            if dirty:
+                rows = {b.bus_no: b for b in Bus.query.filter(Bus.bus_no.in_(list(dirty))).all()}
+
+            # Released sids first so a sid moving between buses never
+            # collides with the unique constraint mid-transaction.
+            released = [n for n in dirty if not self.buses[n]['is_active']]
+            live = [n for n in dirty if self.buses[n]['is_active']]
+            for batch in (released, live):
+                for bus_no in batch:
+                    rec = self.buses[bus_no]
+                    row = rows.get(bus_no)
+                    if row is None:
+                        row = Bus(bus_no=bus_no)
+                        db.session.add(row)
+                    for col in BUS_COLUMNS:
+                        setattr(row, col, rec[col])
+                db.session.flush()
+
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            self._dirty |= dirty
+            if oldest is not None:
+                self._oldest_pending = oldest
+            self.last_flush_error = str(e)
+            print(f"[FLUSH ERROR] {e}")
+            return 0
+
+        self.last_flush_at = datetime.utcnow()
+        self.last_flush_ms = (time.monotonic() - started) * 1000
+        self.last_flush_error = None
+        self.flush_count += 1
+        self.rows_flushed += len(dirty)
+        return len(dirty)
+
+    def stats(self):
+        lag = 0.0
+        if self._oldest_pending is not None:
+            lag = time.monotonic() - self._oldest_pending
+        return {
+            'buses': len(self.buses),
+            'active': self.active_count(),
+            'dirty_buses': len(self._dirty),
+            'queue_depth': len(self._dirty),
+            'flush_lag_s': round(lag, 3),
+            'flush_interval_s': self.flush_interval,
+            'last_flush_at': self.last_flush_at.isoformat() if self.last_flush_at else None,
+            'last_flush_ms': round(self.last_flush_ms, 2),
+            'last_flush_error': self.last_flush_error,
+            'flush_count': self.flush_count,
+            'rows_flushed': self.rows_flushed
+        }
@@ -0,0 +1,274 @@
+"""
+In-Memory Geofence Engine
+
+Owns the live stop-request state (the StopRequest table becomes its
+write-behind copy) and evaluates arrival / departure for each driver ping
+without touching SQLite.
+
+Each bus has a precomputed stop set: its route stops from ROUTES_CACHE plus
+any requested stops not on the route, held as numpy arrays so one ping is a
+single vectorized haversine over the whole set. Hysteresis:
+    distance < ARRIVAL_M   -> arrived (emit stop_arrival)
+    distance > DEPARTURE_M -> departed (emit stop_reset if students were waiting)
+"""
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+
+ARRIVAL_M = float(os.environ.get('GEOFENCE_ARRIVAL_M', 50))
+DEPARTURE_M = float(os.environ.get('GEOFENCE_DEPARTURE_M', 100))
+EARTH_R = 6371000  # meters
+
+
+class StopSet:
+    """Stops for one bus as parallel arrays (radians) + per-stop arrival flags."""
+
+    def __init__(self, stops):
+        # stops: [(stop_name, lat, lng), ...] with unique names
+        self.names = [s[0] for s in stops]
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.lat = np.radians(np.array([s[1] for s in stops], dtype=float))
+        self.lng = np.radians(np.array([s[2] for s in stops], dtype=float))
+        self.cos_lat = np.cos(self.lat)
+        self.arrived = np.zeros(len(stops), dtype=bool)
+
+    def distances(self, lat, lng):
+        phi, lam = np.radians(lat), np.radians(lng)
+        a = (np.sin((self.lat - phi) / 2) ** 2 +
+             np.cos(phi) * self.cos_lat * np.sin((self.lng - lam) / 2) ** 2)
+        return 2 * EARTH_R * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class GeofenceEngine:
+    def __init__(self, arrival_m=ARRIVAL_M, departure_m=DEPARTURE_M):
+        self.arrival_m = arrival_m
+        self.departure_m = departure_m
+        self.routes = {}      # bus_no -> [(stop_name, lat, lng), ...] from ROUTES_CACHE
+        self.requests = {}    # (bus_no, stop_name) -> {count, lat, lng, is_arrived, last_updated}
+        self.stop_sets = {}   # bus_no -> StopSet (built lazily)
+
+        # Write-behind
+        self._dirty = set()   # (bus_no, stop_name) with unflushed changes
+        self.last_flush_ms = 0.0
+        self.last_flush_error = None
+        self.rows_flushed = 0
+
+        self.pings = 0
+        self.arrivals = 0
+        self.resets = 0
+
+    # --- Loading ---
+    def set_routes(self, routes_cache):
+        """Route stops per bus from ROUTES_CACHE; called whenever it is rebuilt."""
+        routes = {}
+        for bus_no, route in routes_cache.items():
+            stops = []
+            for s in route.get('stops', []):
+                if s.get('lat') is not None and s.get('lng') is not None:
+                    stops.append((s['stop_name'], float(s['lat']), float(s['lng'])))
+            routes[str(bus_no)] = stops
+        self.routes = routes
+        self.stop_sets = {}
+
+    def load(self, StopRequest):
+        """Hydrate request state. Must run inside an app context."""
+        for r in StopRequest.query.all():
+            self.requests[(r.bus_no, r.stop_name)] = {
+                'count': r.count or 0,
+                'lat': r.lat,
+                'lng': r.lng,
+                'is_arrived': bool(r.is_arrived),
+                'last_updated': r.last_updated
+            }
+        self.stop_sets = {}
+        print(f"[INFO] Geofence Loaded: {len(self.requests)} stop requests.")
+
+    def _route_stops(self, bus_no):
+        stops = self.routes.get(str(bus_no))
+        if stops is None:
+            stops = self.routes.get(str(bus_no).strip().upper(), [])
+        return stops
+
+    def _stop_set(self, bus_no):
+        ss = self.stop_sets.get(bus_no)
+        if ss is None:
+            stops, seen = [], set()
+            for name, lat, lng in self._route_stops(bus_no):
+                if name not in seen:
+                    seen.add(name)
+                    stops.append((name, lat, lng))
+            for (b, name), req in self.requests.items():
+                if b == bus_no and name not in seen and req['lat'] is not None and req['lng'] is not None:
+                    seen.add(name)
+                    stops.append((name, req['lat'], req['lng']))
+            ss = StopSet(stops)
+            for i, name in enumerate(ss.names):
+                req = self.requests.get((bus_no, name))
+                ss.arrived[i] = bool(req and req['is_arrived'])
+            self.stop_sets[bus_no] = ss
+        return ss
+
+    # --- Requests (socket handlers) ---
+    def _touch(self, key):
+        self._dirty.add(key)
+
+    def request(self, bus_no, stop_name, lat, lng):
+        """One more student waiting. Returns the request record."""
+        key = (bus_no, stop_name)
+        req = self.requests.get(key)
+        if req is None:
+            req = {'count': 0, 'lat': lat, 'lng': lng, 'is_arrived': False, 'last_updated': None}
+            self.requests[key] = req
+            old = self.stop_sets.get(bus_no)
+            if old is not None and stop_name not in old.index:
+                # New off-route stop: rebuild, keeping arrival flags
+                self.stop_sets.pop(bus_no)
+                ss = self._stop_set(bus_no)
+                for name, i in old.index.items():
+                    ss.arrived[ss.index[name]] = old.arrived[i]
+        req['count'] += 1
+        req['last_updated'] = datetime.utcnow()
+        self._touch(key)
+        return req
+
+    def cancel(self, bus_no, stop_name):
+        """One student fewer. Returns the record, or None if nothing was pending."""
+        key = (bus_no, stop_name)
+        req = self.requests.get(key)
+        if not req or req['count'] <= 0:
+            return None
+        req['count'] -= 1
+        req['last_updated'] = datetime.utcnow()
+        self._touch(key)
+        return req
+
+    def pending(self, bus_no):
+        """[(stop_name, record)] with students waiting for this bus."""
+        return [(name, req) for (b, name), req in self.requests.items()
+                if b == bus_no and req['count'] > 0]
+
+    def expire(self, older_than):
+        """Reset counters not touched since `older_than`. Returns the reset keys."""
+        expired = []
+        for key, req in self.requests.items():
+            if req['count'] > 0 and req['last_updated'] and req['last_updated'] < older_than:
+                req['count'] = 0
+                self._set_arrived(key, False)
+                self._touch(key)
+                expired.append(key)
+        return expired
+
+    def _set_arrived(self, key, value):
+        req = self.requests.get(key)
+        if req is not None and req['is_arrived'] != value:
+            req['is_arrived'] = value
+            self._touch(key)
+        ss = self.stop_sets.get(key[0])
+        if ss is not None and key[1] in ss.index:
+            ss.arrived[ss.index[key[1]]] = value
+
+    # --- Evaluation (driver pings) ---
+    def evaluate(self, bus_no, lat, lng):
+        """
+        Check one position against every stop of the bus.
+        Returns [(event, payload), ...] with event 'stop_arrival' or 'stop_reset'.
+        """
+        if lat is None or lng is None:
+            return []
+        self.pings += 1
+        ss = self._stop_set(bus_no)
+        if not ss.names:
+            return []
+        dist = ss.distances(lat, lng)
+        arriving = np.flatnonzero((dist < self.arrival_m) & ~ss.arrived)
+        departing = np.flatnonzero((dist > self.departure_m) & ss.arrived)
+        if not len(arriving) and not len(departing):
+            return []
+
+        events = []
+        for i in arriving:
+            name = ss.names[i]
+            self._set_arrived((bus_no, name), True)
+            req = self.requests.get((bus_no, name))
+            self.arrivals += 1
+            events.append(('stop_arrival', {
+                'bus_no': bus_no,
+                'stop_name': name,
+                'count': req['count'] if req else 0,
+                'distance_m': round(float(dist[i]), 1)
+            }))
+        for i in departing:
+            name = ss.names[i]
+            key = (bus_no, name)
+            self._set_arrived(key, False)
+            req = self.requests.get(key)
+            if req and req['count'] > 0:
+                req['count'] = 0
+                self._touch(key)
+                self.resets += 1
+                events.append(('stop_reset', {'bus_no': bus_no, 'stop_name': name}))
+        return events
+
+    # --- Persistence ---
+    def flush(self, db, StopRequest):
+        """
+        Persist changed requests in one transaction.
+        Must run inside an app context. On failure everything is re-queued.
+        """
+        if not self._dirty:
+            return 0
+        dirty, self._dirty = self._dirty, set()
+        started = time.monotonic()
+        try:
+            bus_nos = list({b for b, _ in dirty})
+            rows = {(r.bus_no, r.stop_name): r
+                    for r in StopRequest.query.filter(StopRequest.bus_no.in_(bus_nos)).all()}
+            for key in dirty:
+                req = self.requests[key]
+                row = rows.get(key)
+                if row is None:
+                    row = StopRequest(bus_no=key[0], stop_name=key[1])
+                    db.session.add(row)
+                row.count = req['count']
+                row.lat = req['lat']
+                row.lng = req['lng']
+                row.is_arrived = req['is_arrived']
+                if req['last_updated']:
+                    row.last_updated = req['last_updated']
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            self._dirty |= dirty
+            self.last_flush_error = str(e)
+            print(f"[GEOFENCE ERROR] {e}")
+            return 0
+        self.last_flush_ms = (time.monotonic() - started) * 1000
+        self.last_flush_error = None
+        self.rows_flushed += len(dirty)
+        return len(dirty)
+
+    def demand_by_stop(self):
+        """stop_name -> requested seats across all buses (autocomplete weights)."""
+        demand = {}
+        for (_, stop_name), r in self.requests.items():
+            demand[stop_name] = demand.get(stop_name, 0) + (r['count'] or 0)
+        return demand
+
+    def stats(self):
+        return {
+            'arrival_m': self.arrival_m,
+            'departure_m': self.departure_m,
+            'buses_indexed': len(self.stop_sets),
+            'stops_indexed': sum(len(ss.names) for ss in self.stop_sets.values()),
+            'requests': len(self.requests),
+            'waiting': sum(r['count'] for r in self.requests.values()),
+            'pings': self.pings,
+            'arrivals': self.arrivals,
+            'resets': self.resets,
+            'dirty': len(self._dirty),
+            'rows_flushed': self.rows_flushed,
+            'last_flush_ms': round(self.last_flush_ms, 2),
+            'last_flush_error': self.last_flush_error
+        }
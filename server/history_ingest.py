@@ -0,0 +1,158 @@
+"""
+LocationHistory Ingestion Pipeline
+
+handle_driver_update pushes history rows onto a bounded in-memory queue
+and returns immediately. A background writer drains the queue in batches
+and inserts each batch with a single executemany, so GPS history never
+costs a SQLite transaction on the real-time path.
+
+Backpressure when the queue is full:
+    drop_oldest - evict the oldest queued row (default, never blocks)
+    block       - wait up to HISTORY_BLOCK_TIMEOUT for the writer, then drop the new row
+"""
+import os
+import threading  # Patched by gevent: Condition waits yield to the hub
+import time
+from collections import deque
+
+MAX_QUEUE = int(os.environ.get('HISTORY_QUEUE_MAX', 10000))
+BATCH_SIZE = int(os.environ.get('HISTORY_BATCH_SIZE', 500))
+FLUSH_INTERVAL = float(os.environ.get('HISTORY_FLUSH_INTERVAL', 2))
+BACKPRESSURE = os.environ.get('HISTORY_BACKPRESSURE', 'drop_oldest')
+BLOCK_TIMEOUT = float(os.environ.get('HISTORY_BLOCK_TIMEOUT', 1.0))
+
+POLICIES = ('drop_oldest', 'block')
+
+
+class HistoryIngestQueue:
+    def __init__(self, maxsize=MAX_QUEUE, batch_size=BATCH_SIZE,
+                 flush_interval=FLUSH_INTERVAL, policy=BACKPRESSURE,
+                 block_timeout=BLOCK_TIMEOUT):
+        if policy not in POLICIES:
+            print(f"[WARN] Unknown history backpressure '{policy}', using drop_oldest")
+            policy = 'drop_oldest'
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.policy = policy
+        self.block_timeout = block_timeout
+
+        self._rows = deque()
+        self._cond = threading.Condition()
+
+        # Counters
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed_batches = 0
+        self.batches = 0
+        self.last_batch_ms = 0.0
+        self.last_error = None
+
+    def __len__(self):
+        return len(self._rows)
+
+    # --- Producer side (socket handlers) ---
+    def push(self, row):
+        """Queue one LocationHistory row (dict). Returns False if it was dropped."""
+        with self._cond:
+            if len(self._rows) >= self.maxsize:
+                if self.policy == 'block':
+                    self._cond.wait_for(lambda: len(self._rows) < self.maxsize,
+                                        timeout=self.block_timeout)
+                    if len(self._rows) >= self.maxsize:
+                        self.dropped += 1
+                        return False
+                else:
+                    self._rows.popleft()
+                    self.dropped += 1
+
+            self._rows.append(row)
+            self.enqueued += 1
+            if len(self._rows) >= self.batch_size:
+                self._cond.notify_all()  # Wake the writer early
+        return True
+
+    # --- Consumer side (background writer) ---
+    def drain(self, limit=None):
+        """Pop up to `limit` rows (default: one batch)."""
+        limit = limit or self.batch_size
+        with self._cond:
+            n = min(limit, len(self._rows))
+            batch = [self._rows.popleft() for _ in range(n)]
+            if batch:
+                self._cond.notify_all()  # Space freed for blocked producers
+        return batch
+
+    def requeue(self, batch):
+        """Put a failed batch back at the head, respecting maxsize."""
+        with self._cond:
+            room = self.maxsize - len(self._rows)
+            if room < len(batch):
+                self.dropped += len(batch) - max(room, 0)
+                batch = batch[len(batch) - max(room, 0):]
+            self._rows.extendleft(reversed(batch))
+
+    def write_batch(self, db, LocationHistory, batch):
+        """Bulk insert one batch (executemany). Must run inside an app context."""
+        started = time.monotonic()
+        try:
+            db.session.execute(LocationHistory.__table__.insert(), batch)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            self.failed_batches += 1
+            self.last_error = str(e)
+            print(f"[HISTORY ERROR] {e}")
+            return False
+        self.batches += 1
+        self.written += len(batch)
+        self.last_batch_ms = (time.monotonic() - started) * 1000
+        self.last_error = None
+        return True
+
+    def flush(self, db, LocationHistory):
+        """Write everything currently queued. Returns rows written."""
+        total = 0
+        while True:
+            batch = self.drain()
+            if not batch:
+                return total
+            if not self.write_batch(db, LocationHistory, batch):
+                self.requeue(batch)
+                return total
+            total += len(batch)
+            time.sleep(0)  # Let socket greenlets run between batches
+
+    def run(self, app, db, LocationHistory):
+        """Writer loop: wake every flush_interval or as soon as a batch is full."""
+        print(f"[INFO] History writer started (batch={self.batch_size}, "
+              f"interval={self.flush_interval}s, policy={self.policy}).")
+        while True:
+            try:
+                with self._cond:
+                    self._cond.wait_for(lambda: len(self._rows) >= self.batch_size,
+                                        timeout=self.flush_interval)
+                with app.app_context():
+                    self.flush(db, LocationHistory)
+                if self.last_error:
+                    time.sleep(self.flush_interval)  # Back off instead of spinning on a full queue
+            except Exception as e:
+                print(f"[HISTORY ERROR] {e}")
+                time.sleep(self.flush_interval)
+
+    def stats(self):
+        return {
+            'queued': len(self._rows),
+            'max_queue': self.maxsize,
+            'batch_size': self.batch_size,
+            'flush_interval_s': self.flush_interval,
+            'policy': self.policy,
+            'enqueued': self.enqueued,
+            'written': self.written,
+            'dropped': self.dropped,
+            'batches': self.batches,
+            'failed_batches': self.failed_batches,
+            'last_batch_ms': round(self.last_batch_ms, 2),
+            'last_error': self.last_error
+        }
@@ -0,0 +1,262 @@
+"""
+Time-Partitioned History Storage
+
+LocationHistory is the "hot" tier: raw rows for the last HISTORY_HOT_DAYS
+days. compact() moves everything older into HistoryPartition rows, one per
+(day, bus), each holding the day's track as delta-encoded columnar arrays
+(seconds, lat, lng in 1e-6 degrees) compressed with zlib.
+
+Partitions older than HISTORY_DOWNSAMPLE_DAYS are downsampled to one point
+per HISTORY_DOWNSAMPLE_SECONDS, and retention drops whole partitions older
+than HISTORY_RETENTION_DAYS instead of deleting rows one by one.
+"""
+import calendar
+import os
+import sys
+import time
+import zlib
+from array import array
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+HOT_DAYS = int(os.environ.get('HISTORY_HOT_DAYS', 1))
+DOWNSAMPLE_DAYS = int(os.environ.get('HISTORY_DOWNSAMPLE_DAYS', 7))
+DOWNSAMPLE_SECONDS = int(os.environ.get('HISTORY_DOWNSAMPLE_SECONDS', 30))
+RETENTION_DAYS = int(os.environ.get('HISTORY_RETENTION_DAYS', 30))
+
+COORD_SCALE = 1_000_000  # 1e-6 degrees ~ 0.11 m
+
+
+def to_epoch(dt):
+    return calendar.timegm(dt.utctimetuple())
+
+
+def from_epoch(seconds):
+    return datetime.utcfromtimestamp(seconds)
+
+
+def _le_bytes(arr):
+    if sys.byteorder != 'little':
+        arr = array(arr.typecode, arr)
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def _from_le(typecode, raw):
+    arr = array(typecode)
+    arr.frombytes(raw)
+    if sys.byteorder != 'little':
+        arr.byteswap()
+    return arr
+
+
+def encode_track(points):
+    """
+    points: sorted [(epoch_s, lat, lng), ...] -> (t0, blob).
+    Layout: zlib(count:u32 | dt[u32] | dlat[i32] | dlng[i32]), all deltas.
+    """
+    t0 = points[0][0]
+    dts, dlats, dlngs = array('I'), array('i'), array('i')
+    prev_t, prev_lat, prev_lng = t0, 0, 0
+    for t, lat, lng in points:
+        qlat, qlng = round(lat * COORD_SCALE), round(lng * COORD_SCALE)
+        dts.append(t - prev_t)
+        dlats.append(qlat - prev_lat)
+        dlngs.append(qlng - prev_lng)
+        prev_t, prev_lat, prev_lng = t, qlat, qlng
+    raw = _le_bytes(array('I', [len(points)])) + _le_bytes(dts) + _le_bytes(dlats) + _le_bytes(dlngs)
+    return t0, zlib.compress(raw, 9)
+
+
+def decode_track(t0, blob):
+    """Inverse of encode_track -> [(epoch_s, lat, lng), ...]"""
+    raw = zlib.decompress(blob)
+    n = _from_le('I', raw[:4])[0]
+    size = 4 * n
+    dts = _from_le('I', raw[4:4 + size])
+    dlats = _from_le('i', raw[4 + size:4 + 2 * size])
+    dlngs = _from_le('i', raw[4 + 2 * size:4 + 3 * size])
+    points = []
+    t, qlat, qlng = t0, 0, 0
+    for i in range(n):
+        t += dts[i]
+        qlat += dlats[i]
+        qlng += dlngs[i]
+        points.append((t, qlat / COORD_SCALE, qlng / COORD_SCALE))
+    return points
+
+
+def downsample(points, resolution_s):
+    """Keep the first point of every resolution_s bucket."""
+    kept, last_bucket = [], None
+    for p in points:
+        bucket = p[0] // resolution_s
+        if bucket != last_bucket:
+            kept.append(p)
+            last_bucket = bucket
+    return kept
+
+
+class HistoryStore:
+    def __init__(self, db, LocationHistory, HistoryPartition, hot_days=HOT_DAYS,
+                 downsample_days=DOWNSAMPLE_DAYS, downsample_s=DOWNSAMPLE_SECONDS,
+                 retention_days=RETENTION_DAYS):
+        self.db = db
+        self.LocationHistory = LocationHistory
+        self.HistoryPartition = HistoryPartition
+        self.hot_days = max(1, hot_days)  # 0 would compact today's live rows
+        self.downsample_days = downsample_days
+        self.downsample_s = downsample_s
+        self.retention_days = retention_days
+        self.last_compaction = None
+
+    def ensure_indexes(self):
+        """Indexes declared on the model only apply to new databases."""
+        with self.db.engine.begin() as conn:
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_location_history_bus_no ON location_history (bus_no)"))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_location_history_timestamp ON location_history (timestamp)"))
+
+    # --- Cutoffs (all UTC calendar days) ---
+    def _day_start(self, now, days_ago):
+        today = datetime(now.year, now.month, now.day)
+        return today - timedelta(days=days_ago)
+
+    # --- Compaction ---
+    def compact(self, now=None):
+        """
+        Fold cold raw rows into partitions, downsample aging partitions and
+        drop expired ones. Must run inside an app context. Returns a report.
+        """
+        now = now or datetime.utcnow()
+        started = time.monotonic()
+        hot_cutoff = self._day_start(now, self.hot_days - 1)
+        downsample_day = self._day_start(now, self.downsample_days).strftime('%Y-%m-%d')
+        retention_cutoff = self._day_start(now, self.retention_days)
+        retention_day = retention_cutoff.strftime('%Y-%m-%d')
+        report = {'partitions_written': 0, 'rows_compacted': 0, 'partitions_downsampled': 0,
+                  'partitions_dropped': 0, 'raw_rows_expired': 0}
+
+        session = self.db.session
+        LH, HP = self.LocationHistory, self.HistoryPartition
+
+        # 1. Retention: whole partitions + any raw rows that were never compacted
+        report['partitions_dropped'] = HP.query.filter(HP.day < retention_day).delete(synchronize_session=False)
+        report['raw_rows_expired'] = LH.query.filter(LH.timestamp < retention_cutoff).delete(synchronize_session=False)
+        session.commit()
+
+        # 2. Cold raw rows -> one partition per (day, bus), one transaction per day
+        days = [r[0] for r in session.execute(
+            text("SELECT DISTINCT date(timestamp) FROM location_history WHERE timestamp < :cutoff ORDER BY 1"),
+            {'cutoff': hot_cutoff}
+        ) if r[0]]
+        for day in days:
+            day_start = datetime.strptime(day, '%Y-%m-%d')
+            day_end = day_start + timedelta(days=1)
+            rows = (session.query(LH.bus_no, LH.timestamp, LH.lat, LH.lng)
+                    .filter(LH.timestamp >= day_start, LH.timestamp < day_end)
+                    .order_by(LH.bus_no, LH.timestamp).all())
+            tracks = {}
+            for bus_no, ts, lat, lng in rows:
+                if lat is None or lng is None or ts is None:
+                    continue
+                tracks.setdefault(bus_no, []).append((to_epoch(ts), lat, lng))
+
+            resolution = self.downsample_s if day <= downsample_day else 0
+            for bus_no, points in tracks.items():
+                self._write_partition(day, bus_no, points, resolution)
+                report['partitions_written'] += 1
+            LH.query.filter(LH.timestamp >= day_start, LH.timestamp < day_end).delete(synchronize_session=False)
+            session.commit()
+            report['rows_compacted'] += len(rows)
+            time.sleep(0)  # Yield to socket greenlets between days
+
+        # 3. Partitions that aged past the downsampling threshold
+        aging = HP.query.filter(HP.day <= downsample_day, HP.resolution_s == 0).all()
+        for part in aging:
+            points = downsample(decode_track(part.t0, part.data), self.downsample_s)
+            part.t0, part.data = encode_track(points)
+            part.point_count = len(points)
+            part.resolution_s = self.downsample_s
+            report['partitions_downsampled'] += 1
+        session.commit()
+
+        report['elapsed_ms'] = round((time.monotonic() - started) * 1000, 2)
+        self.last_compaction = {'at': now.isoformat(), **report}
+        return report
+
+    def _write_partition(self, day, bus_no, points, resolution):
+        """Create or merge the (day, bus) partition."""
+        HP = self.HistoryPartition
+        part = HP.query.filter_by(day=day, bus_no=bus_no).first()
+        raw_count = len(points)
+        if part:
+            # Late rows for an already-compacted day: merge and re-encode
+            points = sorted(decode_track(part.t0, part.data) + points)
+            raw_count += part.raw_count or 0
+            resolution = max(resolution, part.resolution_s or 0)
+        else:
+            part = HP(day=day, bus_no=bus_no)
+            self.db.session.add(part)
+        if resolution:
+            points = downsample(points, resolution)
+        part.t0, part.data = encode_track(points)
+        part.point_count = len(points)
+        part.raw_count = raw_count
+        part.resolution_s = resolution
+        part.created_at = datetime.utcnow()
+
+    # --- Reads ---
+    def load_points(self, start, end, bus_no=None):
+        """
+        All stored points in [start, end) across both tiers, as
+        [(bus_no, datetime, lat, lng), ...] ordered by bus then time.
+        """
+        LH, HP = self.LocationHistory, self.HistoryPartition
+        out = []
+        q = HP.query.filter(HP.day >= start.strftime('%Y-%m-%d'), HP.day <= end.strftime('%Y-%m-%d'))
+        if bus_no:
+            q = q.filter(HP.bus_no == bus_no)
+        t_start, t_end = to_epoch(start), to_epoch(end)
+        for part in q.order_by(HP.bus_no, HP.day).all():
+            for t, lat, lng in decode_track(part.t0, part.data):
+                if t_start <= t < t_end:
+                    out.append((part.bus_no, from_epoch(t), lat, lng))
+
+        q = self.db.session.query(LH.bus_no, LH.timestamp, LH.lat, LH.lng).filter(
+            LH.timestamp >= start, LH.timestamp < end)
+        if bus_no:
+            q = q.filter(LH.bus_no == bus_no)
+        out.extend(tuple(r) for r in q.all())
+        out.sort(key=lambda r: (r[0], r[1]))
+        return out
+
+    def stats(self):
+        """Storage report for both tiers. Must run inside an app context."""
+        session = self.db.session
+        raw_rows, raw_oldest = session.execute(
+            text("SELECT count(*), min(timestamp) FROM location_history")).one()
+        parts, points, raw_folded, blob_bytes, oldest_day, newest_day = session.execute(text(
+            "SELECT count(*), coalesce(sum(point_count), 0), coalesce(sum(raw_count), 0), "
+            "coalesce(sum(length(data)), 0), min(day), max(day) FROM history_partition")).one()
+        # ~Row cost in the raw table: id + bus_no + 2 floats + timestamp text
+        raw_row_bytes = 8 + 4 + 16 + 26
+        db_path = self.db.engine.url.database
+        return {
+            'hot_rows': raw_rows,
+            'hot_oldest': str(raw_oldest) if raw_oldest else None,
+            'partitions': parts,
+            'partition_points': points,
+            'partition_raw_rows': raw_folded,
+            'partition_bytes': blob_bytes,
+            'bytes_per_point': round(blob_bytes / points, 2) if points else 0,
+            'compression_vs_raw': round((raw_folded * raw_row_bytes) / blob_bytes, 1) if blob_bytes else 0,
+            'oldest_day': oldest_day,
+            'newest_day': newest_day,
+            'db_file_bytes': os.path.getsize(db_path) if db_path and os.path.exists(db_path) else None,
+            'hot_days': self.hot_days,
+            'downsample_after_days': self.downsample_days,
+            'downsample_seconds': self.downsample_s,
+            'retention_days': self.retention_days,
+            'last_compaction': self.last_compaction
+        }
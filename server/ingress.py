@@ -0,0 +1,150 @@
+"""
+Driver Ingress Control
+
+Dead-band filter in front of handle_driver_update: a fix is only applied
+(store, history, geofence, broadcast) when the bus moved at least
+INGRESS_MIN_MOVE_M, turned by INGRESS_MIN_HEADING_DEG, changed speed by
+INGRESS_MIN_SPEED_DELTA, changed crowd/type/driver, or INGRESS_KEEPALIVE_S
+passed since the last applied fix.
+
+It also picks the ping interval each driver should use (slow when parked,
+fast when moving, stretched while the broadcast tick is under load) and
+tells the driver only when it changes.
+"""
+import math
+import os
+import time
+
+MIN_MOVE_M = float(os.environ.get('INGRESS_MIN_MOVE_M', 8))
+MIN_HEADING_DEG = float(os.environ.get('INGRESS_MIN_HEADING_DEG', 20))
+MIN_SPEED_DELTA = float(os.environ.get('INGRESS_MIN_SPEED_DELTA', 2.0))  # m/s
+KEEPALIVE_S = float(os.environ.get('INGRESS_KEEPALIVE_S', 30))
+
+# Ping intervals (ms) by speed band, and the multiplier under load
+PING_PARKED_MS = int(os.environ.get('PING_PARKED_MS', 15000))
+PING_SLOW_MS = int(os.environ.get('PING_SLOW_MS', 5000))
+PING_MOVING_MS = int(os.environ.get('PING_MOVING_MS', 3000))
+PING_FAST_MS = int(os.environ.get('PING_FAST_MS', 2000))
+PING_LOAD_FACTOR = float(os.environ.get('PING_LOAD_FACTOR', 2.0))
+
+PARKED_MPS = 0.5
+SLOW_MPS = 4.0    # ~15 km/h
+FAST_MPS = 12.0   # ~43 km/h
+
+STATE_FIELDS = ('crowd', 'type', 'driver_name')
+
+
+def _distance_m(lat1, lng1, lat2, lng2):
+    dy = (lat2 - lat1) * 110540.0
+    dx = (lng2 - lng1) * 111320.0 * math.cos(math.radians(lat1))
+    return math.hypot(dx, dy)
+
+
+def _num(v):
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return None
+
+
+class IngressFilter:
+    def __init__(self, min_move_m=MIN_MOVE_M, min_heading_deg=MIN_HEADING_DEG,
+                 min_speed_delta=MIN_SPEED_DELTA, keepalive_s=KEEPALIVE_S):
+        self.min_move_m = min_move_m
+        self.min_heading_deg = min_heading_deg
+        self.min_speed_delta = min_speed_delta
+        self.keepalive_s = keepalive_s
+
+        self.last = {}          # bus_no -> last applied fix {t, lat, lng, speed, heading, ...}
+        self.speed_est = {}     # bus_no -> m/s (reported, or derived from applied fixes)
+        self.sent_interval = {} # sid -> ping interval (ms) last sent
+
+        self.received = 0
+        self.dropped = 0
+        self.reasons = {}       # why fixes were accepted
+
+    def accept(self, bus_no, data, force=False):
+        """True if this fix should be applied; remembers it if so."""
+        self.received += 1
+        now = time.monotonic()
+        lat, lng = _num(data.get('lat')), _num(data.get('lng'))
+        speed, heading = _num(data.get('speed')), _num(data.get('heading'))
+        last = self.last.get(bus_no)
+
+        reason = None
+        if force or last is None:
+            reason = 'session'
+        elif any(data.get(f) != last.get(f) for f in STATE_FIELDS):
+            reason = 'state'
+        elif now - last['t'] >= self.keepalive_s:
+            reason = 'keepalive'
+        elif lat is None or lng is None or last['lat'] is None or last['lng'] is None:
+            reason = 'position' if (lat, lng) != (last['lat'], last['lng']) else None
+        elif _distance_m(last['lat'], last['lng'], lat, lng) >= self.min_move_m:
+            reason = 'moved'
+        elif (speed is not None and last['speed'] is not None and
+              abs(speed - last['speed']) >= self.min_speed_delta):
+            reason = 'speed'
+        elif heading is not None and last['heading'] is not None:
+            turn = abs((heading - last['heading'] + 180) % 360 - 180)
+            if turn >= self.min_heading_deg:
+                reason = 'heading'
+
+        if reason is None:
+            self.dropped += 1
+            return False
+
+        if speed is None and last and lat is not None and last['lat'] is not None and now > last['t']:
+            speed_est = _distance_m(last['lat'], last['lng'], lat, lng) / (now - last['t'])
+        else:
+            speed_est = speed or 0.0
+        self.speed_est[bus_no] = speed_est
+        fix = {'t': now, 'lat': lat, 'lng': lng, 'speed': speed, 'heading': heading}
+        for f in STATE_FIELDS:
+            fix[f] = data.get(f)
+        self.last[bus_no] = fix
+        self.reasons[reason] = self.reasons.get(reason, 0) + 1
+        return True
+
+    def ping_interval(self, bus_no, loaded=False):
+        speed = self.speed_est.get(bus_no, 0.0)
+        if speed < PARKED_MPS:
+            ms = PING_PARKED_MS
+        elif speed < SLOW_MPS:
+            ms = PING_SLOW_MS
+        elif speed < FAST_MPS:
+            ms = PING_MOVING_MS
+        else:
+            ms = PING_FAST_MS
+        if loaded:
+            ms = int(ms * PING_LOAD_FACTOR)
+        # Parked buses must still beat the keepalive
+        return min(ms, int(self.keepalive_s * 1000))
+
+    def instruction(self, sid, bus_no, loaded=False):
+        """Interval (ms) to send to this driver, or None if unchanged."""
+        ms = self.ping_interval(bus_no, loaded)
+        if self.sent_interval.get(sid) == ms:
+            return None
+        self.sent_interval[sid] = ms
+        return ms
+
+    def forget(self, sid, bus_no=None):
+        """Driver session ended: the next fix starts a new session."""
+        self.sent_interval.pop(sid, None)
+        if bus_no is not None:
+            self.last.pop(bus_no, None)
+            self.speed_est.pop(bus_no, None)
+
+    def stats(self):
+        accepted = self.received - self.dropped
+        return {
+            'received': self.received,
+            'accepted': accepted,
+            'dropped': self.dropped,
+            'drop_ratio': round(self.dropped / self.received, 3) if self.received else 0,
+            'accepted_by_reason': dict(self.reasons),
+            'min_move_m': self.min_move_m,
+            'keepalive_s': self.keepalive_s,
+            'drivers_instructed': len(self.sent_interval)
+        }
@@ -0,0 +1,200 @@
+"""
+Map Matching / Linear Referencing
+
+Snaps live bus positions onto their route polyline (ROUTES_CACHE[bus]['path']).
+Each route is precomputed once into projected segment arrays (metres), the
+cumulative distance at each vertex, a grid of segments per cell, and the
+progress of every stop along the line.
+
+Per ping the matcher first checks a small window of segments around the
+bus's last match (the common case, O(1)); only if that fails does it look up
+the grid cells around the position. Buses further than MATCH_MAX_SNAP_M from
+any nearby segment are reported off-route without a full scan. next_stop is
+a bisect over the sorted stop progress array.
+"""
+import math
+import os
+from bisect import bisect_right
+
+import numpy as np
+
+# A window match closer than this is accepted without a grid lookup
+MATCH_WINDOW_M = float(os.environ.get('MATCH_WINDOW_M', 40))
+# Segments checked behind / ahead of the last match
+MATCH_WINDOW_BACK = 2
+MATCH_WINDOW_AHEAD = int(os.environ.get('MATCH_WINDOW_AHEAD', 8))
+# Grid cell edge (m) and the snapping radius; further away = off route
+MATCH_CELL_M = float(os.environ.get('MATCH_CELL_M', 100))
+MATCH_MAX_SNAP_M = float(os.environ.get('MATCH_MAX_SNAP_M', 300))
+# A stop counts as passed once progress is within this distance of it
+STOP_PASSED_M = 15.0
+
+EARTH_R = 6371000  # meters
+
+
+class RouteGeometry:
+    def __init__(self, path, stops, cell_m=MATCH_CELL_M):
+        pts = np.array([(float(p[0]), float(p[1])) for p in path
+                        if p[0] is not None and p[1] is not None], dtype=float)
+        self.lat0 = float(pts[:, 0].mean())
+        self.kx = EARTH_R * math.radians(1) * math.cos(math.radians(self.lat0))
+        self.ky = EARTH_R * math.radians(1)
+        x, y = pts[:, 1] * self.kx, pts[:, 0] * self.ky
+
+        # Segment i runs from vertex i to vertex i + 1
+        self.ax, self.ay = x[:-1], y[:-1]
+        self.dx, self.dy = np.diff(x), np.diff(y)
+        self.len2 = self.dx ** 2 + self.dy ** 2
+        seg_len = np.sqrt(self.len2)
+        self.cum = np.concatenate(([0.0], np.cumsum(seg_len)))
+        self.length = float(self.cum[-1])
+        self.n = len(self.ax)
+
+        # Grid: cell -> segment indices whose bounding box touches it
+        self.cell_m = cell_m
+        self.grid = {}
+        for i in range(self.n):
+            x0, x1 = sorted((x[i], x[i + 1]))
+            y0, y1 = sorted((y[i], y[i + 1]))
+            for cy in range(int(math.floor(y0 / cell_m)), int(math.floor(y1 / cell_m)) + 1):
+                for cx in range(int(math.floor(x0 / cell_m)), int(math.floor(x1 / cell_m)) + 1):
+                    self.grid.setdefault((cy, cx), []).append(i)
+        self.grid = {k: np.array(v, dtype=np.int64) for k, v in self.grid.items()}
+
+        # Stop progress, projected in stop order so loops map to the right leg
+        self.stop_names, self.stop_progress = [], []
+        seg_from = 0
+        for s in stops:
+            if s.get('lat') is None or s.get('lng') is None or not self.n:
+                continue
+            px, py = float(s['lng']) * self.kx, float(s['lat']) * self.ky
+            idx = np.arange(seg_from, self.n)
+            seg, dist, prog = self._nearest(idx, px, py)
+            if seg is None:
+                continue
+            seg_from = seg
+            self.stop_names.append(s['stop_name'])
+            self.stop_progress.append(prog)
+        # Keep the array sorted for bisect even if stop_order and path disagree
+        order = sorted(range(len(self.stop_progress)), key=lambda i: self.stop_progress[i])
+        self.stop_names = [self.stop_names[i] for i in order]
+        self.stop_progress = [self.stop_progress[i] for i in order]
+
+    def _nearest(self, idx, px, py):
+        """Closest of the given segments -> (segment, distance_m, progress_m)."""
+        if not len(idx):
+            return None, None, None
+        ax, ay, dx, dy, len2 = self.ax[idx], self.ay[idx], self.dx[idx], self.dy[idx], self.len2[idx]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            t = np.where(len2 > 0, ((px - ax) * dx + (py - ay) * dy) / len2, 0.0)
+        t = np.clip(t, 0.0, 1.0)
+        d = np.hypot(ax + t * dx - px, ay + t * dy - py)
+        j = int(np.argmin(d))
+        seg = int(idx[j])
+        progress = float(self.cum[seg] + t[j] * math.sqrt(len2[j]))
+        return seg, float(d[j]), progress
+
+    def grid_candidates(self, px, py, radius_m):
+        r = int(math.ceil(radius_m / self.cell_m))
+        cx0, cy0 = int(math.floor(px / self.cell_m)), int(math.floor(py / self.cell_m))
+        found = [self.grid[(cy, cx)]
+                 for cy in range(cy0 - r, cy0 + r + 1)
+                 for cx in range(cx0 - r, cx0 + r + 1)
+                 if (cy, cx) in self.grid]
+        if not found:
+            return np.empty(0, dtype=np.int64)
+        return np.unique(np.concatenate(found))
+
+    def next_stop(self, progress):
+        i = bisect_right(self.stop_progress, progress + STOP_PASSED_M)
+        if i >= len(self.stop_names):
+            return None, None
+        return self.stop_names[i], self.stop_progress[i] - progress
+
+
+class MapMatcher:
+    def __init__(self):
+        self.routes = {}     # bus_no -> RouteGeometry
+        self.last_seg = {}   # bus_no -> last matched segment
+
+        self.matches = 0
+        self.window_hits = 0
+        self.grid_hits = 0
+        self.off_route = 0
+
+    def set_routes(self, routes_cache):
+        """Precompute geometry for every route; swapped in as one dict."""
+        routes = {}
+        for bus_no, route in routes_cache.items():
+            path = route.get('path') or []
+            if len(path) >= 2:
+                try:
+                    routes[str(bus_no)] = RouteGeometry(path, route.get('stops', []))
+                except Exception as e:
+                    print(f"[WARN] Map matching skipped route {bus_no}: {e}")
+        self.routes = routes
+        self.last_seg = {}
+
+    def route(self, bus_no):
+        """RouteGeometry for a bus number (exact key, then normalized)."""
+        geo = self.routes.get(str(bus_no))
+        if geo is None:
+            geo = self.routes.get(str(bus_no).strip().upper())
+        return geo
+
+    def match(self, bus_no, lat, lng):
+        """
+        {'progress_m', 'next_stop', 'next_stop_m', 'off_route_m'} for a fix,
+        or None if the bus has no route geometry.
+        """
+        geo = self.route(bus_no)
+        if geo is None or lat is None or lng is None or not geo.n:
+            return None
+        self.matches += 1
+        px, py = float(lng) * geo.kx, float(lat) * geo.ky
+
+        best = window = None
+        last = self.last_seg.get(bus_no)
+        if last is not None:
+            lo = max(0, last - MATCH_WINDOW_BACK)
+            hi = min(geo.n, last + MATCH_WINDOW_AHEAD + 1)
+            window = geo._nearest(np.arange(lo, hi), px, py)
+            if window[0] is not None and window[1] <= MATCH_WINDOW_M:
+                best = window
+                self.window_hits += 1
+
+        if best is None:
+            grid = geo._nearest(geo.grid_candidates(px, py, MATCH_MAX_SNAP_M), px, py)
+            found = [m for m in (window, grid) if m is not None and m[0] is not None]
+            if found:
+                best = min(found, key=lambda m: m[1])
+                self.grid_hits += best is grid
+
+        if best is None or best[1] > MATCH_MAX_SNAP_M:
+            self.off_route += 1
+            self.last_seg.pop(bus_no, None)
+            return {'progress_m': None, 'next_stop': None, 'next_stop_m': None,
+                    'off_route_m': MATCH_MAX_SNAP_M}  # At least this far
+
+        seg, dist, progress = best
+        self.last_seg[bus_no] = seg
+        next_stop, next_m = geo.next_stop(progress)
+        return {
+            'progress_m': round(progress, 1),
+            'next_stop': next_stop,
+            'next_stop_m': round(next_m, 1) if next_m is not None else None,
+            'off_route_m': round(dist, 1)
+        }
+
+    def forget(self, bus_no):
+        self.last_seg.pop(bus_no, None)
+
+    def stats(self):
+        return {
+            'routes': len(self.routes),
+            'segments': sum(g.n for g in self.routes.values()),
+            'matches': self.matches,
+            'window_hits': self.window_hits,
+            'grid_hits': self.grid_hits,
+            'off_route': self.off_route
+        }
@@ -0,0 +1,301 @@
+"""
+Prometheus Metrics
+
+Counters, additive gauges and histograms rendered on /metrics in the
+Prometheus text format (no client library needed).
+
+Recording is lock-free: every greenlet writes into its own shard (a plain
+dict keyed by (metric, label values)), looked up through getcurrent(). A
+scrape sums the shards; shards of finished greenlets (Socket.IO runs each
+event in a fresh one) are folded into a base total at scrape time, or once
+METRICS_MAX_SHARDS are open. Gevent only switches greenlets at I/O, so a
+shard is never written while it is being read.
+"""
+import functools
+import os
+import time
+import weakref
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from greenlet import getcurrent
+
+MAX_SHARDS = int(os.environ.get('METRICS_MAX_SHARDS', 512))
+PREFIX = 'bus_tracker_'
+
+# Seconds: 0.5 ms .. 10 s
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Bytes: 64 B .. 1 MB
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+
+class Registry:
+    def __init__(self, max_shards=MAX_SHARDS):
+        self.max_shards = max_shards
+        self.metrics = []
+        self.shards = {}   # id(greenlet) -> (weakref to greenlet, {key: value})
+        self.base = {}     # Totals folded in from finished greenlets
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def shard(self):
+        """This greenlet's dict of (name, labels) -> float | histogram list."""
+        g = getcurrent()
+        entry = self.shards.get(id(g))
+        if entry is not None:
+            if entry[0]() is g:
+                return entry[1]
+            _merge(self.base, entry[1])  # id reused by a new greenlet
+        elif len(self.shards) >= self.max_shards:
+            self.fold()
+        data = {}
+        self.shards[id(g)] = (weakref.ref(g), data)
+        return data
+
+    def fold(self):
+        """Move the shards of finished greenlets into the base totals."""
+        for key, (ref, data) in list(self.shards.items()):
+            g = ref()
+            if g is None or g.dead:
+                _merge(self.base, data)
+                del self.shards[key]
+
+    def collect(self):
+        self.fold()
+        totals = {}
+        _merge(totals, self.base)
+        for _, data in list(self.shards.values()):
+            _merge(totals, data)
+        return totals
+
+    def render(self):
+        totals = self.collect()
+        by_name = {}
+        for (name, labels), value in totals.items():
+            by_name.setdefault(name, []).append((labels, value))
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render(sorted(by_name.get(metric.name, ()), key=lambda x: x[0])))
+        return '\n'.join(lines) + '\n'
+
+    def stats(self):
+        return {'metrics': len(self.metrics), 'open_shards': len(self.shards),
+                'base_series': len(self.base)}
+
+
+def _merge(into, data):
+    for key, value in list(data.items()):
+        if isinstance(value, list):
+            cur = into.get(key)
+            if cur is None:
+                into[key] = list(value)
+            else:
+                for i, v in enumerate(value):
+                    cur[i] += v
+        else:
+            into[key] = into.get(key, 0) + value
+
+
+def _escape(v):
+    return str(v).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _num(v):
+    if v == float('inf'):
+        return '+Inf'
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, registry, name, help_text, labelnames=()):
+        self.registry = registry
+        self.name = PREFIX + name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        registry.register(self)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        data = self.registry.shard()
+        key = (self.name, labels)
+        data[key] = data.get(key, 0) + amount
+
+    def render(self, series):
+        return self.header() + [f"{self.name}{_labels(self.labelnames, l)} {_num(v)}" for l, v in series]
+
+
+class Gauge(Counter):
+    """Additive gauge (inc/dec from any greenlet; shards sum to the current value)."""
+    kind = 'gauge'
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+class GaugeFunc(_Metric):
+    """Gauge read from a callback at scrape time."""
+    kind = 'gauge'
+
+    def __init__(self, registry, name, help_text, fn):
+        super().__init__(registry, name, help_text)
+        self.fn = fn
+
+    def render(self, series):
+        try:
+            value = self.fn()
+        except Exception:
+            return []
+        if value is None:
+            return []
+        return self.header() + [f"{self.name} {_num(value)}"]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, registry, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(registry, name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        data = self.registry.shard()
+        key = (self.name, labels)
+        h = data.get(key)
+        if h is None:
+            # [count, sum, per-bucket counts..., overflow]
+            h = data[key] = [0, 0.0] + [0] * (len(self.buckets) + 1)
+        h[0] += 1
+        h[1] += value
+        h[2 + bisect_left(self.buckets, value)] += 1
+
+    @contextmanager
+    def time(self, *labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def render(self, series):
+        lines = self.header()
+        for labels, h in series:
+            cumulative = 0
+            for le, n in zip(self.buckets + (float('inf'),), h[2:]):
+                cumulative += n
+                bucket = _labels(self.labelnames, labels, 'le="%s"' % _num(le))
+                lines.append(f"{self.name}_bucket{bucket} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_num(h[1])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {h[0]}")
+        return lines
+
+
+REGISTRY = Registry()
+
+# --- Application metrics ---
+SOCKET_EVENT_SECONDS = Histogram(REGISTRY, 'socketio_event_seconds',
+                                 'Socket.IO event handler duration', ('event',))
+SOCKET_EVENT_ERRORS = Counter(REGISTRY, 'socketio_event_errors_total',
+                              'Socket.IO event handlers that raised', ('event',))
+SOCKETS_CONNECTED = Gauge(REGISTRY, 'sockets_connected',
+                          'Connected Socket.IO clients by role', ('role',))
+HTTP_REQUEST_SECONDS = Histogram(REGISTRY, 'http_request_seconds',
+                                 'HTTP request duration by Flask endpoint',
+                                 ('endpoint', 'method', 'status'))
+DB_COMMIT_SECONDS = Histogram(REGISTRY, 'db_commit_seconds',
+                              'SQLAlchemy session commit duration (flush + commit)')
+BROADCAST_FRAME_BYTES = Histogram(REGISTRY, 'broadcast_frame_bytes',
+                                  'Size of each global bus_delta frame (while binary clients take it)', ('encoding',),
+                                  buckets=SIZE_BUCKETS)
+EXTERNAL_CALL_SECONDS = Histogram(REGISTRY, 'external_call_seconds',
+                                  'Groq / Firestore / FCM call duration',
+                                  ('service', 'operation', 'outcome'))
+
+SOCKET_ROLES = ('driver', 'student', 'admin')
+
+
+def socket_role(value):
+    """Role sent by the client in io({query: {role}}); anything else is 'unknown'."""
+    return value if value in SOCKET_ROLES else 'unknown'
+
+
+def timed_event(event):
+    """Decorator for Socket.IO handlers: duration histogram + error counter."""
+    def wrap(fn):
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                SOCKET_EVENT_ERRORS.inc(event)
+                raise
+            finally:
+                SOCKET_EVENT_SECONDS.observe(time.perf_counter() - start, event)
+        return inner
+    return wrap
+
+
+@contextmanager
+def external_call(service, operation):
+    """Time a call to an outside service; outcome is 'ok' or 'error'."""
+    start = time.perf_counter()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'ok'
+    finally:
+        EXTERNAL_CALL_SECONDS.observe(time.perf_counter() - start, service, operation, outcome)
+
+
+def init_app(app, db):
+    """HTTP request timing hooks, DB commit timing and the /metrics route."""
+    from flask import Response, g, request
+    from sqlalchemy import event
+
+    @app.before_request
+    def _start_timer():
+        g._metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _observe_request(response):
+        start = g.pop('_metrics_start', None)
+        if start is not None:
+            endpoint = request.endpoint or 'unmatched'
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint, request.method,
+                                         f"{response.status_code // 100}xx")
+        return response
+
+    @event.listens_for(db.session, 'before_commit')
+    def _commit_start(session):
+        session.info['_metrics_commit'] = time.perf_counter()
+
+    @event.listens_for(db.session, 'after_commit')
+    def _commit_end(session):
+        start = session.info.pop('_metrics_commit', None)
+        if start is not None:
+            DB_COMMIT_SECONDS.observe(time.perf_counter() - start)
+
+    @event.listens_for(db.session, 'after_rollback')
+    def _commit_failed(session):
+        session.info.pop('_metrics_commit', None)
+
+    @app.route('/metrics')
+    def metrics():
+        return Response(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
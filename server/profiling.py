@@ -0,0 +1,340 @@
+"""
+On-Demand Profiling
+
+Three tools for looking inside the live gevent server without a restart,
+driven from the admin blueprint:
+
+- SamplingProfiler: a native OS thread (not a greenlet, so it keeps ticking
+  while the hub is blocked) reads sys._current_frames() PROFILE_SAMPLE_HZ
+  times a second for a fixed duration and counts root-first stacks. Output
+  is the collapsed format flamegraph.pl / speedscope read directly.
+- RequestProfiler: armed with a path prefix, wraps the next matching HTTP
+  requests in cProfile and keeps the marshalled pstats for download.
+  cProfile hooks the OS thread, so greenlets that run while the request
+  waits on I/O are counted too; only one capture runs at a time.
+- LoopLagMonitor: a greenlet that sleeps a fixed interval and records how
+  late it wakes up. Lag is time the hub spent running someone else's code.
+
+dump_greenlets() formats the stack of every live greenlet and thread.
+"""
+import cProfile
+import gc
+import io
+import itertools
+import marshal
+import os
+import pstats
+import sys
+import time
+import traceback
+from collections import Counter, deque
+
+try:
+    from gevent import monkey as _monkey
+    _start_thread = _monkey.get_original('_thread', 'start_new_thread')
+    _get_ident = _monkey.get_original('_thread', 'get_ident')
+    _real_sleep = _monkey.get_original('time', 'sleep')
+    _allocate_lock = _monkey.get_original('_thread', 'allocate_lock')
+except ImportError:
+    import _thread
+    _start_thread, _get_ident, _real_sleep = _thread.start_new_thread, _thread.get_ident, time.sleep
+    _allocate_lock = _thread.allocate_lock
+
+SAMPLE_HZ = float(os.environ.get('PROFILE_SAMPLE_HZ', 100))
+MAX_SAMPLE_S = float(os.environ.get('PROFILE_MAX_SECONDS', 300))
+MAX_CAPTURES = int(os.environ.get('PROFILE_MAX_CAPTURES', 20))
+LAG_INTERVAL = float(os.environ.get('PROFILE_LAG_INTERVAL', 0.5))
+LAG_WINDOW = 240  # Samples kept (2 minutes at the default interval)
+
+# Leaf frames that mean "waiting": the hub's loop, and idle threadpool workers
+_IDLE_LEAVES = ('run (hub.py:', 'acquire_with_timeout (_threading.py:')
+
+
+def _frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _is_idle(stack):
+    return stack.rsplit(';', 1)[-1].startswith(_IDLE_LEAVES)
+
+
+def _collapse(frame):
+    """Root-first 'a;b;c' for a frame chain."""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame.f_code).replace(';', ':'))
+        frame = frame.f_back
+    labels.reverse()
+    return ';'.join(labels)
+
+
+class SamplingProfiler:
+    def __init__(self, hz=SAMPLE_HZ):
+        self.hz = hz
+        self.samples = Counter()
+        # The sampler thread writes samples while greenlets read them: an OS
+        # lock (held only for a tick's update / a copy) keeps both consistent
+        self._lock = _allocate_lock()
+        self.running = False
+        self.started_at = None
+        self.stopped_at = None
+        self.duration_s = 0.0
+        self.taken = 0
+        self._run_id = 0
+
+    def start(self, duration_s, hz=None):
+        """Start sampling for duration_s seconds; False if already running."""
+        if self.running:
+            return False
+        self.hz = float(hz or self.hz)
+        self.duration_s = max(0.1, min(float(duration_s), MAX_SAMPLE_S))
+        with self._lock:
+            self.samples = Counter()
+        self.taken = 0
+        self.started_at, self.stopped_at = time.time(), None
+        self.running = True
+        self._run_id += 1
+        _start_thread(self._run, (self._run_id,))
+        return True
+
+    def stop(self):
+        if self.running:
+            self.running = False
+            self.stopped_at = time.time()
+
+    def _run(self, run_id):
+        me = _get_ident()
+        interval = 1.0 / self.hz
+        deadline = time.monotonic() + self.duration_s
+        while self.running and self._run_id == run_id and time.monotonic() < deadline:
+            stacks = [_collapse(frame) for ident, frame in sys._current_frames().items() if ident != me]
+            with self._lock:
+                self.samples.update(stacks)
+            self.taken += 1
+            _real_sleep(interval)
+        if self._run_id == run_id and self.running:
+            self.running = False
+            self.stopped_at = time.time()
+
+    def snapshot(self):
+        """Copy of the stack counts, safe to iterate while sampling runs."""
+        with self._lock:
+            return Counter(self.samples)
+
+    def collapsed(self, include_idle=False):
+        """Flamegraph input: one 'stack count' line per distinct stack."""
+        lines = []
+        for stack, n in self.snapshot().most_common():
+            if not include_idle and _is_idle(stack):
+                continue
+            lines.append(f"{stack} {n}")
+        return '\n'.join(lines) + '\n'
+
+    def stats(self):
+        samples = self.snapshot()
+        idle = sum(n for s, n in samples.items() if _is_idle(s))
+        return {
+            'running': self.running,
+            'hz': self.hz,
+            'duration_s': self.duration_s,
+            'started_at': self.started_at,
+            'stopped_at': self.stopped_at,
+            'ticks': self.taken,
+            'stacks': len(samples),
+            'samples': sum(samples.values()),
+            'idle_samples': idle
+        }
+
+
+class RequestProfiler:
+    def __init__(self, max_captures=MAX_CAPTURES):
+        self.captures = deque(maxlen=max_captures)  # Newest last
+        self.prefix = None
+        self.remaining = 0
+        self.expires_at = None
+        self._active = None
+        self._ids = itertools.count(1)
+
+    def arm(self, prefix, count=1, ttl_s=600):
+        """Profile the next `count` requests whose path starts with prefix."""
+        self.prefix = prefix
+        self.remaining = max(1, int(count))
+        self.expires_at = time.time() + ttl_s
+        return self.status()
+
+    def disarm(self):
+        self.prefix, self.remaining, self.expires_at = None, 0, None
+
+    def _wants(self, path):
+        if self.prefix is None or self._active is not None:
+            return False
+        if self.expires_at and time.time() > self.expires_at:
+            self.disarm()
+            return False
+        return path.startswith(self.prefix)
+
+    def begin(self, path):
+        """Start a capture if this request matches; returns a token for finish()."""
+        if not self._wants(path):
+            return None
+        prof = cProfile.Profile()
+        self._active = prof
+        self.remaining -= 1
+        if self.remaining <= 0:
+            self.prefix = None
+        prof.enable()
+        return (prof, path, time.perf_counter())
+
+    def finish(self, token, method, status):
+        prof, path, start = token
+        prof.disable()
+        self._active = None
+        elapsed = time.perf_counter() - start
+        prof.create_stats()
+        self.captures.append({
+            'id': next(self._ids),
+            'path': path,
+            'method': method,
+            'status': status,
+            'duration_ms': round(elapsed * 1000, 2),
+            'captured_at': time.time(),
+            'pstats': marshal.dumps(prof.stats)  # Same bytes Stats.dump_stats writes
+        })
+
+    def get(self, capture_id):
+        for c in self.captures:
+            if c['id'] == capture_id:
+                return c
+        return None
+
+    def status(self):
+        return {
+            'armed_prefix': self.prefix,
+            'remaining': self.remaining,
+            'expires_at': self.expires_at,
+            'active': self._active is not None,
+            'captures': [{k: v for k, v in c.items() if k != 'pstats'} for c in self.captures]
+        }
+
+
+class _LoadedStats:
+    """What pstats.Stats expects from a profiler: create_stats() + .stats."""
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+def summarize_pstats(data, limit=25, sort='cumulative'):
+    """Top functions of a marshalled capture as text (pstats print_stats)."""
+    out = io.StringIO()
+    pstats.Stats(_LoadedStats(marshal.loads(data)), stream=out).sort_stats(sort).print_stats(limit)
+    return out.getvalue()
+
+
+class LoopLagMonitor:
+    def __init__(self, interval=LAG_INTERVAL):
+        self.interval = interval
+        self.lags = deque(maxlen=LAG_WINDOW)
+        self.worst = 0.0
+        self.worst_at = None
+        self.running = False
+
+    def run(self, sleep):
+        """Background task; `sleep` is socketio.sleep (yields to the hub)."""
+        self.running = True
+        while True:
+            start = time.perf_counter()
+            sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - start - self.interval)
+            self.lags.append(lag)
+            if lag > self.worst:
+                self.worst, self.worst_at = lag, time.time()
+
+    def current(self):
+        return self.lags[-1] if self.lags else None
+
+    def stats(self):
+        lags = sorted(self.lags)
+        n = len(lags)
+        return {
+            'running': self.running,
+            'interval_s': self.interval,
+            'window': n,
+            'last_ms': round(self.lags[-1] * 1000, 2) if n else None,
+            'p50_ms': round(lags[n // 2] * 1000, 2) if n else None,
+            'p99_ms': round(lags[min(n - 1, int(n * 0.99))] * 1000, 2) if n else None,
+            'max_window_ms': round(lags[-1] * 1000, 2) if n else None,
+            'max_ever_ms': round(self.worst * 1000, 2),
+            'max_ever_at': self.worst_at
+        }
+
+
+def dump_greenlets():
+    """Text dump of every OS thread and live greenlet stack."""
+    from greenlet import greenlet, getcurrent
+    current = getcurrent()
+    out = []
+    for ident, frame in sys._current_frames().items():
+        out.append(f"--- Thread {ident} ---")
+        out.extend(line.rstrip('\n') for line in traceback.format_stack(frame))
+    count = 0
+    for obj in gc.get_objects():
+        if not isinstance(obj, greenlet) or obj.dead:
+            continue
+        count += 1
+        name = getattr(obj, 'name', None) or type(obj).__name__
+        target = getattr(obj, '_run', None) or getattr(obj, 'run', None)
+        target = getattr(target, '__qualname__', repr(target))
+        out.append(f"--- Greenlet {name} ({target}) {hex(id(obj))}"
+                   f"{' [current]' if obj is current else ''} ---")
+        if obj is current:
+            out.append('  (this request)')
+        elif obj.gr_frame is not None:
+            out.extend(line.rstrip('\n') for line in traceback.format_stack(obj.gr_frame))
+        else:
+            out.append('  (not started)')
+    out.insert(0, f"{count} live greenlets")
+    return '\n'.join(out) + '\n'
+
+
+class Profiler:
+    """The three tools behind one object (server.extensions.profiler)."""
+
+    def __init__(self):
+        self.sampler = SamplingProfiler()
+        self.requests = RequestProfiler()
+        self.loop_lag = LoopLagMonitor()
+
+    def init_app(self, app):
+        from flask import g, request
+
+        @app.before_request
+        def _profile_begin():
+            token = self.requests.begin(request.path)
+            if token is not None:
+                g._profile_token = token
+
+        @app.after_request
+        def _profile_end(response):
+            token = g.pop('_profile_token', None)
+            if token is not None:
+                self.requests.finish(token, request.method, response.status_code)
+            return response
+
+        @app.teardown_request
+        def _profile_abort(exc=None):
+            # after_request is skipped when an exception propagates
+            token = g.pop('_profile_token', None)
+            if token is not None:
+                self.requests.finish(token, request.method, 500)
+
+    def stats(self):
+        return {
+            'sampler': self.sampler.stats(),
+            'requests': {k: v for k, v in self.requests.status().items() if k != 'captures'},
+            'captures': len(self.requests.captures),
+            'loop_lag': self.loop_lag.stats()
+        }
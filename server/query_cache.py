@@ -0,0 +1,101 @@
+"""
+Query Result Cache
+
+A bounded LRU + TTL cache for the JSON bodies of the stop search endpoints,
+so the same popular prefixes ("kiit", "patia") are answered without running
+the search or serializing the result again.
+
+Entries are grouped in namespaces (one per endpoint) and keyed on
+(namespace, data version, normalized query). The version is the route data
+version (build_routes) or the search engine's reload counter: a lookup with a
+newer version than the namespace has seen drops the namespace's old entries,
+and a result computed against old data can never be served after a reload.
+
+Limits are entry count and total body bytes; both evict least recently used.
+Gevent only switches greenlets on I/O, so the dict operations need no lock.
+"""
+import os
+import time
+from collections import OrderedDict
+
+MAX_ENTRIES = int(os.environ.get('QUERY_CACHE_MAX_ENTRIES', 5000))
+MAX_BYTES = int(os.environ.get('QUERY_CACHE_MAX_BYTES', 16 * 1024 * 1024))
+TTL_S = float(os.environ.get('QUERY_CACHE_TTL_S', 300))
+# Stop status includes live bus positions: keep it about one broadcast tick
+STATUS_TTL_S = float(os.environ.get('QUERY_CACHE_STATUS_TTL_S', 1))
+
+
+class QueryCache:
+    def __init__(self, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES, ttl_s=TTL_S):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_s = ttl_s
+        self.entries = OrderedDict()  # (ns, version, key) -> (expires_at, body)
+        self.versions = {}            # ns -> newest version seen
+        self.bytes = 0
+
+        self.hits = {}
+        self.misses = {}
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def _check_version(self, ns, version):
+        if self.versions.get(ns, version) != version:
+            # New data loaded: everything cached for this namespace is stale
+            stale = [k for k in self.entries if k[0] == ns]
+            for k in stale:
+                self._drop(k)
+            self.invalidations += 1
+        self.versions[ns] = version
+
+    def _drop(self, k):
+        _, body = self.entries.pop(k)
+        self.bytes -= len(body)
+
+    def get(self, ns, version, key):
+        """Cached body (bytes) or None."""
+        self._check_version(ns, version)
+        k = (ns, version, key)
+        entry = self.entries.get(k)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self.entries.move_to_end(k)
+                self.hits[ns] = self.hits.get(ns, 0) + 1
+                return entry[1]
+            self._drop(k)
+            self.expirations += 1
+        self.misses[ns] = self.misses.get(ns, 0) + 1
+        return None
+
+    def put(self, ns, version, key, body, ttl_s=None):
+        if self.versions.get(ns) != version or len(body) > self.max_bytes:
+            return  # Computed against data that has since been replaced
+        k = (ns, version, key)
+        if k in self.entries:
+            self._drop(k)
+        self.entries[k] = (time.monotonic() + (ttl_s or self.ttl_s), body)
+        self.bytes += len(body)
+        while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+            self._drop(next(iter(self.entries)))
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.bytes = 0
+
+    def stats(self):
+        hits, misses = sum(self.hits.values()), sum(self.misses.values())
+        return {
+            'entries': len(self.entries),
+            'bytes': self.bytes,
+            'max_entries': self.max_entries,
+            'max_bytes': self.max_bytes,
+            'hits': dict(self.hits),
+            'misses': dict(self.misses),
+            'hit_rate': round(hits / (hits + misses), 3) if hits + misses else None,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'invalidations': self.invalidations,
+            'versions': dict(self.versions)
+        }
@@ -0,0 +1,122 @@
+"""
+Spatial Index over All Stops
+
+Built from ROUTES_CACHE whenever routes load. Unique stops (name + position)
+are projected to local metres (equirectangular around the mean latitude),
+sorted by grid cell and stored as flat numpy arrays with a cell -> slice
+table, so a radius query only looks at the cells the circle overlaps.
+
+The index is immutable: build_routes() constructs a new one and swaps the
+reference in server.extensions, so readers never see a half-built index.
+"""
+import math
+import os
+
+import numpy as np
+
+# Grid cell edge in metres
+CELL_M = float(os.environ.get('STOP_INDEX_CELL_M', 250))
+EARTH_R = 6371000  # meters
+
+
+class StopIndex:
+    def __init__(self, routes_cache, cell_m=CELL_M):
+        self.cell_m = cell_m
+
+        # Unique stops -> buses serving them
+        stops = {}
+        for bus_no, route in routes_cache.items():
+            for s in route.get('stops', []):
+                lat, lng = s.get('lat'), s.get('lng')
+                if lat is None or lng is None or (isinstance(lat, float) and math.isnan(lat)):
+                    continue
+                key = (s['stop_name'], round(float(lat), 6), round(float(lng), 6))
+                stops.setdefault(key, set()).add(str(bus_no))
+
+        keys = list(stops)
+        lat = np.array([k[1] for k in keys], dtype=float)
+        lng = np.array([k[2] for k in keys], dtype=float)
+        self.lat0 = float(lat.mean()) if len(keys) else 0.0
+        self.kx = EARTH_R * math.radians(1) * math.cos(math.radians(self.lat0))
+        self.ky = EARTH_R * math.radians(1)
+        x, y = lng * self.kx, lat * self.ky
+
+        # Sort everything by cell so each cell is one contiguous slice
+        cx = np.floor(x / cell_m).astype(np.int64)
+        cy = np.floor(y / cell_m).astype(np.int64)
+        order = np.lexsort((cx, cy))
+        self.x, self.y = x[order], y[order]
+        self.lat, self.lng = lat[order], lng[order]
+        self.names = [keys[i][0] for i in order]
+        self.buses = [sorted(stops[keys[i]]) for i in order]
+
+        # (cy, cx) -> (start, end) from the run boundaries of the sorted cells
+        cy, cx = cy[order], cx[order]
+        bounds = np.flatnonzero((np.diff(cy) != 0) | (np.diff(cx) != 0)) + 1
+        starts = np.concatenate(([0], bounds)).tolist() if len(order) else []
+        ends = np.concatenate((bounds, [len(order)])).tolist() if len(order) else []
+        self.cells = {(int(cy[s]), int(cx[s])): (s, e) for s, e in zip(starts, ends)}
+
+    def __len__(self):
+        return len(self.names)
+
+    def _candidates(self, qx, qy, radius):
+        r = int(math.ceil(radius / self.cell_m))
+        if (2 * r + 1) ** 2 >= len(self.cells):
+            return None  # Circle covers most occupied cells: scan everything
+        c0x, c0y = int(math.floor(qx / self.cell_m)), int(math.floor(qy / self.cell_m))
+        slices = []
+        for cy in range(c0y - r, c0y + r + 1):
+            for cx in range(c0x - r, c0x + r + 1):
+                span = self.cells.get((cy, cx))
+                if span:
+                    slices.append(np.arange(span[0], span[1]))
+        if not slices:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(slices)
+
+    def nearby(self, lat, lng, radius=500, k=10):
+        """
+        Up to k stops within radius metres of (lat, lng), closest first:
+        [{stop_name, lat, lng, distance_m, buses}, ...]
+        """
+        if not self.names:
+            return []
+        qx, qy = lng * self.kx, lat * self.ky
+        idx = self._candidates(qx, qy, radius)
+        if idx is None:
+            d = np.hypot(self.x - qx, self.y - qy)
+            idx = np.flatnonzero(d <= radius)
+            d = d[idx]
+        else:
+            d = np.hypot(self.x[idx] - qx, self.y[idx] - qy)
+            keep = d <= radius
+            idx, d = idx[keep], d[keep]
+        if len(idx) > k:
+            part = np.argpartition(d, k - 1)[:k]
+            idx, d = idx[part], d[part]
+        order = np.argsort(d, kind='stable')
+
+        # Exact great-circle distance for the few stops returned
+        phi, lam = math.radians(lat), math.radians(lng)
+        results = []
+        for j in order:
+            i = int(idx[j])
+            p2, l2 = math.radians(self.lat[i]), math.radians(self.lng[i])
+            a = (math.sin((p2 - phi) / 2) ** 2 +
+                 math.cos(phi) * math.cos(p2) * math.sin((l2 - lam) / 2) ** 2)
+            results.append({
+                'stop_name': self.names[i],
+                'lat': float(self.lat[i]),
+                'lng': float(self.lng[i]),
+                'distance_m': round(2 * EARTH_R * math.asin(math.sqrt(min(a, 1.0))), 1),
+                'buses': self.buses[i]
+            })
+        return results
+
+    def stats(self):
+        return {
+            'stops': len(self.names),
+            'cells': len(self.cells),
+            'cell_m': self.cell_m
+        }
@@ -0,0 +1,120 @@
+"""
+Online Trajectory Compression
+
+Streaming per-bus simplifier applied before history rows are queued.
+Each bus keeps an anchor (the last stored point) and a window of pending
+points. A new fix extends the window as long as every pending point lies
+within TRAJECTORY_TOLERANCE_M of where linear interpolation between the
+anchor and the new fix puts it *at that point's timestamp* (synchronized
+Euclidean distance). Otherwise the newest pending point is stored and
+becomes the anchor (opening-window simplification).
+
+Because the check is time-synchronized, a bus idling at a light or a stop
+keeps its arrival and departure points, so replays and ETA profiles can be
+reconstructed within the tolerance in both space and time.
+"""
+import math
+import os
+
+TOLERANCE_M = float(os.environ.get('TRAJECTORY_TOLERANCE_M', 10))
+# Pending points per bus before the window is force-closed
+MAX_WINDOW = int(os.environ.get('TRAJECTORY_MAX_WINDOW', 60))
+# Store at least one point per bus this often (seconds), even when stationary
+MAX_GAP_S = float(os.environ.get('TRAJECTORY_MAX_GAP_S', 120))
+
+M_PER_DEG_LAT = 110540.0
+M_PER_DEG_LNG = 111320.0
+
+
+def sed_m(anchor, point, current):
+    """Distance (m) from `point` to its time-interpolated position on anchor -> current."""
+    a_t, a_lat, a_lng = anchor
+    t, lat, lng = point
+    c_t, c_lat, c_lng = current
+    span = (c_t - a_t).total_seconds()
+    frac = (t - a_t).total_seconds() / span if span > 0 else 0.0
+    exp_lat = a_lat + (c_lat - a_lat) * frac
+    exp_lng = a_lng + (c_lng - a_lng) * frac
+    dy = (lat - exp_lat) * M_PER_DEG_LAT
+    dx = (lng - exp_lng) * M_PER_DEG_LNG * math.cos(math.radians(a_lat))
+    return math.hypot(dx, dy)
+
+
+class TrajectoryCompressor:
+    def __init__(self, tolerance_m=TOLERANCE_M, max_window=MAX_WINDOW, max_gap_s=MAX_GAP_S):
+        self.tolerance_m = tolerance_m
+        self.max_window = max_window
+        self.max_gap_s = max_gap_s
+        self.anchors = {}   # bus_no -> (timestamp, lat, lng) last stored
+        self.windows = {}   # bus_no -> [(timestamp, lat, lng), ...] pending
+        self.received = {}  # bus_no -> fixes seen
+        self.kept = {}      # bus_no -> fixes stored
+
+    def _row(self, bus_no, point):
+        self.kept[bus_no] = self.kept.get(bus_no, 0) + 1
+        self.anchors[bus_no] = point
+        return {'bus_no': bus_no, 'lat': point[1], 'lng': point[2], 'timestamp': point[0]}
+
+    def add(self, bus_no, timestamp, lat, lng):
+        """Feed one fix. Returns the LocationHistory rows (dicts) to store now."""
+        if lat is None or lng is None:
+            return []
+        self.received[bus_no] = self.received.get(bus_no, 0) + 1
+        point = (timestamp, lat, lng)
+        anchor = self.anchors.get(bus_no)
+        if anchor is None:
+            self.windows[bus_no] = []
+            return [self._row(bus_no, point)]
+
+        window = self.windows[bus_no]
+        gap = (timestamp - anchor[0]).total_seconds()
+        fits = (gap <= self.max_gap_s and len(window) < self.max_window and
+                all(sed_m(anchor, p, point) <= self.tolerance_m for p in window))
+        if fits:
+            window.append(point)
+            return []
+
+        rows = []
+        if window:
+            # Close the window at its last point; the new fix opens the next one
+            rows.append(self._row(bus_no, window[-1]))
+        if not window or (timestamp - self.anchors[bus_no][0]).total_seconds() > self.max_gap_s:
+            rows.append(self._row(bus_no, point))
+            self.windows[bus_no] = []
+        else:
+            self.windows[bus_no] = [point]
+        return rows
+
+    def finish(self, bus_no):
+        """End of a driver session: store the pending tail and forget the bus."""
+        window = self.windows.pop(bus_no, None)
+        rows = [self._row(bus_no, window[-1])] if window else []
+        self.anchors.pop(bus_no, None)
+        return rows
+
+    def finish_all(self):
+        rows = []
+        for bus_no in list(self.windows):
+            rows.extend(self.finish(bus_no))
+        return rows
+
+    def stats(self):
+        per_bus = {}
+        for bus_no, received in self.received.items():
+            kept = self.kept.get(bus_no, 0)
+            per_bus[bus_no] = {
+                'received': received,
+                'kept': kept,
+                'pending': len(self.windows.get(bus_no, ())),
+                'ratio': round(received / kept, 2) if kept else 0
+            }
+        received = sum(self.received.values())
+        kept = sum(self.kept.values())
+        return {
+            'tolerance_m': self.tolerance_m,
+            'max_gap_s': self.max_gap_s,
+            'received': received,
+            'kept': kept,
+            'ratio': round(received / kept, 2) if kept else 0,
+            'buses': per_bus
+        }
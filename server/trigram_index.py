@@ -0,0 +1,198 @@
+"""
+Trigram Inverted Index for Stop Search
+
+Built once per route load from the unique stop names. Names are normalized
+(lower case, single spaces) and numbered in sorted order, so every posting
+list -- a sorted numpy array of name ids -- is also alphabetical.
+
+- Trigrams come from the padded name '^^name ' (^ being a control
+  character no name contains), which gives start ('^^k', '^ki') and end
+  ('us ') grams as well as inner ones. One- and two-character queries use
+  separate unigram / bigram postings.
+- Substring candidates are the intersection of the query's gram postings
+  (smallest list first), then checked with `in`.
+- Prefix matches come from the '^^x' / '^xy' postings and are checked with
+  startswith(); as ids are alphabetical the first k found are the answer.
+- Fuzzy matches count how many of the query's padded trigrams each name
+  shares (np.bincount over the concatenated postings). The score is the
+  share of query trigrams found (containment), ties broken by Jaccard.
+
+Results are ranked prefix (A-Z), then substring (A-Z), then fuzzy (score).
+The index is immutable; rebuilds construct a new one and swap the reference.
+"""
+import re
+
+import numpy as np
+
+_SPACES = re.compile(r'\s+')
+_START = '\x02'
+
+PREFIX, SUBSTRING, FUZZY = 'prefix', 'substring', 'fuzzy'
+# Stop intersecting posting lists once this few candidates are left
+SMALL_CANDIDATES = 32
+
+
+def normalize(text):
+    return _SPACES.sub(' ', str(text).lower()).strip()
+
+
+def trigrams(norm):
+    padded = f"{_START}{_START}{norm} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _ngrams(norm, n):
+    return {norm[i:i + n] for i in range(len(norm) - n + 1)}
+
+
+def _intersect(a, b):
+    """Sorted unique id arrays -> sorted intersection (probe the smaller)."""
+    if len(a) > len(b):
+        a, b = b, a
+    if not len(a):
+        return a
+    pos = np.searchsorted(b, a)
+    pos[pos == len(b)] = 0
+    return a[b[pos] == a]
+
+
+class TrigramIndex:
+    def __init__(self, names, payloads=None):
+        """names: stop names; payloads: optional per-name data (e.g. buses)."""
+        names = list(names)
+        payloads = list(payloads) if payloads is not None else [None] * len(names)
+        order = sorted(range(len(names)), key=lambda i: (normalize(names[i]), names[i]))
+        self.names = [names[i] for i in order]
+        self.payloads = [payloads[i] for i in order]
+        self.norm = [normalize(n) for n in self.names]
+
+        grams = ({}, {}, {})  # unigram, bigram, padded trigram -> [ids]
+        gram_count = np.zeros(len(self.names), dtype=np.int32)
+        for i, s in enumerate(self.norm):
+            tri = trigrams(s)
+            gram_count[i] = len(tri)
+            for n, gram_set in ((1, _ngrams(s, 1)), (2, _ngrams(s, 2)), (3, tri)):
+                postings = grams[n - 1]
+                for g in gram_set:
+                    postings.setdefault(g, []).append(i)
+        # Ids were appended in increasing order, so every list is already sorted
+        self.unigrams, self.bigrams, self.trigrams = (
+            {g: np.array(ids, dtype=np.int32) for g, ids in d.items()} for d in grams)
+        self.gram_count = gram_count
+        self.typos = None     # Optional TypoIndex over self.names (same ids)
+        self.variants = None  # Optional VariantIndex over self.names (same ids)
+
+    def __len__(self):
+        return len(self.names)
+
+    def _empty(self):
+        return np.empty(0, dtype=np.int32)
+
+    def _substring_candidates(self, q):
+        """Ids whose name may contain q (exact for 1-2 characters)."""
+        if len(q) == 1:
+            return self.unigrams.get(q, self._empty()), True
+        if len(q) == 2:
+            return self.bigrams.get(q, self._empty()), True
+        lists = []
+        for g in _ngrams(q, 3):
+            p = self.trigrams.get(g)
+            if p is None:
+                return self._empty(), True
+            lists.append(p)
+        lists.sort(key=len)
+        cand = lists[0]
+        for p in lists[1:]:
+            if len(cand) <= SMALL_CANDIDATES:
+                break  # Cheaper to check the few left with `in`
+            cand = _intersect(cand, p)
+        return cand, False
+
+    def _prefix(self, q, cand, k):
+        if len(q) == 1:
+            return self.trigrams.get(_START * 2 + q, self._empty())[:k].tolist()
+        start = self.trigrams.get(_START + q[:2])
+        if start is None:
+            return []
+        out = []
+        for i in _intersect(cand, start).tolist():
+            if self.norm[i].startswith(q):
+                out.append(i)
+                if len(out) == k:
+                    break
+        return out
+
+    def fuzzy(self, q, k, cutoff=0.4, exclude=()):
+        """[(id, score)] for names sharing at least cutoff of q's trigrams."""
+        grams = trigrams(q)
+        lists = [self.trigrams[g] for g in grams if g in self.trigrams]
+        if not lists or k <= 0:
+            return []
+        counts = np.bincount(np.concatenate(lists), minlength=len(self.names))
+        ids = np.flatnonzero(counts >= max(1, cutoff * len(grams) - 1e-9))
+        shared = counts[ids]
+        containment = shared / len(grams)
+        keep = np.ones(len(ids), dtype=bool)
+        if exclude:
+            keep &= ~np.isin(ids, np.fromiter(exclude, dtype=np.int32))
+        ids, shared, containment = ids[keep], shared[keep], containment[keep]
+        if not len(ids):
+            return []
+        jaccard = shared / (len(grams) + self.gram_count[ids] - shared)
+        if len(ids) > k:
+            # Coarse cut on the combined key, then exact ordering below
+            top = np.argpartition(-(containment + jaccard * 1e-3), k - 1)[:k]
+            ids, containment, jaccard = ids[top], containment[top], jaccard[top]
+        order = np.lexsort((ids, -jaccard, -containment))
+        return [(int(ids[j]), round(float(containment[j]), 3)) for j in order]
+
+    def search(self, query, k=10, cutoff=0.4, fuzzy=True):
+        """Top-k [(id, kind, score)]: prefix, then substring, then fuzzy."""
+        q = normalize(query)
+        if not q or k <= 0 or not self.names:
+            return []
+        cand, exact = self._substring_candidates(q)
+        prefix = self._prefix(q, cand, k)
+        results = [(i, PREFIX, 1.0) for i in prefix]
+
+        if len(results) < k:
+            # Fewer than k prefix hits exist, so skipping them ends quickly
+            taken = set(prefix)
+            for i in cand.tolist():
+                if i in taken or self.norm[i].startswith(q):
+                    continue
+                if exact or q in self.norm[i]:
+                    results.append((i, SUBSTRING, 1.0))
+                    if len(results) == k:
+                        break
+
+        if fuzzy and len(q) >= 2 and len(results) < k:
+            seen = {i for i, _, _ in results}
+            for i, score in self.fuzzy(q, k - len(results), cutoff, seen):
+                results.append((i, FUZZY, score))
+        return results
+
+    def stats(self):
+        return {
+            'names': len(self.names),
+            'unigrams': len(self.unigrams),
+            'bigrams': len(self.bigrams),
+            'trigrams': len(self.trigrams),
+            'postings': int(sum(len(p) for d in (self.unigrams, self.bigrams, self.trigrams)
+                                for p in d.values())),
+            'typos': self.typos.stats() if self.typos else None,
+            'variants': self.variants.stats() if self.variants else None
+        }
+
+
+def bus_sort_key(bus_no):
+    return int(bus_no) if bus_no.isdigit() else 999
+
+
+def from_routes(routes_cache):
+    """Index of every stop name in ROUTES_CACHE; payload = sorted bus numbers."""
+    stop_buses = {}
+    for bus_no, route in routes_cache.items():
+        for stop in route.get('stops', []):
+            stop_buses.setdefault(stop['stop_name'], set()).add(str(bus_no))
+    return TrigramIndex(stop_buses, [sorted(b, key=bus_sort_key) for b in stop_buses.values()])
@@ -0,0 +1,202 @@
+"""
+Typo-Tolerant Token Matcher (Symmetric Delete)
+
+Stop names are split into tokens ('KIIT Campus 25 (End)' -> kiit, campus,
+25, end). For every alphabetic token the index stores all strings reachable
+by deleting up to TYPO_MAX_DISTANCE characters; a query token generates its
+own deletes, and any shared delete is a candidate that is then verified
+with a bounded Damerau-Levenshtein (OSA) distance. Lookup cost depends on
+the query token's length and the candidates found, not on how many stops
+exist.
+
+The allowed distance grows with token length (0 up to 3 characters, 1 up to
+5, then the maximum) so short tokens do not match everything. Numeric tokens
+('25', '30049') only match exactly or by prefix.
+
+The last query token is usually still being typed, so it also matches vocab
+tokens it is a prefix of, and token prefixes within distance 1 ('simr' ->
+'similar'), through a second delete index over token prefixes.
+
+Names are scored by how many query tokens they match (at least half), then
+by total distance, then by length. Name ids are positions in the `names`
+list passed in, so an index built from TrigramIndex.names shares its ids.
+"""
+import os
+import re
+from bisect import bisect_left
+
+import numpy as np
+
+from server.trigram_index import normalize
+
+MAX_DISTANCE = int(os.environ.get('TYPO_MAX_DISTANCE', 2))
+MIN_PREFIX = 3          # Shortest partial token matched with a typo
+MAX_PREFIX_TOKENS = 64  # Vocab tokens a partial last token may expand to
+_TOKEN = re.compile(r'[^\W_]+')  # Letters and digits; brackets etc. split tokens
+
+
+def tokenize(text):
+    return _TOKEN.findall(normalize(text))
+
+
+def allowed_distance(token, max_distance=MAX_DISTANCE):
+    n = len(token)
+    return 0 if n <= 3 else min(1, max_distance) if n <= 5 else max_distance
+
+
+def deletes(word, distance):
+    """word plus every string reachable by deleting up to `distance` characters."""
+    out, frontier = {word}, {word}
+    for _ in range(distance):
+        frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w))}
+        out |= frontier
+    return out
+
+
+def osa_distance(a, b, limit):
+    """Optimal string alignment distance, or limit + 1 once it must exceed limit."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    prev2, prev = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        best = i
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            v = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                v = min(v, prev2[j - 2] + 1)
+            cur[j] = v
+            best = min(best, v)
+        if best > limit:
+            return limit + 1
+        prev2, prev = prev, cur
+    return prev[-1]
+
+
+class TypoIndex:
+    def __init__(self, names, max_distance=MAX_DISTANCE):
+        self.max_distance = max_distance
+        self.n_names = len(names)
+
+        token_names = {}
+        name_tokens = np.zeros(len(names), dtype=np.int16)
+        for i, name in enumerate(names):
+            tokens = set(tokenize(name))
+            name_tokens[i] = len(tokens)
+            for t in tokens:
+                token_names.setdefault(t, []).append(i)
+        self.name_tokens = name_tokens
+
+        self.vocab = sorted(token_names)  # Sorted for prefix ranges
+        self.token_id = {t: i for i, t in enumerate(self.vocab)}
+        self.postings = [np.array(token_names[t], dtype=np.int32) for t in self.vocab]
+
+        # delete -> token ids (whole tokens); delete -> token ids (token prefixes)
+        self.deletes, self.prefix_deletes = {}, {}
+        for tid, t in enumerate(self.vocab):
+            if not t.isalpha():
+                continue
+            for d in deletes(t, allowed_distance(t, max_distance)):
+                self.deletes.setdefault(d, []).append(tid)
+            for m in range(MIN_PREFIX, len(t)):
+                for d in deletes(t[:m], 1):
+                    self.prefix_deletes.setdefault(d, set()).add(tid)
+
+    def __len__(self):
+        return self.n_names
+
+    def token_matches(self, token, max_distance=None, partial=False):
+        """{token id: distance} for vocab tokens matching one query token."""
+        max_distance = self.max_distance if max_distance is None else max_distance
+        found = {}
+        tid = self.token_id.get(token)
+        if tid is not None:
+            found[tid] = 0
+        if token.isalpha():
+            limit = allowed_distance(token, max_distance)
+            if limit:
+                for d in deletes(token, limit):
+                    for tid in self.deletes.get(d, ()):
+                        if tid not in found:
+                            dist = osa_distance(token, self.vocab[tid], limit)
+                            if dist <= limit:
+                                found[tid] = dist
+        if partial:
+            lo = bisect_left(self.vocab, token)
+            for tid in range(lo, min(lo + MAX_PREFIX_TOKENS, len(self.vocab))):
+                if not self.vocab[tid].startswith(token):
+                    break
+                found.setdefault(tid, 0)
+            if token.isalpha() and len(token) >= MIN_PREFIX and max_distance:
+                for d in deletes(token, 1):
+                    for tid in self.prefix_deletes.get(d, ()):
+                        if tid in found:
+                            continue
+                        t = self.vocab[tid]
+                        dist = min(osa_distance(token, t[:m], 1)
+                                   for m in range(len(token) - 1, len(token) + 2) if m >= MIN_PREFIX)
+                        if dist <= 1:
+                            found[tid] = dist
+        return found
+
+    def search(self, query, k=10, max_distance=None, exclude=()):
+        """[(name id, score)] best first; score = matched share minus a distance penalty."""
+        tokens = tokenize(query)
+        if not tokens or not self.n_names or k <= 0:
+            return []
+        matched = np.zeros(self.n_names, dtype=np.int16)
+        distance = np.zeros(self.n_names, dtype=np.int16)
+        for j, token in enumerate(tokens):
+            found = self.token_matches(token, max_distance, partial=j == len(tokens) - 1)
+            if not found:
+                continue
+            ids = np.concatenate([self.postings[tid] for tid in found])
+            dist = np.concatenate([np.full(len(self.postings[tid]), d, dtype=np.int16)
+                                   for tid, d in found.items()])
+            # A name may hold several matching tokens: keep its closest
+            order = np.lexsort((dist, ids))
+            ids, dist = ids[order], dist[order]
+            first = np.concatenate(([True], ids[1:] != ids[:-1]))
+            ids, dist = ids[first], dist[first]
+            matched[ids] += 1
+            distance[ids] += dist
+
+        need = max(1, (len(tokens) + 1) // 2)
+        cand = np.flatnonzero(matched >= need)
+        if exclude:
+            cand = cand[~np.isin(cand, np.fromiter(exclude, dtype=np.int64))]
+        if not len(cand):
+            return []
+        # More tokens matched, then fewer edits, then shorter names, then id
+        order = np.lexsort((cand, self.name_tokens[cand], distance[cand], -matched[cand]))[:k]
+        return [(int(i), round(float(matched[i] / len(tokens) - 0.1 * distance[i]), 3))
+                for i in cand[order]]
+
+    def stats(self):
+        return {
+            'names': self.n_names,
+            'tokens': len(self.vocab),
+            'deletes': len(self.deletes),
+            'prefix_deletes': len(self.prefix_deletes),
+            'max_distance': self.max_distance
+        }
+
+
+def ranked_search(trigram, typos, query, k=10, cutoff=0.4, max_distance=None, variants=None):
+    """
+    Top-k [(id, kind, score)] over a TrigramIndex and the TypoIndex /
+    VariantIndex built from its names: prefix, substring, normalized-key
+    (variant, phonetic), then typo matches, then trigram fuzzy.
+    """
+    results = trigram.search(query, k=k, cutoff=cutoff, fuzzy=False)
+    if len(results) < k and variants is not None:
+        results += variants.lookup(query, k - len(results), {i for i, _, _ in results})
+    if len(results) < k and typos is not None:
+        seen = {i for i, _, _ in results}
+        results += [(i, 'typo', s) for i, s in typos.search(query, k - len(results), max_distance, seen)]
+    q = normalize(query)
+    if len(results) < k and len(q) >= 2:
+        seen = {i for i, _, _ in results}
+        results += [(i, 'fuzzy', s) for i, s in trigram.fuzzy(q, k - len(results), cutoff, seen)]
+    return results
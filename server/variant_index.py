@@ -0,0 +1,242 @@
+"""
+Normalized-Key Index for Stop Names
+
+Built at route load. Every stop name is reduced to three keys, each mapped
+to the stop ids that share it, so a query spelled differently from the
+workbook ('Acharyavihar', 'campus6', 'Ranasinghpur', Odia script) resolves
+with a hash lookup per level instead of fuzzy scoring:
+
+    folded    Odia script transliterated, accents stripped, punctuation and
+              spaces removed, number words as digits, common abbreviations
+              expanded ('KIIT Campus-6' / 'kiit campus six' -> 'kiitcampus6')
+    translit  folded, plus Indic spelling variants: aspirates (chh/ch, sh/s,
+              bh/b), w/v/b, f/ph, ee/i, oo/u, double letters, 'ng' before a
+              consonant, a trailing schwa
+              ('Ranasinghpur' / 'Ranasinhpur' -> 'ranasinpur')
+    phonetic  translit with every vowel after the first letter dropped
+              ('Jayadev Vihar' / 'Jaydev Bihar' -> 'jdbhr')
+
+The keys are built on the joined words, so word breaks never matter
+('Acharya Vihar' / 'acharyavihar'). Names carry qualifiers ('Acharya Vihar
+(NH)', 'Patia Square (Return)'), so every level also indexes the joins of
+each name's leading words (two or more), checked after the whole-name
+keys. A separate table holds the folded joins of word runs that start
+after the first word ('campus6' finds 'KIIT Campus 6 (Return)'), tried
+between the translit and phonetic levels.
+
+Lookups try the levels strict to loose; looser keys collide more, so their
+matches rank lower. The index is immutable; rebuilds construct a new one.
+"""
+import re
+import unicodedata
+
+VARIANT, PHONETIC = 'variant', 'phonetic'
+LEVELS = ('folded', 'translit', 'phonetic')
+LEVEL_SCORE = {'folded': 1.0, 'translit': 0.9, 'span': 0.85, 'phonetic': 0.8}
+LOOKUP_ORDER = ('folded', 'translit', 'span', 'phonetic')
+MIN_KEY = 3  # Shorter keys match too many names to be useful
+
+_WORD = re.compile(r'[^\W_]+')
+_DIGIT_SPLIT = re.compile(r'(?<=[a-z])(?=\d)|(?<=\d)(?=[a-z])')
+
+NUMBER_WORDS = {
+    'zero': '0', 'one': '1', 'two': '2', 'three': '3', 'four': '4', 'five': '5',
+    'six': '6', 'seven': '7', 'eight': '8', 'nine': '9', 'ten': '10',
+    'eleven': '11', 'twelve': '12', 'thirteen': '13', 'fourteen': '14', 'fifteen': '15',
+    'sixteen': '16', 'seventeen': '17', 'eighteen': '18', 'nineteen': '19', 'twenty': '20',
+    'first': '1', 'second': '2', 'third': '3', 'fourth': '4', 'fifth': '5',
+    'i': '1', 'ii': '2', 'iii': '3', 'iv': '4',
+}
+ABBREVIATIONS = {
+    'sq': 'square', 'sqr': 'square', 'stn': 'station', 'rd': 'road', 'ngr': 'nagar',
+    'ngar': 'nagar', 'chowk': 'chhak', 'chouk': 'chhak', 'chak': 'chhak', 'chk': 'chhak',
+    'bazar': 'bazaar', 'mkt': 'market', 'opp': 'opposite', 'hosp': 'hospital',
+    'univ': 'university', 'clg': 'college', 'coll': 'college', 'sch': 'school',
+    'no': 'number', 'rly': 'railway', 'busstand': 'bus stand', 'busstop': 'bus stop',
+}
+
+# Odia script -> Latin. Consonants carry an inherent 'a' unless followed by a
+# vowel sign or the virama.
+_ODIA_VOWELS = {
+    'ଅ': 'a', 'ଆ': 'aa', 'ଇ': 'i', 'ଈ': 'ii', 'ଉ': 'u', 'ଊ': 'uu', 'ଋ': 'ru',
+    'ଏ': 'e', 'ଐ': 'ai', 'ଓ': 'o', 'ଔ': 'au',
+}
+_ODIA_SIGNS = {
+    'ା': 'aa', 'ି': 'i', 'ୀ': 'ii', 'ୁ': 'u', 'ୂ': 'uu', 'ୃ': 'ru',
+    'େ': 'e', 'ୈ': 'ai', 'ୋ': 'o', 'ୌ': 'au',
+}
+_ODIA_CONSONANTS = {
+    'କ': 'k', 'ଖ': 'kh', 'ଗ': 'g', 'ଘ': 'gh', 'ଙ': 'ng', 'ଚ': 'ch', 'ଛ': 'chh',
+    'ଜ': 'j', 'ଝ': 'jh', 'ଞ': 'ny', 'ଟ': 't', 'ଠ': 'th', 'ଡ': 'd', 'ଢ': 'dh',
+    'ଣ': 'n', 'ତ': 't', 'ଥ': 'th', 'ଦ': 'd', 'ଧ': 'dh', 'ନ': 'n', 'ପ': 'p',
+    'ଫ': 'ph', 'ବ': 'b', 'ଭ': 'bh', 'ମ': 'm', 'ଯ': 'j', 'ର': 'r', 'ଲ': 'l',
+    'ଳ': 'l', 'ଶ': 's', 'ଷ': 'sh', 'ସ': 's', 'ହ': 'h', 'ୟ': 'y', 'ୱ': 'w',
+}
+_ODIA_NUKTA = {'ଡ': 'r', 'ଢ': 'rh'}  # With the nukta sign: ଡ଼ / ଢ଼
+_ODIA_MARKS = {'ଂ': 'n', 'ଁ': 'n', 'ଃ': 'h'}
+_ODIA_DIGITS = {chr(0x0B66 + d): str(d) for d in range(10)}
+_VIRAMA, _NUKTA = '୍', '଼'
+
+# Spelling folds, applied in order (plain strings use str.replace)
+_TRANSLIT_RULES = [
+    ('jy', 'y'),  # Odia ର୍ଯ୍ୟ ('rjy') is written 'rya'
+    ('ee', 'i'),
+    ('oo', 'u'),
+    (re.compile(r'([^aeiou\d])h+'), r'\1'),  # Aspirates: chh, bh, sh, ph, ...
+    ('ck', 'k'),
+    (str.maketrans({'w': 'b', 'v': 'b', 'f': 'p', 'z': 'j', 'q': 'k', 'x': 'ks'}), None),
+    (re.compile(r'ng(?=[^aeiou])'), 'n'),
+    (re.compile(r'(.)\1+'), r'\1'),
+    (re.compile(r'(?<=..[^aeiou])a$'), ''),  # Trailing schwa
+]
+_INNER_VOWELS = re.compile(r'(?<=.)[aeiouy]')
+_REPEATS = re.compile(r'(.)\1+')
+
+
+def transliterate_odia(text):
+    """Latin spelling of any Odia script in text (other characters kept)."""
+    if not any('଀' <= ch <= '୿' for ch in text):
+        return text
+    text = unicodedata.normalize('NFD', text)  # ଡ଼ -> ଡ + nukta
+    out, i = [], 0
+    while i < len(text):
+        ch = text[i]
+        nxt = text[i + 1] if i + 1 < len(text) else ''
+        if ch in _ODIA_CONSONANTS:
+            if nxt == _NUKTA and ch in _ODIA_NUKTA:
+                out.append(_ODIA_NUKTA[ch])
+                i += 1
+                nxt = text[i + 1] if i + 1 < len(text) else ''
+            else:
+                out.append(_ODIA_CONSONANTS[ch])
+            if nxt in _ODIA_SIGNS:
+                out.append(_ODIA_SIGNS[nxt])
+                i += 1
+            elif nxt == _VIRAMA:
+                i += 1
+            else:
+                out.append('a')
+        else:
+            out.append(_ODIA_VOWELS.get(ch) or _ODIA_SIGNS.get(ch) or _ODIA_MARKS.get(ch)
+                       or _ODIA_DIGITS.get(ch) or ('' if ch == _NUKTA else ch))
+        i += 1
+    return ''.join(out)
+
+
+def fold_words(text):
+    """Lower-case ASCII words with number words and abbreviations replaced."""
+    text = str(text)
+    if not text.isascii():
+        text = unicodedata.normalize('NFKD', transliterate_odia(text))
+        text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    text = text.lower().replace('&', ' and ')
+    words = []
+    for word in _WORD.findall(_DIGIT_SPLIT.sub(' ', text)):
+        if word.isdigit():
+            word = word.lstrip('0') or '0'
+        word = NUMBER_WORDS.get(word) or ABBREVIATIONS.get(word, word)
+        words.extend(word.split())
+    return words
+
+
+def translit_key(folded):
+    for pattern, repl in _TRANSLIT_RULES:
+        if isinstance(pattern, str):
+            folded = folded.replace(pattern, repl)
+        elif isinstance(pattern, dict):
+            folded = folded.translate(pattern)
+        else:
+            folded = pattern.sub(repl, folded)
+    return folded
+
+
+def keys(text, words=None, translit_cache=None):
+    """{level: key} for a name or query ('' where it folds to nothing)."""
+    folded = ''.join(fold_words(text) if words is None else words)
+    if translit_cache is None:
+        translit = translit_key(folded)
+    else:
+        translit = translit_cache.get(folded)
+        if translit is None:
+            translit = translit_cache[folded] = translit_key(folded)
+    return {
+        'folded': folded,
+        'translit': translit,
+        'phonetic': _REPEATS.sub(r'\1', _INNER_VOWELS.sub('', translit))
+    }
+
+
+class VariantIndex:
+    def __init__(self, names):
+        """names: stop names; ids are positions in this list."""
+        self.n_names = len(names)
+        tables = {level: {} for level in LEVELS}    # Whole-name keys
+        prefixes = {level: {} for level in LEVELS}  # Keys of leading words
+        spans = {}
+        translit_cache = {}  # Leading-word joins repeat across names
+        for i, name in enumerate(names):
+            words = fold_words(name)
+            for level, key in keys(name, words, translit_cache).items():
+                if key:
+                    tables[level].setdefault(key, []).append(i)
+            for j in range(2, len(words)):
+                for level, key in keys(None, words[:j], translit_cache).items():
+                    ids = prefixes[level].setdefault(key, [])
+                    if not ids or ids[-1] != i:
+                        ids.append(i)
+            for j in range(1, len(words)):
+                for m in range(j + 1, len(words) + 1):
+                    ids = spans.setdefault(''.join(words[j:m]), [])
+                    if not ids or ids[-1] != i:
+                        ids.append(i)
+        freeze = lambda table: {key: tuple(ids) for key, ids in table.items()}
+        self.tables = {level: freeze(table) for level, table in tables.items()}
+        self.prefixes = {level: freeze(table) for level, table in prefixes.items()}
+        self.spans = freeze(spans)
+
+    def __len__(self):
+        return self.n_names
+
+    def lookup(self, query, k=10, exclude=()):
+        """
+        [(id, kind, score)]: folded, translit, word run, then phonetic key
+        matches; at each level whole names before leading-word matches.
+        """
+        out, seen = [], set(exclude)
+        query_keys = keys(query)
+        for level in LOOKUP_ORDER:
+            key = query_keys['folded' if level == 'span' else level]
+            if len(key) < MIN_KEY:
+                continue
+            if level == 'span':
+                candidates = self.spans.get(key, ())
+            else:
+                candidates = self.tables[level].get(key, ()) + self.prefixes[level].get(key, ())
+            for i in candidates:
+                if i not in seen:
+                    seen.add(i)
+                    out.append((i, PHONETIC if level == 'phonetic' else VARIANT, LEVEL_SCORE[level]))
+                    if len(out) == k:
+                        return out
+        return out
+
+    def unique(self, query):
+        """
+        The single id whose folded or translit key (whole name, else leading
+        words) equals the query's, else None.
+        """
+        query_keys = keys(query)
+        for level in ('folded', 'translit'):
+            key = query_keys[level]
+            ids = self.tables[level].get(key) or self.prefixes[level].get(key, ())
+            if ids:
+                return ids[0] if len(ids) == 1 else None
+        return None
+
+    def stats(self):
+        return {
+            'names': self.n_names,
+            **{f'{level}_keys': len(self.tables[level]) for level in LEVELS},
+            **{f'{level}_prefix_keys': len(self.prefixes[level]) for level in LEVELS},
+            'span_keys': len(self.spans)
+        }
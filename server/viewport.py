@@ -0,0 +1,341 @@
+"""
+Viewport-Based Fleet Subscriptions
+
+Clients that send their map bounds stop receiving the global bus_delta
+frame and get per-socket frames instead, covering only buses inside (or
+entering) their viewport plus the bus they are tracking. Buses that move
+out of view are listed in the frame's 'left' array.
+
+Live positions are kept in a uniform lat/lng grid (cell -> keys) and
+viewports are indexed by the cells they overlap (cell -> sids), so each
+tick costs O(changed buses x subscribers in their cells).
+"""
+import math
+import os
+
+# Grid cell size in degrees (~1.1 km at campus latitudes)
+CELL_DEG = float(os.environ.get('VIEWPORT_CELL_DEG', 0.01))
+# Viewports spanning more cells than this are treated as "wide": they are
+# checked by bounds only instead of being registered in every cell.
+MAX_VIEWPORT_CELLS = int(os.environ.get('VIEWPORT_MAX_CELLS', 400))
+
+
+def cell_of(lat, lng, cell_deg=CELL_DEG):
+    return (int(math.floor(lat / cell_deg)), int(math.floor(lng / cell_deg)))
+
+
+def cell_range(bounds, cell_deg=CELL_DEG):
+    """Corner cells (r0, c0, r1, c1) of (south, west, north, east)."""
+    south, west, north, east = bounds
+    r0, c0 = cell_of(south, west, cell_deg)
+    r1, c1 = cell_of(north, east, cell_deg)
+    return r0, c0, r1, c1
+
+
+def cell_count(bounds, cell_deg=CELL_DEG):
+    """Number of grid cells overlapping bounds, without listing them."""
+    r0, c0, r1, c1 = cell_range(bounds, cell_deg)
+    return (r1 - r0 + 1) * (c1 - c0 + 1)
+
+
+def cells_in_bounds(bounds, cell_deg=CELL_DEG):
+    """All grid cells overlapping (south, west, north, east)."""
+    r0, c0, r1, c1 = cell_range(bounds, cell_deg)
+    return [(r, c) for r in range(r0, r1 + 1) for c in range(c0, c1 + 1)]
+
+
+def parse_bounds(data):
+    """{south, west, north, east} -> tuple clamped to the globe, or None if malformed."""
+    try:
+        south, west = float(data['south']), float(data['west'])
+        north, east = float(data['north']), float(data['east'])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if not all(math.isfinite(v) for v in (south, west, north, east)):
+        return None
+    # Padded zoomed-out maps report bounds past the poles / antimeridian
+    south, north = max(south, -90.0), min(north, 90.0)
+    west, east = max(west, -180.0), min(east, 180.0)
+    if south > north or west > east:
+        return None
+    return (south, west, north, east)
+
+
+def _has_position(entry):
+    return entry.get('lat') is not None and entry.get('lng') is not None
+
+
+def _norm_bus(bus_no):
+    return str(bus_no).strip().upper()
+
+
+class ViewportRouter:
+    def __init__(self, cell_deg=CELL_DEG, max_cells=MAX_VIEWPORT_CELLS):
+        self.cell_deg = cell_deg
+        self.max_cells = max_cells
+
+        # Mirror of the client-visible fleet model (as of the last tick)
+        self.entries = {}     # key -> entry
+        self.key_cell = {}    # key -> cell
+        self.cell_keys = {}   # cell -> set(keys)
+        self.bus_keys = {}    # bus_no -> set(keys) (live + offline entries)
+
+        # Subscribers
+        self.bounds = {}      # sid -> (south, west, north, east)
+        self.sub_cells = {}   # sid -> list of cells (empty for wide viewports)
+        self.cell_subs = {}   # cell -> set(sids)
+        self.wide = set()     # sids with very large viewports
+        self.tracked = {}     # sid -> bus_no always delivered
+        self.trackers = {}    # bus_no -> set(sids) tracking it
+        self.visible = {}     # sid -> set(keys) the client currently holds
+        self.watchers = {}    # key -> set(sids) holding it
+        self.client_seq = {}  # sid -> seq of the last frame sent
+
+        self.frames_sent = 0
+        self.leaves_sent = 0
+
+    # --- Fleet model mirror ---
+    def reset(self, payload):
+        """Rebuild the mirror from a full payload (key -> entry)."""
+        self.entries = {}
+        self.key_cell = {}
+        self.cell_keys = {}
+        self.bus_keys = {}
+        for key, entry in payload.items():
+            self._put(key, dict(entry))
+
+    def _put(self, key, entry):
+        self._drop_cell(key)
+        self.entries[key] = entry
+        self.bus_keys.setdefault(_norm_bus(entry.get('bus_no')), set()).add(key)
+        if _has_position(entry):
+            cell = cell_of(entry['lat'], entry['lng'], self.cell_deg)
+            self.key_cell[key] = cell
+            self.cell_keys.setdefault(cell, set()).add(key)
+
+    def _drop_cell(self, key):
+        cell = self.key_cell.pop(key, None)
+        if cell is not None:
+            keys = self.cell_keys.get(cell)
+            if keys:
+                keys.discard(key)
+                if not keys:
+                    del self.cell_keys[cell]
+
+    def _remove(self, key):
+        self._drop_cell(key)
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            bus_no = _norm_bus(entry.get('bus_no'))
+            keys = self.bus_keys.get(bus_no)
+            if keys:
+                keys.discard(key)
+                if not keys:
+                    del self.bus_keys[bus_no]
+
+    # --- Subscriptions ---
+    def is_subscribed(self, sid):
+        return sid in self.bounds
+
+    def subscribe(self, sid, bounds):
+        """Register or move a viewport. Returns the frame the client needs."""
+        self._unindex_viewport(sid)
+        self.bounds[sid] = bounds
+        # Count from the corners first: a zoomed-out view spans millions of cells
+        if cell_count(bounds, self.cell_deg) > self.max_cells:
+            self.wide.add(sid)
+            self.sub_cells[sid] = []
+        else:
+            cells = cells_in_bounds(bounds, self.cell_deg)
+            self.sub_cells[sid] = cells
+            for cell in cells:
+                self.cell_subs.setdefault(cell, set()).add(sid)
+
+        if sid not in self.visible:
+            # Fresh subscription: the client replaces its view with a snapshot
+            self.visible[sid] = set()
+            self.client_seq[sid] = 0
+            return None
+        return self._resync_visibility(sid)
+
+    def snapshot(self, sid):
+        """Full view for a subscriber: {seq, buses} limited to its viewport."""
+        keys = self._keys_in_view(sid)
+        old = self.visible.get(sid, set())
+        for key in old - keys:
+            self._unwatch(key, sid)
+        for key in keys - old:
+            self.watchers.setdefault(key, set()).add(sid)
+        self.visible[sid] = keys
+        self.client_seq[sid] = self.client_seq.get(sid, 0) + 1
+        return {
+            'seq': self.client_seq[sid],
+            'buses': {key: self.entries[key] for key in keys}
+        }
+
+    def set_tracked(self, sid, bus_no):
+        """Bus a client tracks is delivered even outside its viewport."""
+        self._untrack(sid)
+        if bus_no:
+            bus_no = _norm_bus(bus_no)
+            self.tracked[sid] = bus_no
+            self.trackers.setdefault(bus_no, set()).add(sid)
+        if sid in self.bounds:
+            return self._resync_visibility(sid)
+        return None
+
+    def unsubscribe(self, sid):
+        self._unindex_viewport(sid)
+        self.bounds.pop(sid, None)
+        self._untrack(sid)
+        self.client_seq.pop(sid, None)
+        for key in self.visible.pop(sid, ()):
+            self._unwatch(key, sid)
+
+    def _unindex_viewport(self, sid):
+        for cell in self.sub_cells.pop(sid, ()):
+            subs = self.cell_subs.get(cell)
+            if subs:
+                subs.discard(sid)
+                if not subs:
+                    del self.cell_subs[cell]
+        self.wide.discard(sid)
+
+    def _untrack(self, sid):
+        bus_no = self.tracked.pop(sid, None)
+        if bus_no is not None:
+            sids = self.trackers.get(bus_no)
+            if sids:
+                sids.discard(sid)
+                if not sids:
+                    del self.trackers[bus_no]
+
+    def _unwatch(self, key, sid):
+        sids = self.watchers.get(key)
+        if sids:
+            sids.discard(sid)
+            if not sids:
+                del self.watchers[key]
+
+    def _in_view(self, sid, key, entry):
+        tracked = self.tracked.get(sid)
+        if tracked is not None and _norm_bus(entry.get('bus_no')) == tracked:
+            return True
+        if not _has_position(entry):
+            return False
+        south, west, north, east = self.bounds[sid]
+        return south <= entry['lat'] <= north and west <= entry['lng'] <= east
+
+    def _keys_in_view(self, sid):
+        keys = set()
+        if sid in self.wide:
+            candidates = self.entries.keys()
+        else:
+            candidates = set()
+            for cell in self.sub_cells.get(sid, ()):
+                candidates |= self.cell_keys.get(cell, set())
+            tracked = self.tracked.get(sid)
+            if tracked is not None:
+                candidates |= self.bus_keys.get(tracked, set())
+        for key in candidates:
+            if self._in_view(sid, key, self.entries[key]):
+                keys.add(key)
+        return keys
+
+    def _resync_visibility(self, sid):
+        """Frame with buses entering / leaving after a bounds or tracking change."""
+        keys = self._keys_in_view(sid)
+        old = self.visible.get(sid, set())
+        frame = self._new_frame(sid)
+        for key in keys - old:
+            frame['changed'][key] = self.entries[key]
+            self.watchers.setdefault(key, set()).add(sid)
+        for key in old - keys:
+            frame['left'].append(key)
+            self._unwatch(key, sid)
+        self.visible[sid] = keys
+        return self._finish_frame(sid, frame)
+
+    # --- Tick routing ---
+    def _new_frame(self, sid):
+        return {'changed': {}, 'removed': [], 'left': []}
+
+    def _finish_frame(self, sid, frame):
+        if not frame['changed'] and not frame['removed'] and not frame['left']:
+            return None
+        base = self.client_seq.get(sid, 0)
+        frame['seq'] = base + 1
+        frame['base'] = base
+        self.client_seq[sid] = base + 1
+        self.frames_sent += 1
+        self.leaves_sent += len(frame['left'])
+        return frame
+
+    def route_delta(self, delta):
+        """
+        Apply a drained store delta to the mirror and return {sid: frame}
+        for viewport subscribers affected by it.
+        """
+        frames = {}
+
+        def frame_for(sid):
+            if sid not in frames:
+                frames[sid] = self._new_frame(sid)
+            return frames[sid]
+
+        for key in delta['removed']:
+            self._remove(key)
+            for sid in self.watchers.pop(key, ()):
+                frame_for(sid)['removed'].append(key)
+                self.visible[sid].discard(key)
+
+        for key, fields in delta['changed'].items():
+            entry = self.entries.get(key)
+            entry = dict(entry, **fields) if entry else dict(fields)
+            self._put(key, entry)
+            if not self.bounds:
+                continue
+
+            # Candidate subscribers: viewports overlapping the new cell,
+            # wide viewports, trackers of this bus, and current holders.
+            candidates = set(self.wide)
+            cell = self.key_cell.get(key)
+            if cell is not None:
+                candidates |= self.cell_subs.get(cell, set())
+            candidates |= {sid for sid in self.trackers.get(_norm_bus(entry.get('bus_no')), ())
+                           if sid in self.bounds}
+            holders = self.watchers.get(key, set())
+            candidates |= holders
+
+            inside = {sid for sid in candidates if self._in_view(sid, key, entry)}
+            for sid in inside:
+                if key in self.visible[sid]:
+                    frame_for(sid)['changed'][key] = fields
+                else:
+                    frame_for(sid)['changed'][key] = entry  # Entering: full entry
+                    self.visible[sid].add(key)
+            for sid in holders - inside:
+                frame_for(sid)['left'].append(key)
+                self.visible[sid].discard(key)
+
+            if inside:
+                self.watchers[key] = inside
+            else:
+                self.watchers.pop(key, None)
+
+        result = {}
+        for sid, frame in frames.items():
+            finished = self._finish_frame(sid, frame)
+            if finished:
+                result[sid] = finished
+        return result
+
+    def stats(self):
+        return {
+            'subscribers': len(self.bounds),
+            'wide_subscribers': len(self.wide),
+            'indexed_buses': len(self.key_cell),
+            'occupied_cells': len(self.cell_keys),
+            'frames_sent': self.frames_sent,
+            'leaves_sent': self.leaves_sent
+        }
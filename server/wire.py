@@ -0,0 +1,192 @@
+"""
+Compact Binary Wire Format for Fleet Frames
+
+Clients that send `set_encoding` {'encoding': 'binary'} receive
+`fleet_snapshot_bin` / `bus_delta_bin` with a binary attachment instead of
+JSON. The decoder lives in static/js/student/map.js (decodeFleetFrame);
+everyone else keeps the JSON events.
+
+Layout (little-endian):
+    header   magic 'BF' | version u8 | flags u8 (1 = snapshot) | seq u32 | base u32
+    strings  count u16, then (len u16, utf-8 bytes) each
+    rows     count u16 | key str-idx u16 [n] | field mask u16 [n]
+             then one column per field in FIELDS order, holding only the
+             rows whose mask has that field's bit set
+    removed  count u16 | str-idx u16 [n]
+    left     count u16 | str-idx u16 [n]
+
+Coordinates are fixed-point 1e-6 degrees (i32), accuracy/speed/heading are
+u16 in tenths, last_updated is u32 epoch seconds, crowd/type are enum codes,
+progress_m is u32 decimetres and off_route_m u16 tenths.
+Null numbers use the column's sentinel value.
+
+String indexes stop below U16_NULL (the null index) and string lengths at
+u16; a frame that does not fit raises FrameTooLarge so callers can send
+JSON instead.
+"""
+import json
+import struct
+from datetime import datetime
+
+MAGIC = b'BF'
+VERSION = 2
+FLAG_SNAPSHOT = 1
+
+CROWD_CODES = ('LOW', 'MED', 'HIGH')
+TYPE_CODES = ('HOSTEL', 'DAY_SCHOLAR')
+
+I32_NULL = -2 ** 31
+U16_NULL = 0xFFFF
+U8_NULL = 0xFF
+U32_NULL = 0xFFFFFFFF
+
+
+class FrameTooLarge(ValueError):
+    """Frame exceeds the u16 string table / string length limits."""
+
+
+def _fixed(scale, fmt, null, limit):
+    def enc(v):
+        if v is None:
+            return null
+        q = int(round(float(v) * scale))
+        return max(-limit, min(limit, q)) if fmt == 'i' else max(0, min(limit, q))
+    return enc
+
+
+def _enum(codes):
+    lookup = {c: i for i, c in enumerate(codes)}
+
+    def enc(v):
+        if v is None:
+            return U8_NULL
+        return lookup.get(v, 0)  # Unknown values fall back to the default (first) code
+    return enc
+
+
+def _epoch(v):
+    if not v:
+        return 0
+    if isinstance(v, str):
+        v = datetime.fromisoformat(v)
+    return int((v - datetime(1970, 1, 1)).total_seconds())
+
+
+# (field, struct code, encoder); str fields are encoded via the string table
+FIELDS = (
+    ('bus_no', 'H', None),
+    ('lat', 'i', _fixed(1e6, 'i', I32_NULL, 2 ** 31 - 1)),
+    ('lng', 'i', _fixed(1e6, 'i', I32_NULL, 2 ** 31 - 1)),
+    ('accuracy', 'H', _fixed(10, 'H', U16_NULL, U16_NULL - 1)),
+    ('speed', 'H', _fixed(10, 'H', U16_NULL, U16_NULL - 1)),
+    ('heading', 'H', _fixed(10, 'H', U16_NULL, U16_NULL - 1)),
+    ('crowd', 'B', _enum(CROWD_CODES)),
+    ('type', 'B', _enum(TYPE_CODES)),
+    ('driver_name', 'H', None),
+    ('last_updated', 'I', _epoch),
+    ('offline', 'B', lambda v: U8_NULL if v is None else int(bool(v))),
+    ('progress_m', 'I', _fixed(10, 'I', U32_NULL, U32_NULL - 1)),
+    ('next_stop', 'H', None),
+    ('off_route_m', 'H', _fixed(10, 'H', U16_NULL, U16_NULL - 1)),
+)
+
+
+class _Strings:
+    def __init__(self):
+        self.index = {}
+        self.items = []
+
+    def ref(self, s):
+        if s is None:
+            return U16_NULL
+        s = str(s)
+        i = self.index.get(s)
+        if i is None:
+            if len(self.items) >= U16_NULL:  # U16_NULL itself means None
+                raise FrameTooLarge(f"more than {U16_NULL} distinct strings")
+            i = self.index[s] = len(self.items)
+            self.items.append(s)
+        return i
+
+    def pack(self):
+        out = [struct.pack('<H', len(self.items))]
+        for s in self.items:
+            b = s.encode('utf-8')
+            if len(b) > U16_NULL:
+                raise FrameTooLarge(f"string of {len(b)} bytes")
+            out.append(struct.pack('<H', len(b)))
+            out.append(b)
+        return b''.join(out)
+
+
+def encode_frame(frame, snapshot=False):
+    """Snapshot ({seq, buses}) or delta ({seq, base, changed, removed[, left]}) -> bytes."""
+    strings = _Strings()
+    rows = frame['buses'] if snapshot else frame.get('changed', {})
+
+    keys, masks = [], []
+    columns = [[] for _ in FIELDS]
+    for key, entry in rows.items():
+        keys.append(strings.ref(key))
+        mask = 0
+        for bit, (name, _, enc) in enumerate(FIELDS):
+            if name in entry:
+                mask |= 1 << bit
+                v = entry[name]
+                columns[bit].append(strings.ref(v) if enc is None else enc(v))
+        masks.append(mask)
+
+    removed = [strings.ref(k) for k in frame.get('removed', ())]
+    left = [strings.ref(k) for k in frame.get('left', ())]
+
+    n = len(keys)
+    parts = [
+        MAGIC,
+        struct.pack('<BBII', VERSION, FLAG_SNAPSHOT if snapshot else 0,
+                    frame.get('seq', 0), frame.get('base', 0) or 0),
+        strings.pack(),
+        struct.pack(f'<H{n}H{n}H', n, *keys, *masks)
+    ]
+    for (_, code, _), col in zip(FIELDS, columns):
+        if col:
+            parts.append(struct.pack(f'<{len(col)}{code}', *col))
+    parts.append(struct.pack(f'<H{len(removed)}H', len(removed), *removed))
+    parts.append(struct.pack(f'<H{len(left)}H', len(left), *left))
+    return b''.join(parts)
+
+
+def json_size(frame):
+    return len(json.dumps(frame, separators=(',', ':'), default=str).encode('utf-8'))
+
+
+class WireStats:
+    """Bytes per frame for both encodings, measured on the global tick frame."""
+
+    def __init__(self):
+        self.frames = 0
+        self.json_bytes = 0
+        self.binary_bytes = 0
+        self.last_json_bytes = 0
+        self.last_binary_bytes = 0
+        self.sent = {'json': 0, 'binary': 0}
+
+    def observe(self, json_bytes, binary_bytes):
+        self.frames += 1
+        self.json_bytes += json_bytes
+        self.binary_bytes += binary_bytes
+        self.last_json_bytes = json_bytes
+        self.last_binary_bytes = binary_bytes
+
+    def count(self, encoding):
+        self.sent[encoding] += 1
+
+    def stats(self):
+        return {
+            'frames_measured': self.frames,
+            'avg_json_bytes': round(self.json_bytes / self.frames, 1) if self.frames else 0,
+            'avg_binary_bytes': round(self.binary_bytes / self.frames, 1) if self.frames else 0,
+            'last_json_bytes': self.last_json_bytes,
+            'last_binary_bytes': self.last_binary_bytes,
+            'binary_vs_json': round(self.binary_bytes / self.json_bytes, 3) if self.json_bytes else 0,
+            'frames_sent': dict(self.sent)
+        }
@@ -2,7 +2,8 @@ export let map = null;
 export let markers = {};
 export let ALL_STOPS_CACHE = []; // Global Cache
 export let ALL_BUSES_CACHE = {}; // Global Cache
-const socket = io();
+const socket = io({ query: { role: 'admin' } });
+let fleetSeq = null; // Sequence number of the fleet view in ALL_BUSES_CACHE
 
 export function initMap() {
     // Center on Bhubaneswar
@@ -18,11 +19,14 @@ export function initMap() {
 
     setupSocketListeners();
 
+    // Only receive buses near what is on screen
+    map.on('moveend', scheduleViewportUpdate);
+
     // Fetch Stops Overlay
     fetchStops();
 
     // Request initial data (in case we missed the 'connect' event)
-    socket.emit('get_buses');
+    sendViewport();
 
     // Initialize Search
     setupSearchListeners();
@@ -101,15 +105,62 @@ async function fetchStops() {
     }
 }
 
+// VIEWPORT SUBSCRIPTION (server sends only buses in padded view)
+let viewportTimer = null;
+
+const VIEWPORT_MIN_ZOOM = 10; // Zoomed further out: take the global feed
+
+function sendViewport() {
+    if (!map) return;
+    if (map.getZoom() < VIEWPORT_MIN_ZOOM) {
+        socket.emit('unsubscribe_viewport'); // No-op unless subscribed
+        return;
+    }
+    const b = map.getBounds().pad(0.25);
+    socket.emit('subscribe_viewport', {
+        south: b.getSouth(),
+        west: b.getWest(),
+        north: b.getNorth(),
+        east: b.getEast()
+    });
+}
+
+function scheduleViewportUpdate() {
+    clearTimeout(viewportTimer);
+    viewportTimer = setTimeout(sendViewport, 300); // Debounce pan/zoom
+}
+
 function setupSocketListeners() {
     console.log("[MAP] Setting up socket listeners...");
 
     socket.on('connect', () => {
         console.log("[SOCKET] Connected to server. ID:", socket.id);
+        sendViewport(); // Subscriptions do not survive a reconnect
+    });
+
+    socket.on('fleet_snapshot', (snapshot) => {
+        console.log("[SOCKET] Received fleet snapshot:", snapshot);
+        fleetSeq = snapshot.seq;
+        updateMarkers(snapshot.buses);
+        updateBusList(snapshot.buses);
     });
 
-    socket.on('update_buses', (data) => {
-        console.log("[SOCKET] Received bus update:", data);
+    socket.on('bus_delta', (delta) => {
+        if (fleetSeq === null || delta.seq <= fleetSeq) return;
+        if (delta.base !== fleetSeq) {
+            // Missed a delta -> ask for a fresh snapshot
+            fleetSeq = null;
+            socket.emit('fleet_resync');
+            return;
+        }
+        fleetSeq = delta.seq;
+
+        const data = { ...ALL_BUSES_CACHE };
+        // 'removed' = gone from the fleet, 'left' = moved out of our viewport
+        [...(delta.removed || []), ...(delta.left || [])].forEach(busId => { delete data[busId]; });
+        Object.entries(delta.changed || {}).forEach(([busId, fields]) => {
+            data[busId] = Object.assign({}, data[busId], fields);
+        });
         updateMarkers(data);
         updateBusList(data);
     });
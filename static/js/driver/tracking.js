@@ -4,7 +4,7 @@ let map = null;
 let userMarker = null;
 let watchId = null;
 let isSharing = false;
-const socket = io(); // Singleton
+const socket = io({ query: { role: 'driver' } }); // Singleton
 let studentMarkers = {};
 let stopMarkers = {}; // NEW: Cache for stop markers
 let activeBusNo = null;
@@ -12,25 +12,36 @@ let currentBusFilter = '';
 let currentCrowdStatus = 'LOW';
 let currentServiceType = 'HOSTEL'; // NEW STATE
 
+// Adaptive ping rate: the server sends the interval to use (slow when parked)
+let pingIntervalMs = 3000;
+let lastEmitAt = 0;
+let lastEmitState = '';
+let lastEmitPos = null;
+const PING_BYPASS_M = 25; // Moving off a long (parked) interval is sent immediately
+
+function movedMeters(a, b) {
+    const dy = (b[0] - a[0]) * 110540;
+    const dx = (b[1] - a[1]) * 111320 * Math.cos(a[0] * Math.PI / 180);
+    return Math.hypot(dx, dy);
+}
+
 
+// Driver console never renders other buses: opt out of fleet frames
+socket.on('connect', () => socket.emit('leave_fleet'));
+
+socket.on('ping_interval', (data) => {
+    if (data && data.interval_ms > 0) pingIntervalMs = data.interval_ms;
+});
 
 // Listen for student updates
+// Server only relays students tracking MY bus (bus room joined on first driver_update)
 socket.on('student_location_update', (data) => {
-    console.log("[DRIVER] Received student update:", data, "Active Bus:", activeBusNo);
-    if (!isSharing || !map || !activeBusNo) {
-        console.log("[DRIVER] ignored (not sharing or no map)");
-        return;
-    }
+    if (!isSharing || !map || !activeBusNo) return;
 
-    // Filter: Only show students tracking MY bus
-    // Robust comparison: Trim and Upper Case
+    // Guard against stragglers from a previous session's bus
     const updateBus = String(data.bus_no).trim().toUpperCase();
     const myBus = String(activeBusNo).trim().toUpperCase();
-
-    if (updateBus !== myBus) {
-        console.log(`[DRIVER] ignored (Bus mismatch: '${updateBus}' != '${myBus}')`);
-        return;
-    }
+    if (updateBus !== myBus) return;
 
     // Render Marker
     if (studentMarkers[data.id]) {
@@ -306,7 +317,17 @@ function handleGPS(pos, busNo, stage) {
         }
     }
 
+    // Throttle to the server's ping interval; crowd/type changes and real
+    // movement after a parked stretch go out at once
+    const state = `${currentCrowdStatus}|${currentServiceType}`;
+    const now = Date.now();
+    const moved = lastEmitPos ? movedMeters(lastEmitPos, [latitude, longitude]) : Infinity;
+    if (socket.connected && state === lastEmitState && now - lastEmitAt < pingIntervalMs && moved < PING_BYPASS_M) return;
+
     if (socket.connected) {
+        lastEmitAt = now;
+        lastEmitState = state;
+        lastEmitPos = [latitude, longitude];
         socket.emit('driver_update', {
             lat: latitude,
             lng: longitude,
@@ -343,6 +364,7 @@ export function stopSession() {
     if (watchId) navigator.geolocation.clearWatch(watchId);
     watchId = null; isSharing = false;
     hasCentered = false; // Reset for next session logic
+    lastEmitAt = 0; lastEmitState = ''; lastEmitPos = null;
     socket.emit('driver_update', null);
 
     // Reset UI
@@ -132,7 +132,7 @@ onAuthStateChanged(auth, (user) => {
 });
 
 // Keep Socket connection alive
-const socket = io();
+const socket = io({ query: { role: 'student' } });
 
 // Listen for Notification Permission (from popup or button)
 window.addEventListener('notification-permission-granted', () => {
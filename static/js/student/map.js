@@ -16,9 +16,10 @@ let stopMarkers = {}; // NEW: Cache for active stop markers
 let fallbackLine = null;
 let routingTimer = null; // Internal timer
 let lastBusData = {};
+let fleetSeq = null; // Sequence number of the fleet view in lastBusData
 let currentBusFilter = '';
 let speedHistory = {}; // NEW: { busId: [speed1, speed2, ...] }
-const socket = io();
+const socket = io({ query: { role: 'student' } });
 
 let userVotes = new Set(); // Track user's active votes
 
@@ -81,13 +82,127 @@ export function initMap() {
     }
 
     setupSocketListeners();
+
+    // Only receive buses near what is on screen
+    map.on('moveend', scheduleViewportUpdate);
+    if (socket.connected) sendViewport();
+}
+
+// --- Viewport Subscription (server sends only buses in padded view) ---
+let viewportTimer = null;
+
+const VIEWPORT_MIN_ZOOM = 10; // Zoomed further out: take the global feed
+
+function sendViewport() {
+    if (!map) return;
+    if (map.getZoom() < VIEWPORT_MIN_ZOOM) {
+        socket.emit('unsubscribe_viewport'); // No-op unless subscribed
+        return;
+    }
+    const b = map.getBounds().pad(0.25);
+    socket.emit('subscribe_viewport', {
+        south: b.getSouth(),
+        west: b.getWest(),
+        north: b.getNorth(),
+        east: b.getEast()
+    });
+}
+
+function scheduleViewportUpdate() {
+    clearTimeout(viewportTimer);
+    viewportTimer = setTimeout(sendViewport, 300); // Debounce pan/zoom
+}
+
+// --- Compact Binary Fleet Frames (see server/wire.py for the layout) ---
+const BINARY_WIRE = typeof DataView !== 'undefined' && typeof TextDecoder !== 'undefined';
+const WIRE_CROWD = ['LOW', 'MED', 'HIGH'];
+const WIRE_TYPE = ['HOSTEL', 'DAY_SCHOLAR'];
+const WIRE_FIELDS = ['bus_no', 'lat', 'lng', 'accuracy', 'speed', 'heading', 'crowd', 'type', 'driver_name', 'last_updated', 'offline', 'progress_m', 'next_stop', 'off_route_m'];
+
+function decodeFleetFrame(buffer) {
+    const view = new DataView(buffer instanceof ArrayBuffer ? buffer : buffer.buffer, buffer.byteOffset || 0);
+    const utf8 = new TextDecoder();
+    let pos = 0;
+    const u8 = () => view.getUint8(pos++);
+    const u16 = () => { const v = view.getUint16(pos, true); pos += 2; return v; };
+    const u32 = () => { const v = view.getUint32(pos, true); pos += 4; return v; };
+    const i32 = () => { const v = view.getInt32(pos, true); pos += 4; return v; };
+
+    pos = 2; // 'BF'
+    u8(); // version
+    const snapshot = (u8() & 1) === 1;
+    const seq = u32();
+    const base = u32();
+
+    const strings = [];
+    for (let n = u16(); n > 0; n--) {
+        const len = u16();
+        strings.push(utf8.decode(new Uint8Array(view.buffer, view.byteOffset + pos, len)));
+        pos += len;
+    }
+    const str = (i) => (i === 0xFFFF ? null : strings[i]);
+    const tenths = (v) => (v === 0xFFFF ? null : v / 10);
+    const readers = [
+        () => str(u16()),
+        () => { const v = i32(); return v === -2147483648 ? null : v / 1e6; },
+        () => { const v = i32(); return v === -2147483648 ? null : v / 1e6; },
+        () => tenths(u16()),
+        () => tenths(u16()),
+        () => tenths(u16()),
+        () => { const v = u8(); return v === 0xFF ? null : WIRE_CROWD[v]; },
+        () => { const v = u8(); return v === 0xFF ? null : WIRE_TYPE[v]; },
+        () => str(u16()),
+        // Naive UTC ISO string, like the JSON feed (callers append "Z")
+        () => { const v = u32(); return v === 0 ? null : new Date(v * 1000).toISOString().slice(0, -1); },
+        () => { const v = u8(); return v === 0xFF ? null : v === 1; },
+        () => { const v = u32(); return v === 0xFFFFFFFF ? null : v / 10; },
+        () => str(u16()),
+        () => tenths(u16())
+    ];
+
+    const rows = u16();
+    const keys = [], masks = [];
+    for (let i = 0; i < rows; i++) keys.push(str(u16()));
+    for (let i = 0; i < rows; i++) masks.push(u16());
+    const entries = keys.map(() => ({}));
+    WIRE_FIELDS.forEach((field, bit) => {
+        for (let i = 0; i < rows; i++) {
+            if (masks[i] & (1 << bit)) entries[i][field] = readers[bit]();
+        }
+    });
+    const changed = {};
+    keys.forEach((key, i) => { changed[key] = entries[i]; });
+
+    const readKeys = () => { const out = []; for (let n = u16(); n > 0; n--) out.push(str(u16())); return out; };
+    const removed = readKeys();
+    const left = readKeys();
+
+    if (snapshot) return { seq, buses: changed };
+    return { seq, base, changed, removed, left };
 }
 
 function setupSocketListeners() {
-    socket.on('connect', () => updateServerStatus(true));
+    socket.on('connect', () => {
+        updateServerStatus(true);
+        // Encoding is per socket: negotiate before the viewport snapshot
+        if (BINARY_WIRE) socket.emit('set_encoding', { encoding: 'binary' });
+        // Rooms do not survive a reconnect: re-join the tracked bus room
+        if (targetBusNo) socket.emit('track_bus', { bus_no: targetBusNo });
+        sendViewport();
+    });
     socket.on('disconnect', () => updateServerStatus(false));
 
-    socket.on('update_buses', (data) => {
+    // Full fleet view (on connect, get_buses or resync)
+    socket.on('fleet_snapshot', applyFleetSnapshot);
+    socket.on('fleet_snapshot_bin', (buf) => applyFleetSnapshot(decodeFleetFrame(buf)));
+
+    // Incremental changes: only the fields that changed since `base`
+    socket.on('bus_delta', applyBusDelta);
+    socket.on('bus_delta_bin', (buf) => applyBusDelta(decodeFleetFrame(buf)));
+
+    function applyFleetSnapshot(snapshot) {
+        fleetSeq = snapshot.seq;
+        const data = snapshot.buses;
         lastBusData = data;
 
         // 1. Update Map Markers (Always show all on map)
@@ -107,7 +222,36 @@ function setupSocketListeners() {
 
         // 3. Render Sidebar List
         renderBusList();
-    });
+    }
+
+    function applyBusDelta(delta) {
+        if (fleetSeq === null) return; // Snapshot pending
+        if (delta.seq <= fleetSeq) return; // Already covered by snapshot
+        if (delta.base !== fleetSeq) {
+            // Missed a delta -> ask for a fresh snapshot
+            console.warn(`[SOCKET] Delta gap (have ${fleetSeq}, got base ${delta.base}). Resyncing...`);
+            fleetSeq = null;
+            socket.emit('fleet_resync');
+            return;
+        }
+        fleetSeq = delta.seq;
+
+        // 'removed' = gone from the fleet, 'left' = moved out of our viewport
+        [...(delta.removed || []), ...(delta.left || [])].forEach(busId => {
+            delete lastBusData[busId];
+            if (markers[busId]) {
+                map.removeLayer(markers[busId]);
+                delete markers[busId];
+            }
+        });
+
+        Object.entries(delta.changed || {}).forEach(([busId, fields]) => {
+            lastBusData[busId] = Object.assign(lastBusData[busId] || {}, fields);
+            updateBusMarker(busId, lastBusData[busId]);
+        });
+
+        renderBusList();
+    }
 
     // --- NEW: Handle Explicit Disconnect ---
     socket.on('bus_disconnected', (sid) => {
@@ -470,6 +614,9 @@ export function startTrackingRouteByBusNo(busNo) {
     targetBusNo = busNo;   // Set Truth
     targetBusId = null;    // Reset Socket ID (will find if online)
 
+    // Join this bus room (stop counts + driver relay are scoped to it)
+    socket.emit('track_bus', { bus_no: busNo });
+
     // 1. Activate Split Screen Mode
     const mapContainer = document.getElementById('map-container');
     const routePanel = document.getElementById('route-panel');
@@ -724,6 +871,9 @@ export function stopTrackingRoute() {
         targetBusId = null;
     }
 
+    // Leave the bus room
+    socket.emit('untrack_bus');
+
     // Release Wake Lock
     releaseWakeLock();
     window.notifiedProximityBusId = null;
@@ -159,11 +159,18 @@ export class BusStopSearch {
             // Only search API if query length >= 1
             if (query.length >= 1) {
                 try {
-                    const response = await fetch(`/api/search_stops?q=${encodeURIComponent(query)}`);
-                    const data = await response.json();
-                    // Backend returns direct array of results
-                    if (Array.isArray(data) && data.length > 0) {
-                        stopResults = data.map(r => ({ ...r, type: 'stop' }));
+                    // Prefix autocomplete first (popular stops on top); fuzzy search only on a miss (typos)
+                    const acResponse = await fetch(`/api/autocomplete?q=${encodeURIComponent(query)}&k=10`);
+                    const acData = await acResponse.json();
+                    if (acData.success && acData.suggestions.length > 0) {
+                        stopResults = acData.suggestions.map(r => ({ ...r, type: 'stop' }));
+                    } else {
+                        const response = await fetch(`/api/search_stops?q=${encodeURIComponent(query)}`);
+                        const data = await response.json();
+                        // Backend returns direct array of results
+                        if (Array.isArray(data) && data.length > 0) {
+                            stopResults = data.map(r => ({ ...r, type: 'stop' }));
+                        }
                     }
                 } catch (e) {
                     console.warn("Stop search API failed", e);